@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Assembly generation benchmark.
+#
+# Compiles the synthetic program of bench/memory.py (default 1M ops) to
+# assembly and reports the time compile() takes and the size of the .asm file,
+# with and without comments and unreferenced labels. Then compares the time to
+# an executable with nasm and ld (if nasm is installed) to the -elf backend.
+#
+# Usage: ./bench/asm.py [-n <ops>]
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import tau_compiler as tau
+from memory import DEFAULT_OPS, generate_program
+
+def bench(name: str, program: tau.Program, **options):
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_file_path = path.join(out_dir, 'bench.asm')
+        start = perf_counter()
+        tau.compile(program, out_file_path, **options)
+        elapsed = perf_counter() - start
+        size = os.stat(out_file_path).st_size
+    print("%-10s %8.3f s  %8.1f MiB" % (name, elapsed, size / 1024 / 1024))
+
+def bench_executable(name: str, program: tau.Program, direct_elf: bool, optimization_level: int):
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_file_path = path.join(out_dir, 'bench')
+        start = perf_counter()
+        if direct_elf:
+            tau.compile_elf(program, out_file_path, optimization_level=optimization_level)
+        else:
+            tau.compile(program, out_file_path + '.asm', comments=False, all_labels=False, optimization_level=optimization_level)
+            subprocess.run(['nasm', '-felf64', out_file_path + '.asm'], check=True)
+            subprocess.run(['ld', '-o', out_file_path, out_file_path + '.o'], check=True)
+        elapsed = perf_counter() - start
+        size = os.stat(out_file_path).st_size
+    print("%-10s %8.3f s  %8.1f MiB executable" % (name, elapsed, size / 1024 / 1024))
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    ops = DEFAULT_OPS
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-n':
+            arg, *argv = argv
+            ops = int(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+
+    program = tau.compile_tokens(tau.lex_text('<synthetic>', generate_program(ops)), tau.IncludeResolver([]), tau.DEFAULT_EXPANSION_LIMIT)
+    print("%d ops" % len(program))
+    bench('default', program)
+    bench('compact', program, comments=False, all_labels=False)
+    bench('-O1', program, optimization_level=1)
+    for optimization_level in [0, 2]:
+        if shutil.which('nasm') is not None:
+            bench_executable('nasm -O%d' % optimization_level, program, False, optimization_level)
+        bench_executable('elf -O%d' % optimization_level, program, True, optimization_level)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Synthetic program generator for the scaling tests of the front end.
+#
+# Generates valid, type correct tau programs of a given shape: about N ops of
+# statements nested D blocks deep, M macros each used K times and a tree of F
+# files where every file includes up to W others. The statements leave the
+# stack as they found it, so the programs also run. The macros are defined by
+# the main file and used by all of them. Every file gets its share of the ops
+# and of the macro uses.
+#
+# Usage: ./bench/generate.py [-n <ops>] [-depth <D>] [-macros <M>] [-uses <K>] [-files <F>] [-fanout <W>] [-seed <n>] -o <dir>
+
+import os
+import sys
+import random
+from os import path
+from dataclasses import dataclass
+from typing import *
+
+@dataclass(slots=True)
+class Shape:
+    ops: int = 10_000
+    depth: int = 4
+    macros: int = 50
+    uses: int = 10
+    files: int = 1
+    fanout: int = 4
+    seed: int = 0
+
+MAIN_FILE = 'main.tau'
+
+# (source, ops) of statements with no effect on the stack
+def statement(rng: random.Random) -> Tuple[str, int]:
+    a, b, c = rng.randint(0, 1000), rng.randint(1, 1000), rng.randint(0, 63)
+    kind = rng.randrange(5)
+    if kind == 0:
+        return '%d %d + %d * drop' % (a, b, c), 6
+    elif kind == 1:
+        return '%d %d < if %d drop else %d drop end' % (a, b, c, a), 10
+    elif kind == 2:
+        return '0 while dup %d < do 1 + end drop' % (c % 4), 9
+    elif kind == 3:
+        return 'bit %d + %d .' % (a, c), 5
+    else:
+        return '%d dup %d divmod drop drop drop' % (a, b), 7
+
+# (opening, closing, ops) of the blocks the statements are nested in
+def block(rng: random.Random) -> Tuple[str, str, int]:
+    if rng.randrange(2) == 0:
+        return '1 1 = if', 'end', 5
+    return '0 while dup 1 < do', '1 + end drop', 10
+
+def macro_name(i: int) -> str:
+    return 'm%d' % i
+
+# deeper blocks are not indented further, so the bytes per op don't grow with the depth
+MAX_INDENT = 4
+
+def indentation(level: int) -> str:
+    return '  ' * min(level, MAX_INDENT)
+
+def file_name(i: int) -> str:
+    return MAIN_FILE if i == 0 else 'include/f%d.tau' % i
+
+def generate_file(rng: random.Random, ops: int, depth: int, calls: List[Tuple[str, int]]) -> List[str]:
+    '''Statements of about `ops` ops in chunks nested `depth` blocks deep, with all the macro `calls` among them.
+    The calls that don't fit in the chunks come at the end, so they can make the file bigger than `ops`.'''
+    lines: List[str] = []
+    count = 0
+    while count < ops:
+        closing: List[str] = []
+        for level in range(depth):
+            opening, close, block_ops = block(rng)
+            lines.append(indentation(level) + opening)
+            closing.append(close)
+            count += block_ops
+        indent = indentation(depth)
+        for _ in range(3):
+            if len(calls) > 0 and rng.randrange(2) == 0:
+                name, call_ops = calls.pop()
+                lines.append(indent + name)
+                count += call_ops
+            else:
+                source, statement_ops = statement(rng)
+                lines.append(indent + source)
+                count += statement_ops
+        for level, close in reversed(list(enumerate(closing))):
+            lines.append(indentation(level) + close)
+    lines.extend(name for name, _ in calls)
+    return lines
+
+def generate(shape: Shape) -> Dict[str, str]:
+    '''Sources of the program by their path relative to the directory of the main file'''
+    rng = random.Random(shape.seed)
+    definitions: List[str] = []
+    bodies: List[Tuple[str, int]] = []
+    for i in range(shape.macros):
+        source, ops = statement(rng)
+        definitions.append('macro %s %s end' % (macro_name(i), source))
+        bodies.append((macro_name(i), ops))
+    calls = bodies * shape.uses
+    rng.shuffle(calls)
+
+    sources: Dict[str, str] = {}
+    for i in range(shape.files):
+        # every file gets its share of the calls, the main one the rest
+        share = len(calls) // (shape.files - i)
+        file_calls, calls = calls[:share], calls[share:]
+        lines: List[str] = []
+        if i == 0:
+            lines.extend(definitions)
+        children = range(i * shape.fanout + 1, min(shape.files, (i + 1) * shape.fanout + 1))
+        lines.extend('include "%s"' % file_name(child) for child in children)
+        lines.extend(generate_file(rng, shape.ops // shape.files, shape.depth, file_calls))
+        sources[file_name(i)] = '\n'.join(lines) + '\n'
+    return sources
+
+def write_program(shape: Shape, out_dir: str) -> str:
+    '''Write the program into `out_dir` and return the path of its main file'''
+    for name, source in generate(shape).items():
+        file_path = path.join(out_dir, name)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(source)
+    return path.join(out_dir, MAIN_FILE)
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    shape = Shape()
+    out_dir = None
+    flags = {'-n': 'ops', '-depth': 'depth', '-macros': 'macros', '-uses': 'uses', '-files': 'files', '-fanout': 'fanout', '-seed': 'seed'}
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg in flags:
+            value, *argv = argv
+            setattr(shape, flags[arg], int(value))
+        elif arg == '-o':
+            out_dir, *argv = argv
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+    if out_dir is None:
+        print("[ERROR] no output directory is provided with -o", file=sys.stderr)
+        exit(1)
+    print(write_program(shape, out_dir))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Include benchmark over diamond shaped include graphs.
+#
+# Generates a tree of files in a temporary directory where every file of level
+# i includes every file of level i+1, and the last level includes a common std
+# file. Then compiles the root with and without -include-once and reports the
+# compile time, the number of includes and the number of tokens they spliced
+# into the program.
+#
+# Usage: ./bench/include.py [-levels <n>] [-width <n>]
+
+import sys
+import tempfile
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import tau_compiler as tau
+
+DEFAULT_LEVELS = 6
+DEFAULT_WIDTH = 3
+OPS_PER_FILE = 50
+
+def generate_graph(root_dir: str, levels: int, width: int) -> str:
+    with open(path.join(root_dir, 'std.tau'), 'w') as f:
+        f.write('1 2 + drop\n' * OPS_PER_FILE)
+    for level in reversed(range(levels)):
+        for i in range(width):
+            with open(path.join(root_dir, 'level%d_%d.tau' % (level, i)), 'w') as f:
+                if level + 1 < levels:
+                    for j in range(width):
+                        f.write('include "level%d_%d.tau"\n' % (level + 1, j))
+                else:
+                    f.write('include "std.tau"\n')
+                f.write('1 2 + drop\n' * OPS_PER_FILE)
+    main_path = path.join(root_dir, 'main.tau')
+    with open(main_path, 'w') as f:
+        for i in range(width):
+            f.write('include "level0_%d.tau"\n' % i)
+    return main_path
+
+def bench(main_path: str, include_once: bool):
+    resolver = tau.IncludeResolver([path.dirname(main_path)], include_once)
+    resolver.included.add(path.realpath(main_path))
+    start = perf_counter()
+    program = tau.compile_tokens(tau.lex_file(main_path), resolver, tau.DEFAULT_EXPANSION_LIMIT)
+    elapsed = perf_counter() - start
+    print("include-once=%-5s %8.3f s  %8d includes  %10d tokens  %10d ops  %4d files lexed" % (include_once, elapsed, resolver.include_count, resolver.token_count, len(program), len(resolver.lexed)))
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    levels = DEFAULT_LEVELS
+    width = DEFAULT_WIDTH
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-levels':
+            arg, *argv = argv
+            levels = int(arg)
+        elif arg == '-width':
+            arg, *argv = argv
+            width = int(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+
+    tau.lex_cache_dir = None
+    with tempfile.TemporaryDirectory() as root_dir:
+        main_path = generate_graph(root_dir, levels, width)
+        print("%d levels of %d files" % (levels, width))
+        bench(main_path, False)
+        bench(main_path, True)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Lexer throughput benchmark.
+#
+# Runs the old per-line lexer (lex_lines) and the single pass lexer (lex_text)
+# over the same sources, checks that they produce identical token streams and
+# reports throughput of both in lines/sec.
+#
+# Usage: ./bench/lex.py [-n <lines>] [files...]
+
+import sys
+import random
+import tempfile
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import tau_compiler as tau
+
+DEFAULT_LINES = 200_000
+RUNS = 3
+
+def generate_source(lines: int, seed: int = 69) -> str:
+    rng = random.Random(seed)
+    words = list(tau.INTRINSIC_BY_NAMES.keys()) + list(tau.KEYWORD_NAMES.keys()) + ['foo', 'bar-baz', '2dup', 'a"b', "x'y"]
+    out = []
+    row = 0
+    while row < lines:
+        kind = rng.randrange(10)
+        if kind == 0:
+            out.append('"hello, %d\\n" stdout write drop // comment %d\n' % (row, row))
+        elif kind == 1:
+            out.append("'a' '\\n' ' ' %d -%d +%d 1_000 0%d\n" % (row, row, row, row))
+        elif kind == 2:
+            out.append('"multi\n  line \\" string"   dup\n')
+            row += 1
+        elif kind == 3:
+            out.append('    \t  \n')
+        else:
+            out.append('    ' + ' '.join(rng.choice(words) for _ in range(rng.randrange(1, 12))) + '\n')
+        row += 1
+    return ''.join(out)
+
+def lex_old(file_path: str, text: str) -> list:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return list(tau.lex_lines(file_path, f.readlines()))
+
+def best_of(runs: int, f) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        start = perf_counter()
+        f()
+        best = min(best, perf_counter() - start)
+    return best
+
+def bench_file(file_path: str):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    lines = text.count('\n') + (0 if text.endswith('\n') else 1)
+
+    old_tokens = lex_old(file_path, text)
+    new_tokens = tau.lex_text(file_path, text)
+    if old_tokens != new_tokens:
+        for i, (a, b) in enumerate(zip(old_tokens, new_tokens)):
+            if a != b:
+                print("[ERROR] %s: token %d differs:\n  lex_lines: %s\n  lex_text:  %s" % (file_path, i, a, b), file=sys.stderr)
+                break
+        else:
+            print("[ERROR] %s: token count differs: %d vs %d" % (file_path, len(old_tokens), len(new_tokens)), file=sys.stderr)
+        exit(1)
+
+    old_time = best_of(RUNS, lambda: lex_old(file_path, text))
+    new_time = best_of(RUNS, lambda: tau.lex_text(file_path, text))
+    print("%s: %d lines, %d tokens, identical" % (file_path, lines, len(new_tokens)))
+    print("    lex_lines: %10.0f lines/sec" % (lines / old_time))
+    print("    lex_text:  %10.0f lines/sec (%.2fx)" % (lines / new_time, old_time / new_time))
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    lines = DEFAULT_LINES
+    files = []
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-n':
+            arg, *argv = argv
+            lines = int(arg)
+        else:
+            files.append(arg)
+
+    if len(files) == 0:
+        root = path.dirname(path.dirname(path.abspath(__file__)))
+        files = [path.join(root, 'core', 'std.tau'), path.join(root, 'test.tau')]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            synthetic = path.join(tmp_dir, 'lex_synthetic.tau')
+            with open(synthetic, 'w', encoding='utf-8') as f:
+                f.write(generate_source(lines))
+            files.append(synthetic)
+            for file_path in files:
+                bench_file(file_path)
+    else:
+        for file_path in files:
+            bench_file(file_path)
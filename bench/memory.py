@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Front end memory benchmark.
+#
+# Generates a synthetic program of roughly N ops (default 1M) that leans on
+# macro expansion, runs it through lex_text(), compile_tokens() and
+# type_check_program() and reports the peak RSS of the process. With
+# -tracemalloc it also reports the peak traced Python memory, which is a lot
+# slower.
+#
+# Usage: ./bench/memory.py [-n <ops>] [-tracemalloc]
+
+import sys
+import resource
+import tracemalloc
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import tau_compiler as tau
+
+DEFAULT_OPS = 1_000_000
+
+MACROS = '''macro inc 1 + end
+macro dec 1 - end
+macro square dup * end
+macro mix inc square dec 2 divmod + end
+'''
+# `mix` expands to 9 ops, the whole line to 20. Call sites are not ops.
+LINE = '0 inc mix 7 swap drop inc 3 * drop\n'
+OPS_PER_LINE = 20
+
+def generate_program(ops: int) -> str:
+    return MACROS + LINE * (ops // OPS_PER_LINE)
+
+def mib(n: int) -> float:
+    return n / 1024 / 1024
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    ops = DEFAULT_OPS
+    trace = False
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-n':
+            arg, *argv = argv
+            ops = int(arg)
+        elif arg == '-tracemalloc':
+            trace = True
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+
+    text = generate_program(ops)
+    if trace:
+        tracemalloc.start()
+    start = perf_counter()
+    tokens = tau.lex_text('<synthetic>', text)
+    program = tau.compile_tokens(tokens, tau.IncludeResolver([]), tau.DEFAULT_EXPANSION_LIMIT)
+    tau.type_check_program(program)
+    elapsed = perf_counter() - start
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print("ops:              %d" % len(program))
+    print("front end time:   %.2f s" % elapsed)
+    if trace:
+        print("tracemalloc peak: %.1f MiB" % mib(peak))
+    # ru_maxrss is in KiB on Linux
+    print("peak RSS:         %.1f MiB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
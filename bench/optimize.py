@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# Optimization levels check and runtime benchmark.
+#
+# Compiles the examples and a set of small programs that cover every intrinsic
+# at every optimization level with nasm and with the -elf backend, runs them and
+# checks that their output and exit code are the same as at -O0 with nasm, and
+# that `tau.py sim` gives the same. With -profile, checks that the number of
+# runs of every op and the totals of the .folded stacks of the executables at
+# every level and backend are the ones of `tau.py sim -profile`, of the program
+# after fold_constants() from -O1 on. Then compiles a few loop heavy programs at every
+# level and reports their run time, the number of instructions in their
+# assembly and the number of instructions they execute on a smaller input,
+# counted by single stepping them with ptrace(2) (Linux x86-64 only). Needs
+# nasm and ld like `tau.py com` does.
+#
+# Usage: ./bench/optimize.py [-check] [-bench] [-runs <n>]
+
+import os
+import sys
+import ctypes
+import subprocess
+import tempfile
+from os import path
+from time import perf_counter
+from typing import *
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+TAU = path.join(ROOT, 'tau.py')
+sys.path.insert(0, ROOT)
+import tau_compiler as tau
+import tau_sim
+
+LEVELS = ['-O0', '-O1', '-O2']
+# name -> flags of `com`
+BACKENDS = {'nasm': [], 'elf': ['-elf']}
+DEFAULT_RUNS = 3
+
+# name -> (source, stdin, extra compiler flags, program arguments)
+EXAMPLES: Dict[str, Tuple[str, bytes, List[str], List[str]]] = {
+    # the examples end with `0 exit`, which leaves the syscall result on the stack
+    'name': (open(path.join(ROOT, 'example', 'name.tau')).read(), b'tau\n', ['-unsafe'], []),
+}
+
+PROGRAMS: Dict[str, Tuple[str, bytes, List[str], List[str]]] = {
+    'arithmetic': ('''include "core/std.tau"
+20 10 - prn 20 10 + prn 20 10 * prn 20 3 divmod prn prn
+1 3 << prn 64 2 >> prn 12 10 or prn 12 10 and prn 0 not prn
+-5 3 + prn 3 -5 - prn 2147483647 1 + prn -2147483648 1 - prn
+4294967296 1 + prn 1 4294967296 + prn 9223372036854775807 prn
+7 dup dup * * prn 100 7 divmod + prn
+0 exit drop
+''', b'', [], []),
+    'compare': ('''include "core/std.tau"
+1 2 = if 1 prn else 0 prn end
+2 2 = if 1 prn else 0 prn end
+1 2 != if 1 prn else 0 prn end
+1 2 < if 1 prn else 0 prn end
+2 1 < if 1 prn else 0 prn end
+1 2 > if 1 prn else 0 prn end
+2 1 > if 1 prn else 0 prn end
+2 2 <= if 1 prn else 0 prn end
+3 2 <= if 1 prn else 0 prn end
+2 2 >= if 1 prn else 0 prn end
+1 2 >= if 1 prn else 0 prn end
+1 2 < if 2 3 < if 5 prn end end
+0 exit drop
+''', b'', [], []),
+    'stack': ('''include "core/std.tau"
+1 2 swap prn prn
+1 2 over prn prn prn
+1 2 3 rot prn prn prn
+4 dup + prn
+5 6 drop prn
+1 2 2dup + + + prn
+0 exit drop
+''', b'', [], []),
+    'memory': ('''include "core/std.tau"
+bit 65 .
+bit 1 + 66 .
+bit , prn
+bit 1 + , prn
+bit 8 + 1234567890123 .64
+bit 8 + ,64 prn
+bit 8 + ,64 1 + prn
+2 bit stdout write drop
+0 exit drop
+''', b'', [], []),
+    'strings': ('''include "core/std.tau"
+"hello\\n" stdout write drop
+"" stdout write drop
+here stdout write drop
+"\\n" stdout write drop
+0 exit drop
+''', b'', [], []),
+    'args': ('''include "core/std.tau"
+argc prn
+argv 8 + ,64 cast(ptr) , prn
+argv 16 + ,64 cast(ptr) , prn
+0 exit drop
+''', b'', [], ['abc', 'xyz']),
+    'loops': ('''include "core/std.tau"
+1 while dup 30 <= do
+  dup 15 divmod swap drop 0 = if
+    15 prn
+  else dup 3 divmod swap drop 0 = if
+    3 prn
+  else dup 5 divmod swap drop 0 = if
+    5 prn
+  else
+    dup prn
+  end end end
+  1 +
+end drop
+0 0 while dup 5 < do
+  0 while dup 4 < do
+    rot 1 + rot rot
+    1 +
+  end drop
+  1 +
+end drop prn
+0 while dup 3 < do 1 + end while dup 6 < do 1 + end prn
+0 while dup 5 < if 1 else 0 end 1 = do 1 + end prn
+10 while dup 10 < do 1 + end prn
+0 while 1 + dup 7 < do end prn
+0 exit drop
+''', b'', [], []),
+    'constants': ('''include "core/std.tau"
+0 1 - prn 0 1 - 1 >> prn 1 63 << prn 1 64 << prn 1 65 << prn
+-1 2 divmod prn prn -1 1 > if 1 prn else 0 prn end
+1 2 < if
+  0 while dup 3 < do dup prn 1 + end drop
+else
+  4 prn
+end
+1 2 > if 5 prn else 3 4 < if 6 prn end end
+2 1 > if 0 while dup 2 < do 1 + end prn end
+1 2 3 rot swap over drop drop drop prn
+0 exit drop
+''', b'', [], []),
+    'exit': ('''include "core/std.tau"
+"bye\\n" stdout write drop
+3 7 + exit drop
+''', b'', [], []),
+}
+
+# name -> (source, N for the run time, N for the executed instructions)
+BENCHMARKS: Dict[str, Tuple[str, int, int]] = {
+    'count': ('''include "core/std.tau"
+macro N %d end
+0 while dup N < do 1 + end prn
+0 exit drop
+''', 500000000, 5000),
+    'sum': ('''include "core/std.tau"
+macro N %d end
+0 0 while dup N < do
+  swap over 255 and + swap
+  1 +
+end drop prn
+0 exit drop
+''', 100000000, 2000),
+    'sieve': ('''include "core/std.tau"
+macro N %d end
+0 while dup 50 < do
+  2 while dup N < do
+    dup bit + , 0 = if
+      dup dup + while dup N < do
+        dup bit + 1 .
+        over +
+      end drop
+    end
+    1 +
+  end drop
+  1 +
+end drop
+0 2 while dup N < do
+  dup bit + , 0 = if swap 1 + swap end
+  1 +
+end drop prn
+0 exit drop
+''', 600000, 50),
+    'collatz': ('''include "core/std.tau"
+macro N %d end
+0 1 while dup N < do
+  dup while dup 1 != do
+    dup 1 and 1 = if
+      3 * 1 +
+    else
+      1 >>
+    end
+    rot 1 + rot rot
+  end drop
+  1 +
+end drop prn
+0 exit drop
+''', 300000, 30),
+    # example/seq.afl
+    'seq': ('''include "core/std.tau"
+macro N %d end
+1 while dup N <= do
+  dup prn
+  1 +
+end drop
+0 exit drop
+''', 1000000, 500),
+}
+
+def compile_program(out_dir: str, name: str, source: str, flags: List[str], level: str, backend: str = 'nasm', profile: bool = False) -> str:
+    source_path = path.join(out_dir, name + '.tau')
+    with open(source_path, 'w') as f:
+        f.write(source)
+    binary_path = path.join(out_dir, '%s%s-%s' % (name, level, backend))
+    subprocess.run([sys.executable, TAU, '-I', ROOT] + flags + ['com', '-s', level] + BACKENDS[backend] + (['-profile'] if profile else []) + ['-o', binary_path, source_path], check=True)
+    return binary_path
+
+def asm_instructions(binary_path: str) -> int:
+    with open(binary_path + '.asm') as f:
+        return sum(1 for line in f if line.startswith('    ') and not line.startswith('    ;'))
+
+def check(out_dir: str) -> bool:
+    ok = True
+    for name, (source, stdin, flags, args) in {**EXAMPLES, **PROGRAMS}.items():
+        same = True
+        expected = None
+        for backend in BACKENDS:
+            for level in LEVELS:
+                binary_path = compile_program(out_dir, name, source, flags, level, backend)
+                result = subprocess.run([binary_path] + args, input=stdin, capture_output=True)
+                if expected is None:
+                    expected = result
+                elif (result.stdout, result.returncode) != (expected.stdout, expected.returncode):
+                    print("[FAIL] %s: %s %s differs from %s nasm" % (name, level, backend, LEVELS[0]))
+                    print("  expected: %r (exit %d)" % (expected.stdout, expected.returncode))
+                    print("  actual:   %r (exit %d)" % (result.stdout, result.returncode))
+                    same = False
+        # the simulation has to behave like the executables too
+        source_path = path.join(out_dir, name + '.tau')
+        result = subprocess.run([sys.executable, TAU, '-I', ROOT] + flags + ['sim', source_path] + args, input=stdin, capture_output=True)
+        if (result.stdout, result.returncode) != (expected.stdout, expected.returncode):
+            print("[FAIL] %s: sim differs from %s nasm" % (name, LEVELS[0]))
+            print("  expected: %r (exit %d)" % (expected.stdout, expected.returncode))
+            print("  actual:   %r (exit %d)" % (result.stdout, result.returncode))
+            same = False
+        if same:
+            print("[OK]   %s" % name)
+        ok = ok and same
+    return ok
+
+def simulated_counts(program: tau.Program, source_path: str, stdin: bytes, args: List[str]) -> List[int]:
+    '''Number of runs of every op in the simulation, which runs in a child with its output to /dev/null'''
+    counts_path = source_path + '.sim-counts'
+    stdin_path = source_path + '.stdin'
+    with open(stdin_path, 'wb') as f:
+        f.write(stdin)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.dup2(os.open(stdin_path, os.O_RDONLY), 0)
+            os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+            counts = [0] * len(program)
+            tau_sim.simulate_program(program, [source_path] + args, counts=counts)
+            with open(counts_path, 'w') as f:
+                f.write(' '.join(map(str, counts)))
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    with open(counts_path) as f:
+        counts = [int(count) for count in f.read().split()]
+    os.remove(counts_path)
+    return counts
+
+def folded_total(folded_path: str) -> int:
+    with open(folded_path) as f:
+        return sum(int(line.rsplit(' ', 1)[1]) for line in f if line.strip())
+
+def exit_runs_only(program: tau.Program, native: List[int], simulated: List[int]) -> bool:
+    '''Whether the counts of an executable differ from the simulated ones only by the runs of the ops after the
+    syscall that exited, which the counter of their basic block counts too'''
+    differences = [ip for ip in range(len(program)) if native[ip] != simulated[ip]]
+    if len(differences) == 0:
+        return True
+    start = differences[0]
+    block = next(block for block in tau.control_flow_graph(program).values() if block.start <= start < block.end)
+    syscall = program[start - 1]
+    return (start > block.start and syscall.typ == tau.OpType.INTRINSIC and syscall.operand in tau.SYSCALL_INTRINSICS
+            and differences == list(range(start, block.end))
+            and all(native[ip] == simulated[ip] + 1 for ip in differences))
+
+def check_profile(out_dir: str) -> bool:
+    tau.lex_cache_dir = None
+    ok = True
+    for name, (source, stdin, flags, args) in {**EXAMPLES, **PROGRAMS}.items():
+        same = True
+        source_path = path.join(out_dir, name + '.tau')
+        with open(source_path, 'w') as f:
+            f.write(source)
+        # the include paths of `tau.py -I ROOT com`
+        program = tau.compile_file(source_path, ['.', './std/', ROOT, out_dir], tau.DEFAULT_EXPANSION_LIMIT)
+        depths = None if '-unsafe' in flags else tau.type_check_program(program)
+        # the program `com` profiles at each level
+        folded, _ = tau.fold_constants(program, depths)
+        programs = {level: program if level == LEVELS[0] else folded for level in LEVELS}
+        counts = {level: simulated_counts(programs[level], source_path, stdin, args) for level in LEVELS}
+        subprocess.run([sys.executable, TAU, '-I', ROOT] + flags + ['sim', '-profile', source_path] + args, input=stdin, capture_output=True)
+        expected_total = folded_total(path.join(out_dir, name) + tau.PROFILE_FOLDED_EXT)
+        if expected_total != sum(counts[LEVELS[0]]):
+            print("[FAIL] %s: the .folded of sim -profile has %d runs, %d ops ran" % (name, expected_total, sum(counts[LEVELS[0]])))
+            same = False
+        for backend in BACKENDS:
+            for level in LEVELS:
+                binary_path = compile_program(out_dir, name, source, flags, level, backend, profile=True)
+                subprocess.run([binary_path] + args, input=stdin, capture_output=True)
+                subprocess.run([sys.executable, TAU, 'profile', binary_path], capture_output=True, check=True)
+                actual_frames, actual = tau_sim.read_profile(binary_path)
+                expected = counts[level]
+                if actual_frames != [tau.profile_frames(op) for op in programs[level]] or not exit_runs_only(programs[level], actual, expected):
+                    print("[FAIL] %s: the -profile counts of %s %s differ from sim -profile" % (name, level, backend))
+                    print("  expected: %r" % expected)
+                    print("  actual:   %r" % actual)
+                    same = False
+                    continue
+                actual_total = folded_total(binary_path + tau.PROFILE_FOLDED_EXT)
+                if actual_total != sum(actual):
+                    print("[FAIL] %s: the .folded of %s %s has %d runs, %d ops ran" % (name, level, backend, actual_total, sum(actual)))
+                    same = False
+        if same:
+            print("[OK]   %s -profile" % name)
+        ok = ok and same
+    return ok
+
+PTRACE_TRACEME = 0
+PTRACE_SINGLESTEP = 9
+
+def executed_instructions(binary_path: str) -> int:
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.ptrace.argtypes = [ctypes.c_long, ctypes.c_long, ctypes.c_void_p, ctypes.c_void_p]
+    pid = os.fork()
+    if pid == 0:
+        libc.ptrace(PTRACE_TRACEME, 0, None, None)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+        os.execv(binary_path, [binary_path])
+    count = 0
+    _, status = os.waitpid(pid, 0)
+    while os.WIFSTOPPED(status):
+        libc.ptrace(PTRACE_SINGLESTEP, pid, None, None)
+        _, status = os.waitpid(pid, 0)
+        count += 1
+    return count
+
+def bench(out_dir: str, runs: int):
+    for name, (source, n, count_n) in BENCHMARKS.items():
+        for level in LEVELS:
+            binary_path = compile_program(out_dir, name, source % n, [], level)
+            best = float('inf')
+            for _ in range(runs):
+                start = perf_counter()
+                subprocess.run([binary_path], stdout=subprocess.DEVNULL, check=False)
+                best = min(best, perf_counter() - start)
+            instructions = asm_instructions(binary_path)
+            executed = executed_instructions(compile_program(out_dir, name, source % count_n, [], level))
+            print("%-10s %-4s %8.3f s  %6d instructions  %9d executed (N=%d)" % (name, level, best, instructions, executed, count_n))
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    do_check = False
+    do_bench = False
+    runs = DEFAULT_RUNS
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-check':
+            do_check = True
+        elif arg == '-bench':
+            do_bench = True
+        elif arg == '-runs':
+            arg, *argv = argv
+            runs = int(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+    if not do_check and not do_bench:
+        do_check = do_bench = True
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        if do_check and not (check(out_dir) and check_profile(out_dir)):
+            exit(1)
+        if do_bench:
+            bench(out_dir, runs)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Benchmark suite of the tau programs in bench/programs.
+#
+# Compiles every program a number of times with `tau.py com -no-cache -json`
+# and collects the time of every phase from the report (lex, expand, type check,
+# generate asm, nasm and ld or the -elf assembler and linker) along with the
+# wall time of the whole `com` process, then runs the executable the same number
+# of times. Reports the median and the standard deviation of every measurement
+# and compares the medians to a baseline JSON written by a previous run with
+# -save. Fails if a median got slower than the baseline by more than the
+# threshold, ignoring differences that are noise: below MIN_DIFFERENCE or below
+# NOISE_DEVIATIONS standard deviations of the two measurements.
+#
+# The baseline only means something on the machine it was saved on. The one in
+# the repo was saved with the -elf backend because nasm is not always there.
+#
+# Usage: ./bench/run.py [-runs <n>] [-backend nasm|elf] [-O0|-O1|-O2] [-baseline <file>] [-save] [-threshold <percent>] [program...]
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+from os import path
+from statistics import median, pvariance
+from time import perf_counter
+from typing import *
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+TAU = path.join(ROOT, 'tau.py')
+PROGRAMS_DIR = path.join(ROOT, 'bench', 'programs')
+DEFAULT_BASELINE = path.join(ROOT, 'bench', 'baseline.json')
+
+DEFAULT_RUNS = 5
+DEFAULT_THRESHOLD = 25.0
+# seconds
+MIN_DIFFERENCE = 0.005
+NOISE_DEVIATIONS = 2
+# name -> flags of `com`
+BACKENDS = {'nasm': [], 'elf': ['-elf']}
+
+# measurement -> seconds of every run
+Measurements = Dict[str, List[float]]
+
+def bench_program(out_dir: str, program_path: str, runs: int, backend: str, level: str) -> Measurements:
+    name = path.splitext(path.basename(program_path))[0]
+    binary_path = path.join(out_dir, name)
+    measurements: Measurements = {}
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run([sys.executable, TAU, '-I', ROOT, '-no-cache', 'com', '-s', '-json', level] + BACKENDS[backend] + ['-o', binary_path, program_path], check=True)
+        measurements.setdefault('com', []).append(perf_counter() - start)
+        with open(binary_path + '.stats.json') as f:
+            report = json.load(f)
+        for phase in report['phases']:
+            measurements.setdefault(phase['name'], []).append(phase['seconds'])
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run([binary_path], stdout=subprocess.DEVNULL, check=True)
+        measurements.setdefault('run', []).append(perf_counter() - start)
+    return measurements
+
+def summarize(measurements: Measurements) -> Dict[str, Dict[str, float]]:
+    return {name: {'median': median(times), 'variance': pvariance(times)} for name, times in measurements.items()}
+
+def compare(name: str, summary: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]], threshold: float) -> bool:
+    '''Print the summary of a program next to its baseline. Returns whether nothing got slower.'''
+    ok = True
+    print(name)
+    for measurement, values in summary.items():
+        line = "  %-14s %10.3f ms  ± %8.3f ms" % (measurement, values['median'] * 1000, values['variance'] ** 0.5 * 1000)
+        if baseline is not None and measurement in baseline:
+            before = baseline[measurement]['median']
+            change = (values['median'] - before) / before * 100 if before > 0 else 0.0
+            line += "  %10.3f ms  %+7.1f%%" % (before * 1000, change)
+            noise = NOISE_DEVIATIONS * (values['variance'] + baseline[measurement]['variance']) ** 0.5
+            if change > threshold and values['median'] - before > max(MIN_DIFFERENCE, noise):
+                line += "  [SLOWER]"
+                ok = False
+        print(line)
+    return ok
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    runs = DEFAULT_RUNS
+    backend = 'nasm' if shutil.which('nasm') is not None else 'elf'
+    level = '-O0'
+    baseline_path = DEFAULT_BASELINE
+    save = False
+    threshold = DEFAULT_THRESHOLD
+    program_paths: List[str] = []
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-runs':
+            arg, *argv = argv
+            runs = int(arg)
+        elif arg == '-backend':
+            backend, *argv = argv
+            if backend not in BACKENDS:
+                print("[ERROR] unknown backend %s" % backend, file=sys.stderr)
+                exit(1)
+        elif arg in ['-O0', '-O1', '-O2']:
+            level = arg
+        elif arg == '-baseline':
+            baseline_path, *argv = argv
+        elif arg == '-save':
+            save = True
+        elif arg == '-threshold':
+            arg, *argv = argv
+            threshold = float(arg)
+        elif arg.startswith('-'):
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+        else:
+            program_paths.append(arg)
+    if len(program_paths) == 0:
+        program_paths = sorted(path.join(PROGRAMS_DIR, name) for name in os.listdir(PROGRAMS_DIR) if name.endswith('.tau'))
+
+    baseline = None
+    if not save and path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if (baseline['backend'], baseline['level']) != (backend, level):
+            print("[WARN] the baseline is for %s %s, not comparing" % (baseline['backend'], baseline['level']))
+            baseline = None
+    print("%d runs, %s %s%s" % (runs, backend, level, "" if baseline is None else ", baseline %s" % baseline_path))
+
+    ok = True
+    summaries = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for program_path in program_paths:
+            name = path.splitext(path.basename(program_path))[0]
+            summaries[name] = summarize(bench_program(out_dir, program_path, runs, backend, level))
+            ok = compare(name, summaries[name], None if baseline is None else baseline['programs'].get(name), threshold) and ok
+
+    if save:
+        with open(baseline_path, 'w') as f:
+            json.dump({'backend': backend, 'level': level, 'runs': runs, 'programs': summaries}, f, indent=2)
+            f.write("\n")
+        print("[INFO] Saved the baseline to %s" % baseline_path)
+    if not ok:
+        exit(1)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Scaling report of the front end.
+#
+# Every sweep doubles a program from bench/generate.py along one dimension:
+# - ops: the number of ops;
+# - depth: the ops and the nesting depth;
+# - macros: the uses of every macro;
+# - files: the ops and the files of the include tree.
+# For every step it times lex_lines(), lex_text(), compile_tokens() (without
+# lexing the includes) and type_check_program(), the median of a number of
+# runs, and measures the peak traced memory of the whole front end in a
+# separate run, because tracemalloc slows it down. The garbage collector is off
+# during the timed calls, its collections grow with the live objects and not
+# with the work of the step. Every run times all the steps, so a change of the
+# load of the machine doesn't bend the slope. The best time would: a short step
+# can fall in a moment of a fast machine that a long one can't. Then it fits
+# every column against the op count on a log-log scale. A slope of 1 is
+# linear. The report fails if a slope is over the limit, so super-linear
+# behaviour is caught.
+#
+# Usage: ./bench/scaling.py [-n <ops>] [-steps <n>] [-runs <n>] [-max-slope <slope>] [sweep...]
+
+import gc
+import sys
+import math
+import tempfile
+import tracemalloc
+from os import path
+from dataclasses import replace
+from statistics import median
+from time import perf_counter
+from typing import *
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import tau_compiler as tau
+from generate import Shape, write_program
+
+DEFAULT_OPS = 30_000
+DEFAULT_STEPS = 3
+DEFAULT_RUNS = 10
+DEFAULT_MAX_SLOPE = 1.3
+# an average statement of bench/generate.py
+OPS_PER_CALL = 7
+
+# name -> shape of the step
+SWEEPS: Dict[str, Callable[[Shape, int], Shape]] = {
+    'ops': lambda base, scale: replace(base, ops=base.ops * scale),
+    'depth': lambda base, scale: replace(base, ops=base.ops * scale, depth=base.depth * scale),
+    'macros': lambda base, scale: replace(base, uses=base.ops * scale // (base.macros * OPS_PER_CALL)),
+    'files': lambda base, scale: replace(base, ops=base.ops * scale, files=4 * scale),
+}
+COLUMNS = ['lex_lines', 'lex_text', 'compile_tokens', 'type_check', 'memory']
+
+def timed(f: Callable[[], Any]) -> float:
+    '''Seconds of a call of `f` with the garbage collector off'''
+    gc.collect()
+    gc.disable()
+    try:
+        start = perf_counter()
+        f()
+        return perf_counter() - start
+    finally:
+        gc.enable()
+
+def front_end(main_path: str) -> Tuple[tau.Program, tau.IncludeResolver]:
+    resolver = tau.IncludeResolver([path.dirname(main_path)])
+    resolver.included.add(path.realpath(main_path))
+    program = tau.compile_tokens(tau.lex_file(main_path), resolver, tau.DEFAULT_EXPANSION_LIMIT)
+    tau.type_check_program(program)
+    return program, resolver
+
+def prepare(main_path: str) -> Tuple[int, int, Dict[str, Callable[[], float]]]:
+    '''Op count of the program, peak bytes of its front end and a function for every other column that times a run of its phase'''
+    program, resolver = front_end(main_path)
+    texts = {}
+    for file_path in [main_path] + list(resolver.lexed):
+        with open(file_path) as f:
+            texts[file_path] = f.read()
+    tokens = tau.lex_text(main_path, texts[main_path])
+
+    def compile_tokens() -> float:
+        resolver = tau.IncludeResolver([path.dirname(main_path)])
+        gc.collect()
+        gc.disable()
+        try:
+            start = perf_counter()
+            tau.compile_tokens(tokens, resolver, tau.DEFAULT_EXPANSION_LIMIT)
+            return perf_counter() - start - resolver.lex_time
+        finally:
+            gc.enable()
+
+    tracemalloc.start()
+    front_end(main_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(program), peak, {
+        'lex_lines': lambda: timed(lambda: [list(tau.lex_lines(file_path, text.splitlines(keepends=True))) for file_path, text in texts.items()]),
+        'lex_text': lambda: timed(lambda: [tau.lex_text(file_path, text) for file_path, text in texts.items()]),
+        'compile_tokens': compile_tokens,
+        'type_check': lambda: timed(lambda: tau.type_check_program(program)),
+    }
+
+def slope(xs: List[float], ys: List[float]) -> float:
+    '''Least squares slope of log(y) over log(x)'''
+    lx = [math.log(x) for x in xs]
+    ly = [math.log(max(y, 1e-9)) for y in ys]
+    mx, my = sum(lx) / len(lx), sum(ly) / len(ly)
+    return sum((x - mx) * (y - my) for x, y in zip(lx, ly)) / sum((x - mx) ** 2 for x in lx)
+
+def sweep(name: str, base: Shape, steps: int, runs: int, max_slope: float) -> bool:
+    print("%s:" % name)
+    print("  %8s %6s %6s %6s  %14s %14s %14s %14s %10s" % ('ops', 'depth', 'uses', 'files', 'lex_lines', 'lex_text', 'compile_tokens', 'type_check', 'memory'))
+    shapes = [SWEEPS[name](base, 2 ** step) for step in range(steps)]
+    with tempfile.TemporaryDirectory() as out_dir:
+        prepared = [prepare(write_program(shape, path.join(out_dir, str(step)))) for step, shape in enumerate(shapes)]
+        times: List[Dict[str, List[float]]] = [{column: [] for column in timers} for _, _, timers in prepared]
+        # a run times every step, so a change of the load of the machine
+        # slows all of them instead of bending the slope
+        for _ in range(runs):
+            for step_times, (_, _, timers) in zip(times, prepared):
+                for column, timer in timers.items():
+                    step_times[column].append(timer())
+    rows: List[Dict[str, float]] = [dict({column: median(values) for column, values in step_times.items()}, memory=peak) for step_times, (_, peak, _) in zip(times, prepared)]
+    sizes = [size for size, _, _ in prepared]
+    for size, shape, row in zip(sizes, shapes, rows):
+        print("  %8d %6d %6d %6d  %11.1f ms %11.1f ms %11.1f ms %11.1f ms %6.1f MiB" % (
+            size, shape.depth, shape.uses, shape.files,
+            row['lex_lines'] * 1000, row['lex_text'] * 1000, row['compile_tokens'] * 1000, row['type_check'] * 1000, row['memory'] / 1024 / 1024))
+    slopes = {column: slope(sizes, [row[column] for row in rows]) for column in COLUMNS}
+    print("  %-29s %14.2f %14.2f %14.2f %14.2f %10.2f" % ('slope', *[slopes[column] for column in COLUMNS]))
+    ok = True
+    for column in COLUMNS:
+        if slopes[column] > max_slope:
+            print("[FAIL] %s: %s grows with ops^%.2f" % (name, column, slopes[column]))
+            ok = False
+    return ok
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    base = Shape(ops=DEFAULT_OPS)
+    steps = DEFAULT_STEPS
+    runs = DEFAULT_RUNS
+    max_slope = DEFAULT_MAX_SLOPE
+    sweeps: List[str] = []
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-n':
+            arg, *argv = argv
+            base.ops = int(arg)
+        elif arg == '-steps':
+            arg, *argv = argv
+            steps = int(arg)
+        elif arg == '-runs':
+            arg, *argv = argv
+            runs = int(arg)
+        elif arg == '-max-slope':
+            arg, *argv = argv
+            max_slope = float(arg)
+        elif arg in SWEEPS:
+            sweeps.append(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+    if steps < 2:
+        print("[ERROR] a slope needs at least 2 steps", file=sys.stderr)
+        exit(1)
+
+    # the included files are lexed from disk, the token cache would skip that
+    tau.lex_cache_dir = None
+    ok = True
+    for name in sweeps or list(SWEEPS):
+        ok = sweep(name, base, steps, runs, max_slope) and ok
+    if not ok:
+        exit(1)
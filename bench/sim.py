@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Simulation benchmark.
+#
+# Runs a few loop heavy programs with `tau.py sim` in both of its modes, the
+# interpreter that runs the ops one by one (-interpret) and the default one that
+# translates the basic blocks to Python functions first, and reports the best
+# time of each and the speedup of the translation. The time includes the
+# translation itself but not the front end. Fails if the speedup on a program
+# is below its target. The output of the programs goes to /dev/null.
+#
+# Usage: ./bench/sim.py [-runs <n>] [-n <iterations>] [program...]
+
+import os
+import sys
+from os import path
+from time import perf_counter
+from typing import *
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import tau_compiler as tau
+import tau_sim
+
+DEFAULT_RUNS = 3
+DEFAULT_ITERATIONS = 200_000
+
+# name -> (source with %(n)d for the number of iterations, minimum speedup)
+PROGRAMS: Dict[str, Tuple[str, float]] = {
+    # prints the numbers up to n like example/seq.afl
+    'seq': ('''include "core/std.tau"
+0 while dup %(n)d < do
+  dup prn
+  1 +
+end drop
+0 exit drop
+''', 5.0),
+    # sums j & 7 in nested loops like bench/programs/loop.tau
+    'loops': ('''include "core/std.tau"
+0 0 while dup %(n)d 100 divmod drop < do
+  0 while dup 100 < do
+    rot over 7 and + rot rot
+    1 +
+  end drop
+  1 +
+end drop prn
+0 exit drop
+''', 5.0),
+    # fills a buffer byte by byte and sums it back with branches in the loop
+    'memory': ('''include "core/std.tau"
+0 while dup %(n)d 1000 divmod drop < do
+  0 while dup 1000 < do
+    dup 3 and 0 = if
+      dup bit + over .
+    else
+      dup bit + 1 .
+    end
+    1 +
+  end drop
+  1 +
+end drop
+0 0 while dup 1000 < do
+  dup bit + , rot + swap
+  1 +
+end drop prn
+0 exit drop
+''', 3.0),
+}
+
+def load_program(name: str, iterations: int) -> tau.Program:
+    source, _ = PROGRAMS[name]
+    program_path = path.join(ROOT, 'bench', '%s.tau' % name)
+    tokens = tau.lex_text(program_path, source % {'n': iterations})
+    program = tau.compile_tokens(tokens, tau.IncludeResolver([ROOT]), tau.DEFAULT_EXPANSION_LIMIT)
+    tau.type_check_program(program)
+    return program
+
+def best_time(program: tau.Program, interpret: bool, runs: int) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        start = perf_counter()
+        exit_code = tau_sim.simulate_program(program, [program[0].token.loc[0]], interpret)
+        best = min(best, perf_counter() - start)
+        assert exit_code == 0
+    return best
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    runs = DEFAULT_RUNS
+    iterations = DEFAULT_ITERATIONS
+    names: List[str] = []
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-runs':
+            arg, *argv = argv
+            runs = int(arg)
+        elif arg == '-n':
+            arg, *argv = argv
+            iterations = int(arg)
+        elif arg in PROGRAMS:
+            names.append(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+
+    tau.lex_cache_dir = None
+    ok = True
+    print("%-8s %12s %12s %9s" % ('program', 'interpret', 'translate', 'speedup'))
+    for name in names or list(PROGRAMS):
+        program = load_program(name, iterations)
+        stdout = os.dup(1)
+        with open(os.devnull, 'wb') as devnull:
+            os.dup2(devnull.fileno(), 1)
+        try:
+            interpreted = best_time(program, True, runs)
+            translated = best_time(program, False, runs)
+        finally:
+            os.dup2(stdout, 1)
+            os.close(stdout)
+        speedup = interpreted / translated
+        print("%-8s %9.1f ms %9.1f ms %8.1fx" % (name, interpreted * 1000, translated * 1000, speedup))
+        if speedup < PROGRAMS[name][1]:
+            print("[FAIL] %s: the speedup is below %.1fx" % (name, PROGRAMS[name][1]))
+            ok = False
+    if not ok:
+        exit(1)
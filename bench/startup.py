@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Startup time benchmark.
+#
+# Runs `tau.py help` a number of times and reports the median wall time next to
+# the one of a bare interpreter, then breaks it down with `python3 -X importtime`
+# into the imports, listing the slowest ones. tau.py is a launcher of
+# tau_compiler.py, whose bytecode is cached. It is compiled before the runs, as
+# the first run after a change does, and the time of compiling it is reported
+# too. Fails if the median is over the target or if one of the modules that
+# tau_compiler.py imports lazily is imported at startup. The target is for the
+# machine the benchmark was written on.
+#
+# Usage: ./bench/startup.py [-runs <n>] [-target <ms>] [-top <n>]
+
+import sys
+import subprocess
+import py_compile
+from os import path
+from statistics import median
+from time import perf_counter
+from typing import *
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+TAU = path.join(ROOT, 'tau.py')
+COMPILER = path.join(ROOT, 'tau_compiler.py')
+
+DEFAULT_RUNS = 20
+DEFAULT_TARGET_MS = 100.0
+DEFAULT_TOP = 10
+# Only imported by the functions that use them. marshal is imported by the
+# interpreter itself.
+LAZY_MODULES = ['tau_sim', 'subprocess', 'shlex', 'hashlib', 'shutil', 'struct', 'traceback', 'tempfile', 'concurrent.futures']
+
+def wall_time(cmd: List[str], runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        times.append(perf_counter() - start)
+    return median(times)
+
+def import_times() -> List[Tuple[str, int, int]]:
+    '''(module, self us, cumulative us) of every module imported by `tau.py help`, the nested ones indented'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', TAU, 'help'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        # nested imports are indented past the space after the separator
+        imports.append((module[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+def compile_time(runs: int) -> float:
+    with open(COMPILER) as f:
+        source = f.read()
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        compile(source, COMPILER, 'exec')
+        times.append(perf_counter() - start)
+    return median(times)
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    runs = DEFAULT_RUNS
+    target = DEFAULT_TARGET_MS
+    top = DEFAULT_TOP
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-runs':
+            arg, *argv = argv
+            runs = int(arg)
+        elif arg == '-target':
+            arg, *argv = argv
+            target = float(arg)
+        elif arg == '-top':
+            arg, *argv = argv
+            top = int(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+
+    # also with PYTHONDONTWRITEBYTECODE, which would leave every run to compile it
+    py_compile.compile(COMPILER, doraise=True)
+    interpreter = wall_time([sys.executable, '-c', 'pass'], runs) * 1000
+    startup = wall_time([sys.executable, TAU, 'help'], runs) * 1000
+    imports = import_times()
+    # top level imports only, the others are part of their cumulative time
+    total_imports = sum(cumulative for module, _, cumulative in imports if not module.startswith(' ')) / 1000
+    print("interpreter  %8.1f ms" % interpreter)
+    print("tau.py help  %8.1f ms  (target %.1f ms)" % (startup, target))
+    print("  compile    %8.1f ms  (of tau_compiler.py, only when its bytecode is stale)" % (compile_time(runs) * 1000))
+    print("  imports    %8.1f ms  (with the ones of the interpreter)" % total_imports)
+    for module, self_us, cumulative_us in sorted(imports, key=lambda entry: entry[2], reverse=True)[:top]:
+        print("    %-24s %6.1f ms  (self %.1f ms)" % (module.lstrip(), cumulative_us / 1000, self_us / 1000))
+
+    ok = True
+    eager = [module for module in LAZY_MODULES if module in {name.lstrip() for name, _, _ in imports}]
+    if len(eager) > 0:
+        print("[FAIL] imported at startup: %s" % ", ".join(eager))
+        ok = False
+    if startup > target:
+        print("[FAIL] startup time %.1f ms is over the target of %.1f ms" % (startup, target))
+        ok = False
+    if not ok:
+        exit(1)
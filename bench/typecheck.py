@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Type checker benchmark.
+#
+# Compiles the synthetic program of bench/memory.py (default 1M ops) and a
+# stress program of deeply nested blocks over a large live stack, and reports
+# the time spent in type_check_program() for both.
+#
+# Usage: ./bench/typecheck.py [-n <ops>] [-depth <nesting>] [-live <values>] [-repeat <n>]
+
+import sys
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import tau_compiler as tau
+from memory import DEFAULT_OPS, generate_program
+
+RUNS = 3
+DEFAULT_DEPTH = 200
+DEFAULT_LIVE = 2000
+DEFAULT_REPEAT = 20
+
+def generate_nested_program(depth: int, live: int, repeat: int) -> str:
+    '''`live` values on the stack under `repeat` times `depth` nested if/else and while blocks'''
+    nest = ''
+    for i in range(depth):
+        if i % 2 == 0:
+            nest += '1 1 = if 1 drop else\n'
+        else:
+            nest += '1 while dup 2 < do 1 + \n'
+    for i in reversed(range(depth)):
+        if i % 2 == 0:
+            nest += 'end\n'
+        else:
+            nest += 'end drop\n'
+    return '1 ' * live + '\n' + nest * repeat + 'drop ' * live + '\n'
+
+def best_of(runs: int, f) -> float:
+    best = float('inf')
+    for _ in range(runs):
+        start = perf_counter()
+        f()
+        best = min(best, perf_counter() - start)
+    return best
+
+def bench(name: str, text: str):
+    program = tau.compile_tokens(tau.lex_text('<%s>' % name, text), tau.IncludeResolver([]), tau.DEFAULT_EXPANSION_LIMIT)
+    elapsed = best_of(RUNS, lambda: tau.type_check_program(program))
+    print("%-10s %8d ops  %8.3f s  %10.0f ops/sec" % (name, len(program), elapsed, len(program) / elapsed))
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    ops = DEFAULT_OPS
+    depth = DEFAULT_DEPTH
+    live = DEFAULT_LIVE
+    repeat = DEFAULT_REPEAT
+    while len(argv) > 0:
+        arg, *argv = argv
+        if arg == '-n':
+            arg, *argv = argv
+            ops = int(arg)
+        elif arg == '-depth':
+            arg, *argv = argv
+            depth = int(arg)
+        elif arg == '-live':
+            arg, *argv = argv
+            live = int(arg)
+        elif arg == '-repeat':
+            arg, *argv = argv
+            repeat = int(arg)
+        else:
+            print("[ERROR] unknown argument %s" % arg, file=sys.stderr)
+            exit(1)
+
+    bench('flat', generate_program(ops))
+    bench('nested', generate_nested_program(depth, live, repeat))
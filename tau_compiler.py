@@ -0,0 +1,3605 @@
+# The compiler. tau.py only runs main(): a script is compiled on every run and
+# never gets cached bytecode, a module does. See bench/startup.py.
+
+import os
+import sys
+import re
+from os import path
+from typing import *
+from enum import IntEnum, Enum, auto
+from dataclasses import dataclass, field
+from time import sleep, perf_counter
+# The other modules are imported by the functions that need them, most runs
+# only use a few of them. See bench/startup.py.
+
+TAU_EXT = '.tau'
+DEFAULT_EXPANSION_LIMIT=1000
+EXPANSION_DIAGNOSTIC_LIMIT=10
+MEM_CAP  = 640_000 
+# Size of the buffer `prn` writes to. It is flushed when full, before every
+# syscall of the program and at the end of the program.
+OUTPUT_BUFFER_CAP = 64 * 1024
+# Enough for the 20 digits of the largest 64 bit number and the newline
+DIGIT_SPACE_CAP = 32
+SIM_NULL_POINTER_PADDING = 1 
+SIM_STR_CAPACITY  = 640_000
+SIM_ARGV_CAPACITY = 640_000
+CACHE_DIR = '.tau-cache'
+LEX_CACHE_VERSION = 1
+BUILD_CACHE_VERSION = 2
+# Name of the executable in an entry of the build cache, the other files of the build follow it with their extension
+BUILD_CACHE_FILE = 'out'
+DEFAULT_BUILD_CACHE_SIZE_MB = 256
+DEFAULT_WATCH_INTERVAL = 0.25
+
+debug=False
+# Directory of the on-disk token cache used by lex_file(). None disables the cache.
+lex_cache_dir: Optional[str] = path.join(CACHE_DIR, 'lex')
+# Directory of the executables cached by `com`. None disables the cache.
+build_cache_dir: Optional[str] = path.join(CACHE_DIR, 'build')
+# Tokens of the files lexed by this process as file path -> (mtime, size, tokens), kept by `watch`. None disables it.
+lex_memory_cache: Optional[Dict[str, Tuple[int, int, List['Token']]]] = None
+
+Loc=Tuple[str, int, int]
+
+class Keyword(Enum):
+    IF=auto()
+    END=auto()
+    ELSE=auto()
+    WHILE=auto()
+    DO=auto()
+    MACRO=auto()
+    INCLUDE=auto()
+
+class Intrinsic(Enum):
+    PLUS=auto()
+    MINUS=auto()
+    MUL=auto()
+    DIVMOD=auto()
+    EQ=auto()
+    GT=auto()
+    LT=auto()
+    GE=auto()
+    LE=auto()
+    NE=auto()
+    SHR=auto()
+    SHL=auto()
+    OR=auto()
+    AND=auto()
+    NOT=auto()
+    PRINT=auto()
+    DUP=auto()
+    SWAP=auto()
+    DROP=auto()
+    OVER=auto()
+    ROT=auto()
+    MEM=auto()
+    LOAD=auto()
+    STORE=auto()
+    LOAD64=auto()
+    STORE64=auto()
+    CAST_PTR=auto()
+    ARGC=auto()
+    ARGV=auto()
+    HERE=auto()
+    SYSCALL0=auto()
+    SYSCALL1=auto()
+    SYSCALL2=auto()
+    SYSCALL3=auto()
+    SYSCALL4=auto()
+    SYSCALL5=auto()
+    SYSCALL6=auto()
+
+class OpType(Enum):
+    PUSH_INT=auto()
+    PUSH_STR=auto()
+    INTRINSIC=auto()
+    IF=auto()
+    END=auto()
+    ELSE=auto()
+    WHILE=auto()
+    DO=auto()
+
+class TokenType(Enum):
+    WORD=auto()
+    INT=auto()
+    STR=auto()
+    CHAR=auto()
+    KEYWORD=auto()
+
+assert len(TokenType) == 5, "Exhaustive Token type definition. The `value` field of the Token dataclass may require an update"
+# Tokens and ops are slotted since big programs hold millions of them. The
+# location of a token is stored unpacked. `file` is interned by the lexer, so
+# all the tokens of a file share a single string instead of each carrying its
+# own Loc tuple. The tuple is built on demand by the `loc` property.
+@dataclass(slots=True)
+class Token:
+    typ: TokenType
+    text: str
+    file: str
+    row: int
+    col: int
+    value: Union[int, str, Keyword]
+    expanded_from: Optional['Token'] = None
+    expanded_count: int = 0
+
+    @property
+    def loc(self) -> Loc:
+        return (self.file, self.row, self.col)
+
+OpAddr=int
+
+@dataclass(slots=True)
+class Op:
+    typ: OpType
+    token: Token
+    operand: Optional[Union[int, str, Intrinsic, OpAddr]] = None
+    # Macro bodies and included files are not copied on expansion, so the token
+    # of an op is shared by all its expansions. The expansion stack of this
+    # particular op starts here instead of at token.expanded_from.
+    expanded_from: Optional[Token] = None
+
+Program=List[Op]
+
+
+def get_cstr_from_mem(bit: bytearray, ptr: int) -> bytes:
+    end = ptr
+    while bit[end] != 0:
+        end += 1
+    return bit[ptr:end]
+
+class DataType(IntEnum):
+    INT=auto()
+    BOOL=auto()
+    PTR=auto()
+
+def compiler_diagnostic(loc: Loc, tag: str, message: str):
+    print("%s:%d:%d: %s: %s" % (loc + (tag, message)), file=sys.stderr)
+
+def compiler_diagnostic_with_expansion_stack(token: Token, tag: str, message: str, expanded_from: Optional[Token] = None):
+    compiler_diagnostic(token.loc, tag, message)
+    stack = expanded_from if expanded_from is not None else token.expanded_from
+    limit = 0
+    while stack is not None and limit <= EXPANSION_DIAGNOSTIC_LIMIT:
+        compiler_note(stack.loc, "expanded from `%s`" % stack.text)
+        stack = stack.expanded_from
+        limit += 1
+    if limit > EXPANSION_DIAGNOSTIC_LIMIT:
+        print('...', file=sys.stderr)
+        print('... too many expansions ...', file=sys.stderr)
+        print('...', file=sys.stderr)
+
+def compiler_error(loc: Loc, message: str):
+    compiler_diagnostic(loc, 'ERROR', message)
+
+def compiler_error_with_expansion_stack(token: Token, message: str, expanded_from: Optional[Token] = None):
+    compiler_diagnostic_with_expansion_stack(token, 'ERROR', message, expanded_from)
+
+def compiler_note(loc: Loc, message: str):
+    compiler_diagnostic(loc, 'NOTE', message)
+
+def not_enough_arguments(op: Op):
+    if op.typ == OpType.INTRINSIC:
+        assert isinstance(op.operand, Intrinsic)
+        compiler_error_with_expansion_stack(op.token, "not enough arguments for the `%s` intrinsic" % INTRINSIC_NAMES[op.operand], op.expanded_from)
+    elif op.typ == OpType.IF:
+        compiler_error_with_expansion_stack(op.token, "not enough arguments for the if-block", op.expanded_from)
+    else:
+        assert False, "unsupported type of operation"
+
+# The data stack of the type checker is persistent: a cell is (type, op, below,
+# depth) and the empty stack is None. Pushing and popping never modify existing
+# cells, so a block can remember the stack at its start in O(1) and compare it
+# with the stack at its end by walking only the cells that are not shared.
+DataStack=Optional[Tuple[DataType, Op, Any, int]]
+
+def data_stack_depth(stack: DataStack) -> int:
+    return 0 if stack is None else stack[3]
+
+def data_stack_push(stack: DataStack, typ: DataType, op: Op) -> DataStack:
+    return (typ, op, stack, 1 if stack is None else stack[3] + 1)
+
+def data_stack_types(stack: DataStack) -> List[DataType]:
+    '''Types of the stack from the bottom to the top'''
+    types = []
+    while stack is not None:
+        types.append(stack[0])
+        stack = stack[2]
+    types.reverse()
+    return types
+
+def data_stack_same_types(a: DataStack, b: DataStack) -> bool:
+    if data_stack_depth(a) != data_stack_depth(b):
+        return False
+    while a is not b:
+        assert a is not None and b is not None
+        if a[0] != b[0]:
+            return False
+        a = a[2]
+        b = b[2]
+    return True
+
+# A result of an intrinsic as written in INTRINSIC_SIGNATURES:
+#   DataType            - a new value of that type produced by the intrinsic
+#   int                 - the argument with that index passed through unchanged
+#   (DataType, int)     - the argument with that index retyped
+SignatureResult=Union[DataType, int, Tuple[DataType, int]]
+
+@dataclass(slots=True)
+class Signature:
+    '''Stack effect of an intrinsic.
+
+    Arguments are indexed from the bottom of the stack to the top, so for `a b -`
+    `a` is the argument 0. If `cases` is None the intrinsic accepts arguments of
+    any type and produces `results`, otherwise `cases` maps the types of the
+    arguments to the results and all other combinations are a type error.
+    '''
+    arity: int
+    results: Tuple[Tuple[Optional[DataType], int], ...]
+    cases: Optional[Dict[Tuple[DataType, ...], Tuple[Tuple[Optional[DataType], int], ...]]]
+    error: str
+    # Format the error message with the types of the arguments
+    error_with_types: bool
+
+def normalize_signature_results(results: Tuple[SignatureResult, ...]) -> Tuple[Tuple[Optional[DataType], int], ...]:
+    '''Turn the results into (type, argument) pairs. None type keeps the type of the argument, -1 argument is a new value.'''
+    normalized: List[Tuple[Optional[DataType], int]] = []
+    for result in results:
+        if isinstance(result, DataType):
+            normalized.append((result, -1))
+        elif isinstance(result, int):
+            normalized.append((None, result))
+        else:
+            normalized.append(result)
+    return tuple(normalized)
+
+def signature(arity: int, results: Tuple[SignatureResult, ...] = (), cases: Optional[Dict[Tuple[DataType, ...], Tuple[SignatureResult, ...]]] = None, error: str = "", error_with_types: bool = False) -> Signature:
+    normalized_cases = None
+    if cases is not None:
+        normalized_cases = {types: normalize_signature_results(case_results) for types, case_results in cases.items()}
+        assert len(set(map(len, cases.values()))) == 1, "All cases of a signature must produce the same amount of results"
+        results = next(iter(cases.values()))
+    return Signature(arity, normalize_signature_results(results), normalized_cases, error, error_with_types)
+
+assert len(Intrinsic) == 37, "Exhaustive INTRINSIC_SIGNATURES definition"
+assert len(DataType) == 3, "Exhaustive type handling in INTRINSIC_SIGNATURES"
+INTRINSIC_SIGNATURES: Dict[Intrinsic, Signature] = {
+    Intrinsic.PLUS: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, ), (DataType.PTR, DataType.INT): (DataType.PTR, ), (DataType.INT, DataType.PTR): (DataType.PTR, )},
+                              error="invalid argument types for PLUS intrinsic. Expected INT or PTR"),
+    Intrinsic.MINUS: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, ), (DataType.PTR, DataType.PTR): (DataType.INT, ), (DataType.PTR, DataType.INT): (DataType.PTR, )},
+                               error="invalid argument types fo MINUS intrinsic: %s", error_with_types=True),
+    Intrinsic.MUL: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, )}, error="invalid argument types fo MUL intrinsic. Expected INT."),
+    Intrinsic.DIVMOD: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, DataType.INT)}, error="invalid argument types fo DIVMOD intrinsic. Expected INT."),
+
+    Intrinsic.EQ: signature(2, cases={(DataType.INT, DataType.INT): (DataType.BOOL, )}, error="invalid argument types fo EQ intrinsic. Expected INT."),
+    Intrinsic.GT: signature(2, cases={(DataType.INT, DataType.INT): (DataType.BOOL, )}, error="invalid argument type for GT intrinsic"),
+    Intrinsic.LT: signature(2, cases={(DataType.INT, DataType.INT): (DataType.BOOL, )}, error="invalid argument type for LT intrinsic"),
+    Intrinsic.GE: signature(2, cases={(DataType.INT, DataType.INT): (DataType.BOOL, )}, error="invalid argument type for GE intrinsic"),
+    Intrinsic.LE: signature(2, cases={(DataType.INT, DataType.INT): (DataType.BOOL, )}, error="invalid argument type for LE intrinsic"),
+    Intrinsic.NE: signature(2, cases={(DataType.INT, DataType.INT): (DataType.BOOL, )}, error="invalid argument type for NE intrinsic"),
+
+    Intrinsic.SHR: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, )}, error="invalid argument type for SHR intrinsic"),
+    Intrinsic.SHL: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, )}, error="invalid argument type for SHL intrinsic"),
+    Intrinsic.OR: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, ), (DataType.BOOL, DataType.BOOL): (DataType.BOOL, )}, error="invalid argument type for OR intrinsic"),
+    Intrinsic.AND: signature(2, cases={(DataType.INT, DataType.INT): (DataType.INT, ), (DataType.BOOL, DataType.BOOL): (DataType.BOOL, )}, error="invalid argument type for AND intrinsic"),
+    Intrinsic.NOT: signature(1, cases={(DataType.INT, ): (DataType.INT, ), (DataType.BOOL, ): (DataType.BOOL, )}, error="invalid argument type for NOT intrinsic"),
+    Intrinsic.PRINT: signature(1),
+
+    Intrinsic.DUP: signature(1, (0, 0)),
+    Intrinsic.SWAP: signature(2, (1, 0)),
+    Intrinsic.DROP: signature(1),
+    Intrinsic.OVER: signature(2, (0, 1, 0)),
+    Intrinsic.ROT: signature(3, (1, 2, 0)),
+
+    Intrinsic.MEM: signature(0, (DataType.PTR, )),
+    Intrinsic.LOAD: signature(1, cases={(DataType.PTR, ): (DataType.INT, )}, error="invalid argument type for LOAD intrinsic: %s", error_with_types=True),
+    Intrinsic.STORE: signature(2, cases={(DataType.PTR, DataType.INT): ()}, error="invalid argument type for STORE intrinsic"),
+    Intrinsic.LOAD64: signature(1, cases={(DataType.PTR, ): (DataType.INT, )}, error="invalid argument type for LOAD64 intrinsic"),
+    Intrinsic.STORE64: signature(2, cases={(DataType.PTR, DataType.INT): (), (DataType.PTR, DataType.PTR): ()}, error="invalid argument type for STORE64 intrinsic: %s", error_with_types=True),
+    Intrinsic.CAST_PTR: signature(1, ((DataType.PTR, 0), )),
+    Intrinsic.ARGC: signature(0, (DataType.INT, )),
+    Intrinsic.ARGV: signature(0, (DataType.PTR, )),
+    Intrinsic.HERE: signature(0, (DataType.INT, DataType.PTR)),
+
+    Intrinsic.SYSCALL0: signature(1, (DataType.INT, )),
+    Intrinsic.SYSCALL1: signature(2, (DataType.INT, )),
+    Intrinsic.SYSCALL2: signature(3, (DataType.INT, )),
+    Intrinsic.SYSCALL3: signature(4, (DataType.INT, )),
+    Intrinsic.SYSCALL4: signature(5, (DataType.INT, )),
+    Intrinsic.SYSCALL5: signature(6, (DataType.INT, )),
+    Intrinsic.SYSCALL6: signature(7, (DataType.INT, )),
+}
+
+def type_check_intrinsic(op: Op, stack: DataStack) -> DataStack:
+    assert isinstance(op.operand, Intrinsic), "This could be a bug in compilation step"
+    sig = INTRINSIC_SIGNATURES[op.operand]
+    if data_stack_depth(stack) < sig.arity:
+        not_enough_arguments(op)
+        exit(1)
+    args: Sequence[Tuple[DataType, Op, Any, int]]
+    if sig.arity == 1:
+        assert stack is not None
+        args = (stack, )
+        stack = stack[2]
+    elif sig.arity == 2:
+        assert stack is not None and stack[2] is not None
+        args = (stack[2], stack)
+        stack = stack[2][2]
+    else:
+        args = []
+        for _ in range(sig.arity):
+            assert stack is not None
+            args.append(stack)
+            stack = stack[2]
+        args.reverse()
+    results = sig.results
+    if sig.cases is not None:
+        types = tuple([arg[0] for arg in args])
+        case = sig.cases.get(types)
+        if case is None:
+            if sig.error_with_types:
+                compiler_error_with_expansion_stack(op.token, sig.error % (types[0] if sig.arity == 1 else list(types)), op.expanded_from)
+            else:
+                compiler_error_with_expansion_stack(op.token, sig.error, op.expanded_from)
+            exit(1)
+        results = case
+    depth = data_stack_depth(stack)
+    for typ, arg in results:
+        depth += 1
+        if arg < 0:
+            stack = (typ, op, stack, depth)
+        elif typ is None:
+            stack = (args[arg][0], args[arg][1], stack, depth)
+        else:
+            stack = (typ, args[arg][1], stack, depth)
+    return stack
+
+def type_check_block_end(op: Op, expected: DataStack, actual: DataStack, message: str):
+    if not data_stack_same_types(expected, actual):
+        compiler_error_with_expansion_stack(op.token, message, op.expanded_from)
+        compiler_note(op.token.loc, 'Expected types: %s' % data_stack_types(expected))
+        compiler_note(op.token.loc, 'Actual types: %s' % data_stack_types(actual))
+        exit(1)
+
+def type_check_program(program: Program) -> List[int]:
+    '''Depths of the data stack before every op and at the end of the program'''
+    stack: DataStack = None
+    block_stack: List[Tuple[DataStack, OpType]] = []
+    depths: List[int] = []
+    for ip in range(len(program)):
+        op = program[ip]
+        depths.append(0 if stack is None else stack[3])
+        assert len(OpType) == 8, "Exhaustive ops handling in type_check_program()"
+        if op.typ == OpType.INTRINSIC:
+            stack = type_check_intrinsic(op, stack)
+        elif op.typ == OpType.PUSH_INT:
+            stack = data_stack_push(stack, DataType.INT, op)
+        elif op.typ == OpType.PUSH_STR:
+            stack = data_stack_push(stack, DataType.INT, op)
+            stack = data_stack_push(stack, DataType.PTR, op)
+        elif op.typ == OpType.IF:
+            if stack is None:
+                not_enough_arguments(op)
+                exit(1)
+            a_type, a_op, stack, _ = stack
+            if a_type != DataType.BOOL:
+                compiler_error_with_expansion_stack(op.token, "Invalid argument for the if-block condition. Expected BOOL.", op.expanded_from)
+                exit(1)
+            block_stack.append((stack, op.typ))
+        elif op.typ == OpType.END:
+            block_snapshot, block_type = block_stack.pop()
+            assert len(OpType) == 8, "Exhaustive handling of op types"
+            if block_type == OpType.IF:
+                type_check_block_end(op, block_snapshot, stack, 'else-less if block is not allowed to alter the types of the arguments on the data stack')
+            elif block_type == OpType.ELSE:
+                type_check_block_end(op, block_snapshot, stack, 'both branches of the if-block must produce the same types of the arguments on the data stack')
+            elif block_type == OpType.DO:
+                while_snapshot, while_type = block_stack.pop()
+                assert while_type == OpType.WHILE
+                type_check_block_end(op, while_snapshot, stack, 'while-do body is not allowed to alter the types of the arguments on the data stack')
+                stack = block_snapshot
+            else:
+                assert "unreachable"
+        elif op.typ == OpType.ELSE:
+            stack_snapshot, block_type = block_stack.pop()
+            assert block_type == OpType.IF
+            block_stack.append((stack, op.typ))
+            stack = stack_snapshot
+        elif op.typ == OpType.WHILE:
+            block_stack.append((stack, op.typ))
+        elif op.typ == OpType.DO:
+            if stack is None:
+                not_enough_arguments(op)
+                exit(1)
+            a_type, a_op, stack, _ = stack
+            if a_type != DataType.BOOL:
+                compiler_error_with_expansion_stack(op.token, "Invalid argument for the while-do condition. Expected BOOL.", op.expanded_from)
+                exit(1)
+            block_stack.append((stack, op.typ))
+        else:
+            assert False, "unreachable"
+    if stack is not None:
+        compiler_error_with_expansion_stack(stack[1].token, "unhandled data on the stack: %s" % data_stack_types(stack), stack[1].expanded_from)
+        exit(1)
+    depths.append(0)
+    return depths
+
+# The values of the data stack are 64 bit words. Constants are kept in the
+# range of signed words, so folding `0 1 -` gives -1 and not 2**64 - 1.
+def word(value: int) -> int:
+    value &= 2**64 - 1
+    return value - 2**64 if value >= 2**63 else value
+
+def unsigned_word(value: int) -> int:
+    return value & (2**64 - 1)
+
+def fold_divmod(a: int, b: int) -> Optional[Tuple[int, ...]]:
+    if unsigned_word(b) == 0:
+        # keep the division by zero for the runtime
+        return None
+    return (word(unsigned_word(a) // unsigned_word(b)), word(unsigned_word(a) % unsigned_word(b)))
+
+# intrinsic -> (arity, statistic, results of the intrinsic for constant arguments)
+#
+# Same semantics as the generated assembly: `div` is unsigned, the comparisons
+# are signed and the shifts use only the lowest 6 bits of the count.
+FOLD_INTRINSICS: Dict[Intrinsic, Tuple[int, str, Callable[..., Optional[Tuple[int, ...]]]]] = {
+    Intrinsic.PLUS: (2, 'arithmetic', lambda a, b: (word(a + b), )),
+    Intrinsic.MINUS: (2, 'arithmetic', lambda a, b: (word(a - b), )),
+    Intrinsic.MUL: (2, 'arithmetic', lambda a, b: (word(a * b), )),
+    Intrinsic.DIVMOD: (2, 'arithmetic', fold_divmod),
+    Intrinsic.SHR: (2, 'arithmetic', lambda a, b: (word(unsigned_word(a) >> (b & 63)), )),
+    Intrinsic.SHL: (2, 'arithmetic', lambda a, b: (word(a << (b & 63)), )),
+    Intrinsic.OR: (2, 'arithmetic', lambda a, b: (word(a | b), )),
+    Intrinsic.AND: (2, 'arithmetic', lambda a, b: (word(a & b), )),
+    Intrinsic.NOT: (1, 'arithmetic', lambda a: (word(~a), )),
+    Intrinsic.EQ: (2, 'comparisons', lambda a, b: (int(word(a) == word(b)), )),
+    Intrinsic.NE: (2, 'comparisons', lambda a, b: (int(word(a) != word(b)), )),
+    Intrinsic.GT: (2, 'comparisons', lambda a, b: (int(word(a) > word(b)), )),
+    Intrinsic.LT: (2, 'comparisons', lambda a, b: (int(word(a) < word(b)), )),
+    Intrinsic.GE: (2, 'comparisons', lambda a, b: (int(word(a) >= word(b)), )),
+    Intrinsic.LE: (2, 'comparisons', lambda a, b: (int(word(a) <= word(b)), )),
+    Intrinsic.DUP: (1, 'stack ops', lambda a: (a, a)),
+    Intrinsic.SWAP: (2, 'stack ops', lambda a, b: (b, a)),
+    Intrinsic.DROP: (1, 'stack ops', lambda a: ()),
+    Intrinsic.OVER: (2, 'stack ops', lambda a, b: (a, b, a)),
+    Intrinsic.ROT: (3, 'stack ops', lambda a, b, c: (b, c, a)),
+}
+FOLD_STATISTICS = ['arithmetic', 'comparisons', 'stack ops', 'branches']
+
+def trailing_constants(out: Program, barrier: int, n: int) -> Optional[List[int]]:
+    '''Values of the last `n` ops of `out` after `barrier` if they all push an integer that fits a word'''
+    if len(out) - barrier < n:
+        return None
+    values = []
+    for op in out[len(out) - n:]:
+        if op.typ is not OpType.PUSH_INT:
+            return None
+        assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+        if not -2**63 <= op.operand < 2**64:
+            # leave it to the assembler to complain
+            return None
+        values.append(op.operand)
+    return values
+
+def fold_constants_pass(program: Program, depths: Optional[List[int]], stats: Dict[str, int]) -> Tuple[Program, Optional[List[int]]]:
+    '''One pass of constant folding over the program.
+
+    Values are only folded within a straight run of ops. A jump target is a
+    barrier because its stack depends on where the jump came from. `if`s with
+    a constant condition are replaced by the branch that is taken.
+    '''
+    targets = jump_targets(program)
+    out: Program = []
+    out_depths: List[int] = []
+    # the address of every op of `program` in `out`
+    addrs: List[OpAddr] = []
+    dropped: Set[OpAddr] = set()
+    barrier = 0
+    for ip in range(len(program)):
+        if ip in targets:
+            barrier = len(out)
+        addrs.append(len(out))
+        if ip in dropped:
+            continue
+        op = program[ip]
+        if op.typ is OpType.INTRINSIC:
+            fold = FOLD_INTRINSICS.get(op.operand)
+            if fold is not None:
+                arity, statistic, results = fold
+                values = trailing_constants(out, barrier, arity)
+                folded = None if values is None else results(*values)
+                if folded is not None:
+                    depth = out_depths[len(out) - arity]
+                    del out[len(out) - arity:]
+                    del out_depths[len(out_depths) - arity:]
+                    for i, value in enumerate(folded):
+                        out.append(Op(OpType.PUSH_INT, op.token, value, op.expanded_from))
+                        out_depths.append(depth + i)
+                    stats[statistic] += 1
+                    continue
+        elif op.typ is OpType.IF and trailing_constants(out, barrier, 1) is not None:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            condition = out.pop()
+            out_depths.pop()
+            assert isinstance(condition.operand, int), "This could be a bug in the compilation step"
+            stats['branches'] += 1
+            else_ip = op.operand - 1
+            if program[else_ip].typ == OpType.ELSE:
+                end_ip = program[else_ip].operand
+                assert isinstance(end_ip, int), "This could be a bug in the compilation step"
+                if unsigned_word(condition.operand) != 0:
+                    dropped.update(range(else_ip, end_ip + 1))
+                else:
+                    dropped.update(range(ip, else_ip + 1))
+                    dropped.add(end_ip)
+            else:
+                end_ip = op.operand
+                if unsigned_word(condition.operand) != 0:
+                    dropped.add(end_ip)
+                else:
+                    dropped.update(range(ip, end_ip + 1))
+            continue
+        elif op.typ in [OpType.IF, OpType.ELSE, OpType.END, OpType.DO]:
+            # the jump is remapped below
+            op = Op(op.typ, op.token, op.operand, op.expanded_from)
+        out.append(op)
+        out_depths.append(0 if depths is None else depths[ip])
+    addrs.append(len(out))
+    for op in out:
+        if op.typ in [OpType.IF, OpType.ELSE, OpType.END, OpType.DO]:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            op.operand = addrs[op.operand]
+    if depths is None:
+        return out, None
+    out_depths.append(depths[len(program)])
+    return out, out_depths
+
+def fold_constants(program: Program, depths: Optional[List[int]]) -> Tuple[Program, Optional[List[int]]]:
+    '''Fold the ops on compile time constants until there is nothing to fold.
+
+    `depths` are the depths of the data stack as returned by
+    type_check_program(). They are updated to match the folded program.
+    '''
+    passes = 0
+    while True:
+        stats = {statistic: 0 for statistic in FOLD_STATISTICS}
+        size = len(program)
+        program, depths = fold_constants_pass(program, depths, stats)
+        passes += 1
+        if debug:
+            print("[INFO] fold pass %d: %s; %d -> %d ops" % (passes, ", ".join("%d %s" % (stats[statistic], statistic) for statistic in FOLD_STATISTICS), size, len(program)))
+        if len(program) == size:
+            return program, depths
+
+INTRINSIC_ASM: Dict[Intrinsic, Tuple[str, ...]] = {
+    Intrinsic.PLUS: (
+        "    ;-- plus --",
+        "    pop rax",
+        "    pop rbx",
+        "    add rax, rbx",
+        "    push rax",
+    ),
+    Intrinsic.MINUS: (
+        "    ;-- minus --",
+        "    pop rax",
+        "    pop rbx",
+        "    sub rbx, rax",
+        "    push rbx",
+    ),
+    Intrinsic.MUL: (
+        "    ;-- mul --",
+        "    pop rax",
+        "    pop rbx",
+        "    mul rbx",
+        "    push rax",
+    ),
+    Intrinsic.DIVMOD: (
+        "    ;-- mod --",
+        "    xor rdx, rdx",
+        "    pop rbx",
+        "    pop rax",
+        "    div rbx",
+        "    push rax",
+        "    push rdx",
+    ),
+    Intrinsic.SHR: (
+        "    ;-- shr --",
+        "    pop rcx",
+        "    pop rbx",
+        "    shr rbx, cl",
+        "    push rbx",
+    ),
+    Intrinsic.SHL: (
+        "    ;-- shl --",
+        "    pop rcx",
+        "    pop rbx",
+        "    shl rbx, cl",
+        "    push rbx",
+    ),
+    Intrinsic.OR: (
+        "    ;-- bor --",
+        "    pop rax",
+        "    pop rbx",
+        "    or rbx, rax",
+        "    push rbx",
+    ),
+    Intrinsic.AND: (
+        "    ;-- band --",
+        "    pop rax",
+        "    pop rbx",
+        "    and rbx, rax",
+        "    push rbx",
+    ),
+    Intrinsic.NOT: (
+        "    ;-- not --",
+        "    pop rax",
+        "    not rax",
+        "    push rax",
+    ),
+    Intrinsic.PRINT: (
+        "    ;-- print --",
+        "    pop rax",
+        "    call printNum",
+    ),
+    Intrinsic.EQ: (
+        "    ;-- equal --",
+        "    mov rcx, 0",
+        "    mov rdx, 1",
+        "    pop rax",
+        "    pop rbx",
+        "    cmp rax, rbx",
+        "    cmove rcx, rdx",
+        "    push rcx",
+    ),
+    Intrinsic.GT: (
+        "    ;-- gt --",
+        "    mov rcx, 0",
+        "    mov rdx, 1",
+        "    pop rbx",
+        "    pop rax",
+        "    cmp rax, rbx",
+        "    cmovg rcx, rdx",
+        "    push rcx",
+    ),
+    Intrinsic.LT: (
+        "    ;-- gt --",
+        "    mov rcx, 0",
+        "    mov rdx, 1",
+        "    pop rbx",
+        "    pop rax",
+        "    cmp rax, rbx",
+        "    cmovl rcx, rdx",
+        "    push rcx",
+    ),
+    Intrinsic.GE: (
+        "    ;-- gt --",
+        "    mov rcx, 0",
+        "    mov rdx, 1",
+        "    pop rbx",
+        "    pop rax",
+        "    cmp rax, rbx",
+        "    cmovge rcx, rdx",
+        "    push rcx",
+    ),
+    Intrinsic.LE: (
+        "    ;-- gt --",
+        "    mov rcx, 0",
+        "    mov rdx, 1",
+        "    pop rbx",
+        "    pop rax",
+        "    cmp rax, rbx",
+        "    cmovle rcx, rdx",
+        "    push rcx",
+    ),
+    Intrinsic.NE: (
+        "    ;-- ne --",
+        "    mov rcx, 0",
+        "    mov rdx, 1",
+        "    pop rbx",
+        "    pop rax",
+        "    cmp rax, rbx",
+        "    cmovne rcx, rdx",
+        "    push rcx",
+    ),
+    Intrinsic.DUP: (
+        "    ;-- dup --",
+        "    pop rax",
+        "    push rax",
+        "    push rax",
+    ),
+    Intrinsic.SWAP: (
+        "    ;-- swap --",
+        "    pop rax",
+        "    pop rbx",
+        "    push rax",
+        "    push rbx",
+    ),
+    Intrinsic.DROP: (
+        "    ;-- drop --",
+        "    pop rax",
+    ),
+    Intrinsic.OVER: (
+        "    ;-- over --",
+        "    pop rax",
+        "    pop rbx",
+        "    push rbx",
+        "    push rax",
+        "    push rbx",
+    ),
+    Intrinsic.ROT: (
+        "    ;-- rot --",
+        "    pop rax",
+        "    pop rbx",
+        "    pop rcx",
+        "    push rbx",
+        "    push rax",
+        "    push rcx",
+    ),
+    Intrinsic.MEM: (
+        "    ;-- bit --",
+        "    push bit",
+    ),
+    Intrinsic.LOAD: (
+        "    ;-- load --",
+        "    pop rax",
+        "    xor rbx, rbx",
+        "    mov bl, [rax]",
+        "    push rbx",
+    ),
+    Intrinsic.STORE: (
+        "    ;-- store --",
+        "    pop rbx",
+        "    pop rax",
+        "    mov [rax], bl",
+    ),
+    Intrinsic.ARGC: (
+        "    ;-- argc --",
+        "    mov rax, [args_ptr]",
+        "    mov rax, [rax]",
+        "    push rax",
+    ),
+    Intrinsic.ARGV: (
+        "    ;-- argv --",
+        "    mov rax, [args_ptr]",
+        "    add rax, 8",
+        "    push rax",
+    ),
+    Intrinsic.LOAD64: (
+        "    ;-- load --",
+        "    pop rax",
+        "    xor rbx, rbx",
+        "    mov rbx, [rax]",
+        "    push rbx",
+    ),
+    Intrinsic.STORE64: (
+        "    ;-- store --",
+        "    pop rbx",
+        "    pop rax",
+        "    mov [rax], rbx",
+    ),
+    Intrinsic.CAST_PTR: (
+        "    ;-- cast(ptr) --",
+    ),
+    Intrinsic.SYSCALL0: (
+        "    ;-- syscall0 --",
+        "    pop rax",
+        "    syscall",
+        "    push rax",
+    ),
+    Intrinsic.SYSCALL1: (
+        "    ;-- syscall1 --",
+        "    pop rax",
+        "    pop rdi",
+        "    syscall",
+        "    push rax",
+    ),
+    Intrinsic.SYSCALL2: (
+        "    ;-- syscall2 --",
+        "    pop rax",
+        "    pop rdi",
+        "    pop rsi",
+        "    syscall",
+        "    push rax",
+    ),
+    Intrinsic.SYSCALL3: (
+        "    ;-- syscall3 --",
+        "    pop rax",
+        "    pop rdi",
+        "    pop rsi",
+        "    pop rdx",
+        "    syscall",
+        "    push rax",
+    ),
+    Intrinsic.SYSCALL4: (
+        "    ;-- syscall4 --",
+        "    pop rax",
+        "    pop rdi",
+        "    pop rsi",
+        "    pop rdx",
+        "    pop r10",
+        "    syscall",
+        "    push rax",
+    ),
+    Intrinsic.SYSCALL5: (
+        "    ;-- syscall5 --",
+        "    pop rax",
+        "    pop rdi",
+        "    pop rsi",
+        "    pop rdx",
+        "    pop r10",
+        "    pop r8",
+        "    syscall",
+        "    push rax",
+    ),
+    Intrinsic.SYSCALL6: (
+        "    ;-- syscall6 --",
+        "    pop rax",
+        "    pop rdi",
+        "    pop rsi",
+        "    pop rdx",
+        "    pop r10",
+        "    pop r8",
+        "    pop r9",
+        "    syscall",
+        "    push rax",
+    ),
+}
+assert len(INTRINSIC_ASM) == len(Intrinsic) - 1, "Every intrinsic but here has its assembly in INTRINSIC_ASM"
+INTRINSIC_ASM_NO_COMMENTS = {intrinsic: tuple(line for line in lines if not line.startswith("    ;")) for intrinsic, lines in INTRINSIC_ASM.items()}
+SYSCALL_INTRINSICS = {Intrinsic.SYSCALL0, Intrinsic.SYSCALL1, Intrinsic.SYSCALL2, Intrinsic.SYSCALL3, Intrinsic.SYSCALL4, Intrinsic.SYSCALL5, Intrinsic.SYSCALL6}
+
+def uses_output_buffer(program: Program) -> bool:
+    '''Whether the program prints with `prn`, so its syscalls have to flush the output buffer first'''
+    return any(op.typ == OpType.INTRINSIC and op.operand == Intrinsic.PRINT for op in program)
+
+def jump_targets(program: Program, rotated: Container[OpAddr] = ()) -> Set[OpAddr]:
+    '''Addresses of the ops that are jumped to by the generated code
+
+    The `end`s of the `rotated` loops don't jump, see loop_layout().
+    '''
+    targets: Set[OpAddr] = set()
+    jumps = (OpType.IF, OpType.ELSE, OpType.DO)
+    end = OpType.END
+    for ip, op in enumerate(program):
+        if op.typ in jumps or (op.typ is end and op.operand != ip + 1 and ip not in rotated):
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            targets.add(op.operand)
+    return targets
+
+@dataclass(slots=True)
+class BasicBlock:
+    '''The ops program[start:end]. Only the first op is jumped to and only the last one jumps.'''
+    start: OpAddr
+    end: OpAddr
+    # starts of the blocks the control flows to after this one
+    successors: List[OpAddr]
+
+def control_flow_graph(program: Program) -> Dict[OpAddr, BasicBlock]:
+    '''Basic blocks of the program by their start. The end of the program is the successor of the last block.'''
+    assert len(OpType) == 8, "Exhaustive ops handling in control_flow_graph()"
+    leaders = jump_targets(program)
+    leaders.add(0)
+    for ip, op in enumerate(program):
+        if op.typ in [OpType.IF, OpType.ELSE, OpType.END, OpType.DO]:
+            leaders.add(ip + 1)
+    leaders.discard(len(program))
+    starts = sorted(leaders)
+    cfg: Dict[OpAddr, BasicBlock] = {}
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(program)
+        last = program[end - 1]
+        if last.typ in [OpType.IF, OpType.DO]:
+            assert isinstance(last.operand, int), "This could be a bug in the compilation step"
+            successors = [end, last.operand]
+        elif last.typ in [OpType.ELSE, OpType.END]:
+            assert isinstance(last.operand, int), "This could be a bug in the compilation step"
+            successors = [last.operand]
+        else:
+            successors = [end]
+        cfg[start] = BasicBlock(start, end, successors)
+    return cfg
+
+# Longest condition of a while loop that is copied to the bottom of the loop
+LOOP_ROTATION_LIMIT = 32
+
+def rotated_loops(program: Program) -> Dict[OpAddr, Tuple[OpAddr, OpAddr]]:
+    '''The `while` and `do` of the loops that are rotated, by the address of their `end`.
+
+    A rotated loop checks its condition once before the first iteration and then
+    again at the bottom, so every iteration takes only the backward jump. Only
+    loops whose condition is a single basic block are rotated.
+    '''
+    cfg = control_flow_graph(program)
+    loops: Dict[OpAddr, Tuple[OpAddr, OpAddr]] = {}
+    for block in cfg.values():
+        end_ip = block.end - 1
+        op = program[end_ip]
+        if op.typ == OpType.END and block.successors[0] <= end_ip:
+            condition = cfg[block.successors[0]]
+            do_ip = condition.end - 1
+            if program[do_ip].typ == OpType.DO and do_ip - condition.start <= LOOP_ROTATION_LIMIT:
+                loops[end_ip] = (condition.start, do_ip)
+    return loops
+
+def loop_layout(program: Program, loops: Dict[OpAddr, Tuple[OpAddr, OpAddr]]) -> List[Tuple[OpAddr, bool]]:
+    '''The order in which the ops are generated as (address, copy) pairs.
+
+    The `end` of every rotated loop is followed by a copy of the condition of
+    the loop, whose `do` jumps back to the body while the condition holds.
+    '''
+    layout: List[Tuple[OpAddr, bool]] = []
+    for ip in range(len(program)):
+        layout.append((ip, False))
+        if ip in loops:
+            while_ip, do_ip = loops[ip]
+            layout.extend((copy_ip, True) for copy_ip in range(while_ip + 1, do_ip + 1))
+    return layout
+
+def generate_asm_prologue(asm: List[str]):
+    asm.append("BITS 64")
+    asm.append("global _start")
+    asm.append("_start:")
+    asm.append("    mov [args_ptr], rsp")
+
+@dataclass(slots=True)
+class AsmProfile:
+    '''Counters of the basic blocks of a -profile build, written to `counts_path` when the program exits'''
+    counts_path: str
+    # start of every basic block -> index of its counter
+    counters: Dict[OpAddr, int]
+
+def asm_profile(program: Program, counts_path: str) -> AsmProfile:
+    return AsmProfile(counts_path, {start: i for i, start in enumerate(control_flow_graph(program))})
+
+def generate_profile_counter(asm: List[str], profile: Optional[AsmProfile], program: Program, ip: OpAddr, copy: bool):
+    '''Count the block that starts at `ip`. A copy of the condition of a rotated loop counts the block of its `while`.'''
+    if profile is None:
+        return
+    if copy:
+        if program[ip - 1].typ != OpType.WHILE:
+            return
+        ip -= 1
+    if ip in profile.counters:
+        asm.append("    inc qword [profileCounters+%d]" % (8 * profile.counters[ip]))
+
+def generate_syscall_asm(asm: List[str], lines: Iterable[str], profile: Optional[AsmProfile]):
+    '''The lines of a syscall. With -profile the counters are written first if it is an exit.'''
+    for line in lines:
+        if profile is not None and line == "    syscall":
+            asm.append("    call profileExit")
+        asm.append(line)
+
+def generate_asm_epilogue(asm: List[str], strs: List[bytes], profile: Optional[AsmProfile] = None):
+    '''Exit at the end of the program, then memory, string literals and the runtime'''
+    asm.append("    call flushOutput")
+    if profile is not None:
+        asm.append("    call profileDump")
+    asm.append("    mov rax, 60")
+    asm.append("    xor rdi, rdi")
+    asm.append("    syscall")
+    asm.append("section .bss")
+    asm.append("args_ptr: resq 1")
+    asm.append("bit resb %d" % MEM_CAP)
+    asm.append("digitSpace resb %d" % DIGIT_SPACE_CAP)
+    asm.append("outputBuffer resb %d" % OUTPUT_BUFFER_CAP)
+    asm.append("outputLen resq 1")
+    if profile is not None:
+        asm.append("profileCounters resq %d" % len(profile.counters))
+    asm.append("section .data")
+    for i, s in enumerate(strs):
+        asm.append("str_%d: db %s" % (i, ','.join(map(hex, s))))
+    if profile is not None:
+        asm.append("profilePath: db %s" % ','.join(map(hex, profile.counts_path.encode('utf-8') + b'\0')))
+    asm.append("section .text")
+    if profile is not None:
+        generate_profile_runtime(asm, len(profile.counters))
+    # formats rax and a newline at the end of digitSpace and appends them to outputBuffer
+    asm.append("printNum:")
+    asm.append("    lea rsi, [digitSpace+%d]" % (DIGIT_SPACE_CAP - 1))
+    asm.append("    mov byte [rsi], 10")
+    asm.append("    mov rcx, 10")
+    asm.append("printNumLoop:")
+    asm.append("    xor edx, edx")
+    asm.append("    div rcx")
+    asm.append("    add dl, 48")
+    asm.append("    dec rsi")
+    asm.append("    mov [rsi], dl")
+    asm.append("    test rax, rax")
+    asm.append("    jnz printNumLoop")
+    asm.append("    lea rdx, [digitSpace+%d]" % DIGIT_SPACE_CAP)
+    asm.append("    sub rdx, rsi")
+    asm.append("    mov rdi, [outputLen]")
+    asm.append("    lea rax, [rdi+rdx]")
+    asm.append("    cmp rax, %d" % OUTPUT_BUFFER_CAP)
+    asm.append("    jbe printNumCopy")
+    asm.append("    push rsi")
+    asm.append("    push rdx")
+    asm.append("    call flushOutput")
+    asm.append("    pop rdx")
+    asm.append("    pop rsi")
+    asm.append("    xor edi, edi")
+    asm.append("    mov rax, rdx")
+    asm.append("printNumCopy:")
+    asm.append("    mov [outputLen], rax")
+    asm.append("    add rdi, outputBuffer")
+    asm.append("printNumCopyLoop:")
+    asm.append("    mov al, [rsi]")
+    asm.append("    mov [rdi], al")
+    asm.append("    inc rsi")
+    asm.append("    inc rdi")
+    asm.append("    dec rdx")
+    asm.append("    jnz printNumCopyLoop")
+    asm.append("    ret")
+    # writes outputBuffer to stdout. What is left after a failed write is lost.
+    asm.append("flushOutput:")
+    asm.append("    mov rsi, outputBuffer")
+    asm.append("    mov rdx, [outputLen]")
+    asm.append("flushOutputLoop:")
+    asm.append("    test rdx, rdx")
+    asm.append("    jz flushOutputDone")
+    asm.append("    mov rax, 1")
+    asm.append("    mov rdi, 1")
+    asm.append("    syscall")
+    asm.append("    test rax, rax")
+    asm.append("    jle flushOutputDone")
+    asm.append("    add rsi, rax")
+    asm.append("    sub rdx, rax")
+    asm.append("    jmp flushOutputLoop")
+    asm.append("flushOutputDone:")
+    asm.append("    mov qword [outputLen], 0")
+    asm.append("    ret")
+
+def generate_profile_runtime(asm: List[str], counters: int):
+    '''The routines that write the counters of a -profile build. They preserve all the registers but rcx and r11.'''
+    # called right before every syscall of the program, rax is the syscall number
+    asm.append("profileExit:")
+    asm.append("    cmp rax, 60")
+    asm.append("    je profileDump")
+    asm.append("    cmp rax, 231")
+    asm.append("    je profileDump")
+    asm.append("    ret")
+    # open(profilePath, O_WRONLY | O_CREAT | O_TRUNC, 0644), write, close
+    asm.append("profileDump:")
+    for reg in ['rax', 'rdi', 'rsi', 'rdx']:
+        asm.append("    push %s" % reg)
+    asm.append("    mov rax, 2")
+    asm.append("    mov rdi, profilePath")
+    asm.append("    mov rsi, 577")
+    asm.append("    mov rdx, 420")
+    asm.append("    syscall")
+    asm.append("    test rax, rax")
+    asm.append("    jl profileDumpDone")
+    asm.append("    mov rdi, rax")
+    asm.append("    mov rax, 1")
+    asm.append("    mov rsi, profileCounters")
+    asm.append("    mov rdx, %d" % (8 * counters))
+    asm.append("    syscall")
+    asm.append("    mov rax, 3")
+    asm.append("    syscall")
+    asm.append("profileDumpDone:")
+    for reg in ['rdx', 'rsi', 'rdi', 'rax']:
+        asm.append("    pop %s" % reg)
+    asm.append("    ret")
+
+# The conditional jump of `if`/`do` after a comparison, taken when the comparison is false
+COMPARE_JUMPS = {
+    Intrinsic.EQ: 'jne',
+    Intrinsic.NE: 'je',
+    Intrinsic.GT: 'jle',
+    Intrinsic.LT: 'jge',
+    Intrinsic.GE: 'jl',
+    Intrinsic.LE: 'jg',
+}
+NEGATED_JUMPS = {'je': 'jne', 'jne': 'je', 'jl': 'jge', 'jge': 'jl', 'jg': 'jle', 'jle': 'jg', 'jz': 'jnz', 'jnz': 'jz'}
+# Alignment of the first instruction of the body of rotated loops
+LOOP_ALIGNMENT = 16
+
+def fuses_with_next(program: Program, ip: OpAddr) -> bool:
+    '''Whether the op at `ip` is a comparison whose result is only used by the `if` or `do` right after it'''
+    return ip + 1 < len(program) and program[ip + 1].typ in [OpType.IF, OpType.DO] and program[ip].operand in COMPARE_JUMPS
+
+def generate_asm(program: Program, comments: bool = True, all_labels: bool = True, fuse_branches: bool = False, rotate_loops: bool = False, profile: Optional[AsmProfile] = None) -> List[str]:
+    '''Lines of the nasm assembly of the program, without the newlines.
+
+    Without `comments` the `;-- op --` comment lines are left out, without
+    `all_labels` only the `addr_N` labels that are actually jumped to are.
+    With `fuse_branches` a comparison followed by `if` or `do` becomes a `cmp`
+    and a conditional jump instead of pushing the boolean and testing it.
+    With `rotate_loops` the loops are laid out by loop_layout().
+    With a `profile` every basic block counts its executions.
+    '''
+    strs: List[bytes] = []
+    asm: List[str] = []
+    loops = rotated_loops(program) if rotate_loops else {}
+    targets = set() if all_labels else jump_targets(program, loops)
+    heads = {do_ip + 1 for _, do_ip in loops.values()}
+    targets |= heads
+    layout = loop_layout(program, loops) if rotate_loops else zip(range(len(program)), [False] * len(program))
+    intrinsic_asm = INTRINSIC_ASM if comments else INTRINSIC_ASM_NO_COMMENTS
+    flush = uses_output_buffer(program)
+    compare_jump: Optional[str] = None
+    assert len(OpType) == 8, "Exhaustive ops handling in compile"
+    generate_asm_prologue(asm)
+    for ip, copy in layout:
+        op = program[ip]
+        if not copy and (all_labels or ip in targets):
+            if ip in heads:
+                asm.append("    align %d" % LOOP_ALIGNMENT)
+            asm.append("addr_%d:" % ip)
+        generate_profile_counter(asm, profile, program, ip, copy)
+        if op.typ == OpType.INTRINSIC:
+            if op.operand == Intrinsic.HERE:
+                value = ("%s:%d:%d" % op.token.loc).encode('utf-8')
+                n = len(value)
+                if comments:
+                    asm.append("    ;-- here --")
+                asm.append("    mov rax, %d" % n)
+                asm.append("    push rax")
+                asm.append("    push str_%d" % len(strs))
+                strs.append(value)
+            elif fuse_branches and fuses_with_next(program, ip):
+                if comments:
+                    asm.append(INTRINSIC_ASM[op.operand][0])
+                asm.append("    pop rbx")
+                asm.append("    pop rax")
+                asm.append("    cmp rax, rbx")
+                compare_jump = COMPARE_JUMPS[op.operand]
+            elif (flush or profile is not None) and op.operand in SYSCALL_INTRINSICS:
+                if comments:
+                    asm.append(INTRINSIC_ASM[op.operand][0])
+                if flush:
+                    asm.append("    call flushOutput")
+                generate_syscall_asm(asm, INTRINSIC_ASM_NO_COMMENTS[op.operand], profile)
+            else:
+                assert isinstance(op.operand, Intrinsic), "This could be a bug in the compilation step"
+                asm.extend(intrinsic_asm[op.operand])
+        elif op.typ == OpType.PUSH_INT:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            if comments:
+                asm.append("    ;-- push int %d --" % op.operand)
+            asm.append("    mov rax, %d" % op.operand)
+            asm.append("    push rax")
+        elif op.typ == OpType.PUSH_STR:
+            assert isinstance(op.operand, str), "This could be a bug in the compilation step"
+            value = op.operand.encode('utf-8')
+            n = len(value)
+            if comments:
+                asm.append("    ;-- push str --")
+            asm.append("    mov rax, %d" % n)
+            asm.append("    push rax")
+            asm.append("    push str_%d" % len(strs))
+            strs.append(value)
+        elif op.typ == OpType.IF:
+            if comments:
+                asm.append("    ;-- if --")
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            if compare_jump is not None:
+                asm.append("    %s addr_%d" % (compare_jump, op.operand))
+                compare_jump = None
+            else:
+                asm.append("    pop rax")
+                asm.append("    test rax, rax")
+                asm.append("    jz addr_%d" % op.operand)
+        elif op.typ == OpType.ELSE:
+            if comments:
+                asm.append("    ;-- else --")
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            asm.append("    jmp addr_%d" % op.operand)
+        elif op.typ == OpType.END:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            if comments:
+                asm.append("    ;-- end --")
+            if ip + 1 != op.operand and ip not in loops:
+                asm.append("    jmp addr_%d" % op.operand)
+        elif op.typ == OpType.WHILE:
+            if comments:
+                asm.append("    ;-- while --")
+        elif op.typ == OpType.DO:
+            if comments:
+                asm.append("    ;-- do --")
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            # the copy at the bottom of a rotated loop jumps back to the body
+            jump, target = ('jnz', ip + 1) if copy else ('jz', op.operand)
+            if compare_jump is not None:
+                asm.append("    %s addr_%d" % (NEGATED_JUMPS[compare_jump] if copy else compare_jump, target))
+                compare_jump = None
+            else:
+                asm.append("    pop rax")
+                asm.append("    test rax, rax")
+                asm.append("    %s addr_%d" % (jump, target))
+        else:
+            assert False, "unreachable"
+    if all_labels or len(program) in targets:
+        asm.append("addr_%d:" % len(program))
+    generate_asm_epilogue(asm, strs, profile)
+    return asm
+
+# Registers that keep the top of the data stack in generate_cached_asm(),
+# deepest first in the canonical state. The runtime must preserve them.
+CACHE_REGISTERS = ['r12', 'r13', 'r14']
+CACHE_BYTE_REGISTERS = {'r12': 'r12b', 'r13': 'r13b', 'r14': 'r14b'}
+SYSCALL_ARGUMENT_REGISTERS = ['rax', 'rdi', 'rsi', 'rdx', 'r10', 'r8', 'r9']
+CACHE_ALU = {
+    Intrinsic.PLUS: 'add',
+    Intrinsic.MINUS: 'sub',
+    Intrinsic.MUL: 'imul',
+    Intrinsic.OR: 'or',
+    Intrinsic.AND: 'and',
+}
+CACHE_SETCC = {
+    Intrinsic.EQ: 'sete',
+    Intrinsic.NE: 'setne',
+    Intrinsic.GT: 'setg',
+    Intrinsic.LT: 'setl',
+    Intrinsic.GE: 'setge',
+    Intrinsic.LE: 'setle',
+}
+
+# A cached value is either the register that holds it or an integer constant
+# that hasn't been moved into a register yet
+CachedValue = Union[str, int]
+
+@dataclass(slots=True)
+class RegisterCache:
+    '''The top values of the data stack at the current point of generate_cached_asm()'''
+    asm: List[str]
+    # the top of the stack last
+    values: List[CachedValue] = field(default_factory=list)
+
+def is_immediate32(value: CachedValue) -> bool:
+    return isinstance(value, int) and -2**31 <= value < 2**31
+
+def cache_free_register(cache: RegisterCache) -> str:
+    for reg in CACHE_REGISTERS:
+        if reg not in cache.values:
+            return reg
+    assert False, "The register cache is full"
+
+def cache_register(cache: RegisterCache, index: int) -> str:
+    '''Register of cache.values[index], moving the constant into a free one if it is one'''
+    value = cache.values[index]
+    if isinstance(value, int):
+        reg = cache_free_register(cache)
+        cache.asm.append("    mov %s, %d" % (reg, value))
+        cache.values[index] = reg
+        return reg
+    return value
+
+def cache_spill(cache: RegisterCache):
+    '''Push the deepest cached value to the memory stack'''
+    value = cache.values[0]
+    if isinstance(value, int) and not is_immediate32(value):
+        cache.asm.append("    mov rax, %d" % value)
+        value = 'rax'
+    cache.asm.append("    push %s" % value)
+    cache.values.pop(0)
+
+def cache_load(cache: RegisterCache, n: int):
+    '''Pop values from the memory stack until the top `n` values are cached'''
+    assert n <= len(CACHE_REGISTERS)
+    while len(cache.values) < n:
+        reg = cache_free_register(cache)
+        cache.asm.append("    pop %s" % reg)
+        cache.values.insert(0, reg)
+
+def cache_push(cache: RegisterCache, value: Optional[int] = None) -> str:
+    '''Register for a new top value, spilling the deepest cached value if there's none free.
+
+    With `value` the new top is that constant and no register is taken.
+    '''
+    if len(cache.values) == len(CACHE_REGISTERS):
+        cache_spill(cache)
+    if value is not None:
+        cache.values.append(value)
+        return ''
+    reg = cache_free_register(cache)
+    cache.values.append(reg)
+    return reg
+
+def cache_canonicalize(cache: RegisterCache, n: int):
+    '''Keep exactly the top `n` values in the first `n` CACHE_REGISTERS, which is the state at every jump and jump target'''
+    while len(cache.values) > n:
+        cache_spill(cache)
+    cache_load(cache, n)
+    for i in range(n):
+        want = CACHE_REGISTERS[i]
+        have = cache.values[i]
+        if isinstance(have, int) or have == want:
+            continue
+        if want in cache.values:
+            cache.asm.append("    xchg %s, %s" % (have, want))
+            cache.values[cache.values.index(want)] = have
+        else:
+            cache.asm.append("    mov %s, %s" % (want, have))
+        cache.values[i] = want
+    # the registers of the constants are free now
+    for i in range(n):
+        if isinstance(cache.values[i], int):
+            cache.asm.append("    mov %s, %d" % (CACHE_REGISTERS[i], cache.values[i]))
+            cache.values[i] = CACHE_REGISTERS[i]
+
+def canonical_cache_size(depths: Optional[List[int]], ip: OpAddr) -> int:
+    return 0 if depths is None else min(depths[ip], len(CACHE_REGISTERS))
+
+def generate_cached_asm(program: Program, depths: Optional[List[int]], comments: bool = True, profile: Optional[AsmProfile] = None) -> Tuple[List[str], Dict[str, Set[str]]]:
+    '''Like generate_asm() but keeps up to len(CACHE_REGISTERS) top values of the data stack in registers.
+
+    `depths` are the depths of the data stack before every op as returned by
+    type_check_program(). Every jump target starts with the top
+    min(depth, len(CACHE_REGISTERS)) values in registers, so loops can keep
+    their values in registers across iterations. Without the depths (-unsafe)
+    the cache is spilled to memory at every jump and jump target. The loops
+    are laid out by loop_layout().
+
+    Also returns the registers that are live at every label for optimize_asm().
+    '''
+    strs: List[bytes] = []
+    asm: List[str] = []
+    live: Dict[str, Set[str]] = {}
+    cache = RegisterCache(asm)
+    loops = rotated_loops(program)
+    heads = {do_ip + 1 for _, do_ip in loops.values()}
+    targets = jump_targets(program, loops) | heads
+    layout = loop_layout(program, loops)
+    layout.append((len(program), False))
+    reachable = True
+    flush = uses_output_buffer(program)
+    compare_jump: Optional[str] = None
+    assert len(OpType) == 8, "Exhaustive ops handling in generate_cached_asm()"
+    assert len(Intrinsic) == 37, "Exhaustive intrinsic handling in generate_cached_asm()"
+    generate_asm_prologue(asm)
+    for ip, copy in layout:
+        if not copy and ip in targets:
+            if reachable:
+                cache_canonicalize(cache, canonical_cache_size(depths, ip))
+            else:
+                cache.values = list(CACHE_REGISTERS[:canonical_cache_size(depths, ip)])
+            if ip in heads:
+                asm.append("    align %d" % LOOP_ALIGNMENT)
+            asm.append("addr_%d:" % ip)
+            live["addr_%d" % ip] = set(CACHE_REGISTERS[:canonical_cache_size(depths, ip)])
+            reachable = True
+        if ip == len(program):
+            break
+        op = program[ip]
+        generate_profile_counter(asm, profile, program, ip, copy)
+        if comments:
+            if op.typ == OpType.INTRINSIC:
+                asm.append(INTRINSIC_ASM[op.operand][0] if op.operand != Intrinsic.HERE else "    ;-- here --")
+            elif op.typ == OpType.PUSH_INT:
+                asm.append("    ;-- push int %d --" % op.operand)
+            else:
+                asm.append("    ;-- %s --" % op.typ.name.lower().replace('_', ' '))
+        if op.typ == OpType.INTRINSIC:
+            if op.operand in CACHE_ALU:
+                cache_load(cache, 2)
+                a = cache_register(cache, -2)
+                if not is_immediate32(cache.values[-1]):
+                    cache_register(cache, -1)
+                b = cache.values.pop()
+                asm.append("    %s %s, %s" % (CACHE_ALU[op.operand], a, b))
+            elif op.operand == Intrinsic.DIVMOD:
+                cache_load(cache, 2)
+                a = cache_register(cache, -2)
+                b = cache_register(cache, -1)
+                asm.append("    xor rdx, rdx")
+                asm.append("    mov rax, %s" % a)
+                asm.append("    div %s" % b)
+                asm.append("    mov %s, rax" % a)
+                asm.append("    mov %s, rdx" % b)
+            elif op.operand in [Intrinsic.SHR, Intrinsic.SHL]:
+                cache_load(cache, 2)
+                a = cache_register(cache, -2)
+                b = cache.values.pop()
+                mnemonic = 'shr' if op.operand == Intrinsic.SHR else 'shl'
+                if isinstance(b, int) and 0 <= b < 256:
+                    asm.append("    %s %s, %d" % (mnemonic, a, b))
+                else:
+                    asm.append("    mov rcx, %s" % b)
+                    asm.append("    %s %s, cl" % (mnemonic, a))
+            elif op.operand == Intrinsic.NOT:
+                cache_load(cache, 1)
+                asm.append("    not %s" % cache_register(cache, -1))
+            elif op.operand == Intrinsic.PRINT:
+                if len(cache.values) > 0:
+                    asm.append("    mov rax, %s" % cache.values.pop())
+                else:
+                    asm.append("    pop rax")
+                asm.append("    call printNum")
+            elif op.operand in CACHE_SETCC:
+                cache_load(cache, 2)
+                a = cache_register(cache, -2)
+                if not is_immediate32(cache.values[-1]):
+                    cache_register(cache, -1)
+                b = cache.values.pop()
+                asm.append("    cmp %s, %s" % (a, b))
+                if fuses_with_next(program, ip):
+                    cache.values.pop()
+                    compare_jump = COMPARE_JUMPS[op.operand]
+                else:
+                    asm.append("    %s al" % CACHE_SETCC[op.operand])
+                    asm.append("    movzx %s, al" % a)
+            elif op.operand == Intrinsic.DUP:
+                cache_load(cache, 1)
+                a = cache.values[-1]
+                if isinstance(a, int):
+                    cache_push(cache, a)
+                else:
+                    asm.append("    mov %s, %s" % (cache_push(cache), a))
+            elif op.operand == Intrinsic.SWAP:
+                cache_load(cache, 2)
+                cache.values[-2], cache.values[-1] = cache.values[-1], cache.values[-2]
+            elif op.operand == Intrinsic.DROP:
+                if len(cache.values) > 0:
+                    cache.values.pop()
+                else:
+                    asm.append("    add rsp, 8")
+            elif op.operand == Intrinsic.OVER:
+                cache_load(cache, 2)
+                a = cache.values[-2]
+                if isinstance(a, int):
+                    cache_push(cache, a)
+                else:
+                    reg = cache_push(cache)
+                    asm.append("    mov %s, %s" % (reg, a))
+            elif op.operand == Intrinsic.ROT:
+                cache_load(cache, 3)
+                a, b, c = cache.values[-3:]
+                cache.values[-3:] = [b, c, a]
+            elif op.operand == Intrinsic.MEM:
+                asm.append("    mov %s, bit" % cache_push(cache))
+            elif op.operand == Intrinsic.LOAD:
+                cache_load(cache, 1)
+                reg = cache_register(cache, -1)
+                asm.append("    movzx %s, byte [%s]" % (reg, reg))
+            elif op.operand == Intrinsic.STORE:
+                cache_load(cache, 2)
+                address = cache_register(cache, -2)
+                value = cache_register(cache, -1)
+                cache.values[-2:] = []
+                asm.append("    mov [%s], %s" % (address, CACHE_BYTE_REGISTERS[value]))
+            elif op.operand == Intrinsic.LOAD64:
+                cache_load(cache, 1)
+                reg = cache_register(cache, -1)
+                asm.append("    mov %s, [%s]" % (reg, reg))
+            elif op.operand == Intrinsic.STORE64:
+                cache_load(cache, 2)
+                address = cache_register(cache, -2)
+                value = cache_register(cache, -1)
+                cache.values[-2:] = []
+                asm.append("    mov [%s], %s" % (address, value))
+            elif op.operand == Intrinsic.CAST_PTR:
+                pass
+            elif op.operand == Intrinsic.ARGC:
+                reg = cache_push(cache)
+                asm.append("    mov %s, [args_ptr]" % reg)
+                asm.append("    mov %s, [%s]" % (reg, reg))
+            elif op.operand == Intrinsic.ARGV:
+                reg = cache_push(cache)
+                asm.append("    mov %s, [args_ptr]" % reg)
+                asm.append("    add %s, 8" % reg)
+            elif op.operand == Intrinsic.HERE:
+                value = ("%s:%d:%d" % op.token.loc).encode('utf-8')
+                cache_push(cache, len(value))
+                asm.append("    mov %s, str_%d" % (cache_push(cache), len(strs)))
+                strs.append(value)
+            elif op.operand in SYSCALL_INTRINSICS:
+                if flush:
+                    asm.append("    call flushOutput")
+                for reg in SYSCALL_ARGUMENT_REGISTERS[:INTRINSIC_SIGNATURES[op.operand].arity]:
+                    if len(cache.values) > 0:
+                        asm.append("    mov %s, %s" % (reg, cache.values.pop()))
+                    else:
+                        asm.append("    pop %s" % reg)
+                generate_syscall_asm(asm, ["    syscall"], profile)
+                asm.append("    mov %s, rax" % cache_push(cache))
+            else:
+                assert False, "unreachable"
+        elif op.typ == OpType.PUSH_INT:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            cache_push(cache, op.operand)
+        elif op.typ == OpType.PUSH_STR:
+            assert isinstance(op.operand, str), "This could be a bug in the compilation step"
+            value = op.operand.encode('utf-8')
+            cache_push(cache, len(value))
+            asm.append("    mov %s, str_%d" % (cache_push(cache), len(strs)))
+            strs.append(value)
+        elif op.typ in [OpType.IF, OpType.DO]:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            jump = 'jz'
+            if compare_jump is not None:
+                jump = compare_jump
+                compare_jump = None
+            else:
+                cache_load(cache, 1)
+                reg = cache_register(cache, -1)
+                cache.values.pop()
+                asm.append("    test %s, %s" % (reg, reg))
+            # neither spilling nor moving the cached values changes the flags.
+            # Both the body and the code after a loop start with the stack the
+            # loop started with, so the copy at the bottom of a rotated loop can
+            # canonicalize for either.
+            cache_canonicalize(cache, canonical_cache_size(depths, op.operand))
+            if copy:
+                asm.append("    %s addr_%d" % (NEGATED_JUMPS[jump], ip + 1))
+            else:
+                asm.append("    %s addr_%d" % (jump, op.operand))
+        elif op.typ in [OpType.ELSE, OpType.END]:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            if op.operand != ip + 1 and ip not in loops:
+                cache_canonicalize(cache, canonical_cache_size(depths, op.operand))
+                asm.append("    jmp addr_%d" % op.operand)
+                reachable = False
+        elif op.typ == OpType.WHILE:
+            pass
+        else:
+            assert False, "unreachable"
+    generate_asm_epilogue(asm, strs, profile)
+    return asm, live
+
+
+class AsmLineType(Enum):
+    COMMENT=auto()
+    LABEL=auto()
+    # an instruction that only reads and writes registers, flags and memory
+    INSTRUCTION=auto()
+    # jumps, calls and returns
+    CONTROL=auto()
+    # directives and everything the optimizer does not understand
+    OTHER=auto()
+
+@dataclass(slots=True)
+class AsmLine:
+    typ: AsmLineType
+    text: str
+    mnemonic: str = ''
+    operands: List[str] = field(default_factory=list)
+    reads: Set[str] = field(default_factory=set)
+    writes: Set[str] = field(default_factory=set)
+    # reads or writes memory, including the stack
+    memory: bool = False
+
+# Every name of a general purpose register mapped to its 64-bit register
+ASM_REGISTERS: Dict[str, str] = {
+    **{name % x: 'r%sx' % x for x in 'abcd' for name in ['r%sx', 'e%sx', '%sx', '%sl']},
+    **{name % x: 'r%s' % x for x in ['si', 'di', 'sp', 'bp'] for name in ['r%s', 'e%s', '%s', '%sl']},
+    **{name % i: 'r%d' % i for i in range(8, 16) for name in ['r%d', 'r%dd', 'r%dw', 'r%db']},
+}
+ASM_REGISTERS_64 = set(ASM_REGISTERS.values())
+ASM_INT_REGEX = re.compile(r'-?\d+')
+ASM_MEMORY_REGISTER_REGEX = re.compile(r'\w+')
+# Labels of ops. The generated code doesn't keep values in registers across
+# ops except for the CACHE_REGISTERS, so no other register is live at them.
+# optimize_asm() records the live ones in the `reads` of the labels and of the
+# jumps to them.
+ASM_OP_LABEL_PREFIX = 'addr_'
+# The registers the runtime routines read and the ones they overwrite on every path
+ASM_RUNTIME_CALLS: Dict[str, Tuple[Set[str], Set[str]]] = {
+    'printNum': ({'rax'}, {'rax', 'rcx', 'rdx', 'rsi', 'rdi'}),
+    'flushOutput': (set(), {'rdx', 'rsi'}),
+    'profileExit': ({'rax'}, set()),
+    'profileDump': (set(), set()),
+}
+ASM_SYSCALL_READS = {'rax', 'rdi', 'rsi', 'rdx', 'r10', 'r8', 'r9'}
+ASM_SYSCALL_WRITES = {'rax', 'rcx', 'r11'}
+ASM_ALU_MNEMONICS = {'add', 'sub', 'imul', 'and', 'or', 'xor', 'shl', 'shr'}
+ASM_FLAGS_WRITERS = ASM_ALU_MNEMONICS | {'cmp', 'test', 'inc', 'dec', 'neg', 'mul', 'div'}
+# How many instructions the optimizer looks ahead from any instruction
+ASM_PEEPHOLE_WINDOW = 32
+
+def asm_operand_registers(operand: str) -> Set[str]:
+    if operand.endswith(']'):
+        return {ASM_REGISTERS[name] for name in ASM_MEMORY_REGISTER_REGEX.findall(operand) if name in ASM_REGISTERS}
+    if operand in ASM_REGISTERS:
+        return {ASM_REGISTERS[operand]}
+    return set()
+
+def asm_is_immediate32(operand: str) -> bool:
+    return ASM_INT_REGEX.fullmatch(operand) is not None and -2**31 <= int(operand) < 2**31
+
+def asm_instruction(mnemonic: str, operands: List[str], cache: Dict[str, AsmLine]) -> AsmLine:
+    text = "    %s %s" % (mnemonic, ", ".join(operands)) if len(operands) > 0 else "    %s" % mnemonic
+    return parse_asm_line(text, cache)
+
+def parse_asm_instruction(text: str, mnemonic: str, operands: List[str]) -> AsmLine:
+    line = AsmLine(AsmLineType.INSTRUCTION, text, mnemonic, operands)
+    if mnemonic in ['push', 'pop']:
+        line.memory = True
+        line.reads.add('rsp')
+        line.writes.add('rsp')
+        if mnemonic == 'push':
+            line.reads |= asm_operand_registers(operands[0])
+        else:
+            line.writes |= asm_operand_registers(operands[0])
+        return line
+    if mnemonic == 'syscall':
+        line.memory = True
+        line.reads |= ASM_SYSCALL_READS
+        line.writes |= ASM_SYSCALL_WRITES
+        return line
+    if mnemonic == 'lea':
+        line.reads |= asm_operand_registers(operands[1])
+        line.writes |= asm_operand_registers(operands[0])
+        return line
+    line.memory = any(operand.endswith(']') for operand in operands)
+    if mnemonic in ['mul', 'div']:
+        line.reads |= {'rax'} | asm_operand_registers(operands[0])
+        if mnemonic == 'div':
+            line.reads.add('rdx')
+        line.writes |= {'rax', 'rdx'}
+    elif mnemonic in ['mov', 'movzx'] or mnemonic.startswith('cmov'):
+        dst, src = operands
+        line.reads |= asm_operand_registers(src)
+        if dst.endswith(']') or dst not in ASM_REGISTERS_64 or mnemonic.startswith('cmov'):
+            # stores read the address, partial writes and cmovs the old value
+            line.reads |= asm_operand_registers(dst)
+        if not dst.endswith(']'):
+            line.writes |= asm_operand_registers(dst)
+    elif mnemonic in ASM_ALU_MNEMONICS or mnemonic in ['cmp', 'test', 'not', 'neg', 'inc', 'dec']:
+        if not (mnemonic == 'xor' and operands[0] == operands[1]):
+            for operand in operands:
+                line.reads |= asm_operand_registers(operand)
+        if mnemonic not in ['cmp', 'test']:
+            line.writes |= asm_operand_registers(operands[0])
+    elif mnemonic == 'xchg':
+        for operand in operands:
+            line.reads |= asm_operand_registers(operand)
+            line.writes |= asm_operand_registers(operand)
+    elif mnemonic.startswith('set'):
+        line.reads |= asm_operand_registers(operands[0])
+        line.writes |= asm_operand_registers(operands[0])
+    elif mnemonic == 'align':
+        # padding with nops
+        pass
+    else:
+        line.typ = AsmLineType.OTHER
+    return line
+
+def parse_asm_line(text: str, cache: Dict[str, AsmLine]) -> AsmLine:
+    '''Parsed line of assembly. AsmLines are never modified, so equal lines share one.'''
+    line = cache.get(text)
+    if line is None:
+        line = cache[text] = parse_new_asm_line(text)
+    return line
+
+def parse_new_asm_line(text: str) -> AsmLine:
+    stripped = text.strip()
+    if stripped == '' or stripped.startswith(';'):
+        return AsmLine(AsmLineType.COMMENT, text)
+    if stripped.endswith(':'):
+        return AsmLine(AsmLineType.LABEL, text, operands=[stripped[:-1]])
+    if not text.startswith("    "):
+        return AsmLine(AsmLineType.OTHER, text)
+    mnemonic, _, rest = stripped.partition(' ')
+    operands = [operand.strip() for operand in rest.split(',')] if rest != '' else []
+    if mnemonic.startswith('j') or mnemonic in ['call', 'ret']:
+        return AsmLine(AsmLineType.CONTROL, text, mnemonic, operands)
+    return parse_asm_instruction(text, mnemonic, operands)
+
+def asm_register_dead(code: List[Optional[AsmLine]], ip: int, reg: str) -> bool:
+    '''Whether `reg` is written before it is read on every path after code[ip]
+
+    Anything the optimizer can't see through within ASM_PEEPHOLE_WINDOW
+    instructions counts as a read.
+    '''
+    seen = 0
+    ip += 1
+    while ip < len(code) and seen < ASM_PEEPHOLE_WINDOW:
+        line = code[ip]
+        ip += 1
+        if line is None or line.typ == AsmLineType.COMMENT:
+            continue
+        seen += 1
+        if line.typ == AsmLineType.INSTRUCTION:
+            if reg in line.reads:
+                return False
+            if reg in line.writes:
+                return True
+        elif line.typ == AsmLineType.LABEL:
+            return line.operands[0].startswith(ASM_OP_LABEL_PREFIX) and reg not in line.reads
+        elif line.typ == AsmLineType.CONTROL:
+            target = line.operands[0] if len(line.operands) > 0 else ''
+            if line.mnemonic == 'call':
+                if target not in ASM_RUNTIME_CALLS:
+                    return False
+                reads, writes = ASM_RUNTIME_CALLS[target]
+                if reg in reads:
+                    return False
+                if reg in writes:
+                    return True
+            elif not target.startswith(ASM_OP_LABEL_PREFIX) or reg in line.reads:
+                return False
+            elif line.mnemonic == 'jmp':
+                return True
+        else:
+            return False
+    return False
+
+def asm_flags_dead(code: List[Optional[AsmLine]], ip: int) -> bool:
+    '''Whether the flags are written before they are read on every path after code[ip]'''
+    seen = 0
+    ip += 1
+    while ip < len(code) and seen < ASM_PEEPHOLE_WINDOW:
+        line = code[ip]
+        ip += 1
+        if line is None or line.typ == AsmLineType.COMMENT:
+            continue
+        seen += 1
+        if line.typ == AsmLineType.INSTRUCTION:
+            if line.mnemonic.startswith('cmov') or line.mnemonic.startswith('set'):
+                return False
+            if line.mnemonic in ASM_FLAGS_WRITERS:
+                return True
+        elif line.typ == AsmLineType.LABEL:
+            return line.operands[0].startswith(ASM_OP_LABEL_PREFIX)
+        elif line.typ == AsmLineType.CONTROL:
+            target = line.operands[0] if len(line.operands) > 0 else ''
+            if line.mnemonic == 'call':
+                return target in ASM_RUNTIME_CALLS
+            return line.mnemonic == 'jmp' and target.startswith(ASM_OP_LABEL_PREFIX)
+        else:
+            return False
+    return False
+
+def asm_next_instruction(code: List[Optional[AsmLine]], ip: int) -> int:
+    ip += 1
+    while ip < len(code) and (code[ip] is None or code[ip].typ == AsmLineType.COMMENT):
+        ip += 1
+    return ip
+
+def asm_fold_push_pop(code: List[Optional[AsmLine]], ip: int, cache: Dict[str, AsmLine]) -> bool:
+    '''push X ... pop Y => mov Y, X
+
+    Only register instructions may be in between. The move goes where X is
+    still intact, which is the pop unless X is overwritten in between.
+    '''
+    push = code[ip]
+    assert push is not None
+    value = push.operands[0]
+    value_regs = push.reads - {'rsp'}
+    between: List[AsmLine] = []
+    pop_ip = asm_next_instruction(code, ip)
+    while pop_ip < len(code) and len(between) < ASM_PEEPHOLE_WINDOW:
+        line = code[pop_ip]
+        assert line is not None
+        if line.typ != AsmLineType.INSTRUCTION:
+            return False
+        if line.mnemonic == 'pop':
+            break
+        if line.memory or 'rsp' in line.reads or 'rsp' in line.writes:
+            return False
+        between.append(line)
+        pop_ip = asm_next_instruction(code, pop_ip)
+    else:
+        return False
+    pop = code[pop_ip]
+    assert pop is not None
+    target = pop.operands[0]
+    if target not in ASM_REGISTERS_64:
+        return False
+    if not any(line.writes & value_regs for line in between):
+        code[ip] = None
+        code[pop_ip] = None if target == value else asm_instruction('mov', [target, value], cache)
+        return True
+    if not any(target in line.reads or target in line.writes for line in between):
+        code[ip] = asm_instruction('mov', [target, value], cache)
+        code[pop_ip] = None
+        return True
+    return False
+
+def asm_substitute(line: AsmLine, reg: str, value: str) -> Optional[List[str]]:
+    '''Operands of `line` with the read of `reg` replaced by `value`, if the instruction has such a form'''
+    operands = line.operands
+    is_reg = value in ASM_REGISTERS_64
+    if line.mnemonic == 'push':
+        if operands[0] == reg and (is_reg or ASM_INT_REGEX.fullmatch(value) is None or asm_is_immediate32(value)):
+            return [value]
+    elif line.mnemonic == 'mov':
+        if operands[1] == reg and operands[0] in ASM_REGISTERS_64:
+            return [operands[0], value]
+    elif line.mnemonic in ['add', 'sub', 'and', 'or', 'xor', 'cmp']:
+        if operands[1] == reg and operands[0] != reg and operands[0] in ASM_REGISTERS_64 and (is_reg or asm_is_immediate32(value)):
+            return [operands[0], value]
+        if line.mnemonic == 'cmp' and operands[0] == reg and operands[1] != reg and is_reg:
+            return [value, operands[1]]
+    elif line.mnemonic == 'test':
+        if is_reg and all(operand in ASM_REGISTERS_64 for operand in operands):
+            return [value if operand == reg else operand for operand in operands]
+    elif line.mnemonic == 'lea':
+        if is_reg and operands[0] != reg:
+            return [operands[0], re.sub(r'\b%s\b' % reg, value, operands[1])]
+    return None
+
+def asm_propagate_mov(code: List[Optional[AsmLine]], ip: int, cache: Dict[str, AsmLine]) -> bool:
+    '''mov R, V ... OP R => OP V, when R is dead after OP'''
+    mov = code[ip]
+    assert mov is not None
+    reg, value = mov.operands
+    if reg not in ASM_REGISTERS_64 or reg == 'rsp' or value.endswith(']'):
+        return False
+    use_ip = asm_next_instruction(code, ip)
+    seen = 0
+    while use_ip < len(code) and seen < ASM_PEEPHOLE_WINDOW:
+        line = code[use_ip]
+        assert line is not None
+        if line.typ != AsmLineType.INSTRUCTION:
+            return False
+        if reg in line.reads:
+            break
+        if reg in line.writes or line.writes & mov.reads:
+            return False
+        seen += 1
+        use_ip = asm_next_instruction(code, use_ip)
+    else:
+        return False
+    use = code[use_ip]
+    assert use is not None
+    operands = asm_substitute(use, reg, value)
+    if operands is None or not asm_register_dead(code, use_ip, reg):
+        return False
+    code[ip] = None
+    code[use_ip] = asm_instruction(use.mnemonic, operands, cache)
+    return True
+
+def asm_fold_add_immediate(code: List[Optional[AsmLine]], ip: int, cache: Dict[str, AsmLine]) -> bool:
+    '''mov A, imm ... add A, B => lea A, [B+imm]'''
+    mov = code[ip]
+    assert mov is not None
+    reg, value = mov.operands
+    if reg not in ASM_REGISTERS_64 or not asm_is_immediate32(value):
+        return False
+    add_ip = asm_next_instruction(code, ip)
+    seen = 0
+    while add_ip < len(code) and seen < ASM_PEEPHOLE_WINDOW:
+        line = code[add_ip]
+        assert line is not None
+        if line.typ != AsmLineType.INSTRUCTION:
+            return False
+        if reg in line.reads or reg in line.writes:
+            break
+        seen += 1
+        add_ip = asm_next_instruction(code, add_ip)
+    else:
+        return False
+    add = code[add_ip]
+    assert add is not None
+    if add.mnemonic != 'add' or add.operands[0] != reg or add.operands[1] not in ASM_REGISTERS_64 or add.operands[1] == reg:
+        return False
+    if not asm_flags_dead(code, add_ip):
+        return False
+    code[ip] = None
+    code[add_ip] = asm_instruction('lea', [reg, '[%s%+d]' % (add.operands[1], int(value))], cache)
+    return True
+
+def optimize_asm(asm: List[str], live: Optional[Dict[str, Set[str]]] = None) -> List[str]:
+    '''Peephole optimization of the lines of generate_asm() or generate_cached_asm()
+
+    Folds push/pop pairs into register moves, propagates moved registers and
+    immediates into the instructions that use them and removes the moves that
+    become dead. Relies on the generated code not keeping values in registers
+    across ops except for the `live` ones at each op label, so labels of ops
+    should be left out where possible.
+    '''
+    cache: Dict[str, AsmLine] = {}
+    code: List[Optional[AsmLine]] = [parse_asm_line(line, cache) for line in asm]
+    if live is not None:
+        for ip, line in enumerate(code):
+            assert line is not None
+            if line.typ in [AsmLineType.LABEL, AsmLineType.CONTROL] and len(line.operands) > 0 and line.operands[0] in live:
+                code[ip] = AsmLine(line.typ, line.text, line.mnemonic, line.operands, reads=live[line.operands[0]])
+    changed = True
+    while changed:
+        changed = False
+        for ip in range(len(code)):
+            line = code[ip]
+            if line is None or line.typ != AsmLineType.INSTRUCTION:
+                continue
+            if line.mnemonic == 'mov' or line.mnemonic == 'lea':
+                reg = line.operands[0]
+                if reg in ASM_REGISTERS_64 and not line.memory and asm_register_dead(code, ip, reg):
+                    code[ip] = None
+                    changed = True
+                elif line.mnemonic == 'mov' and (asm_propagate_mov(code, ip, cache) or asm_fold_add_immediate(code, ip, cache)):
+                    changed = True
+                elif line.mnemonic == 'mov' and line.operands[0] == line.operands[1]:
+                    code[ip] = None
+                    changed = True
+            elif line.mnemonic == 'push':
+                if asm_fold_push_pop(code, ip, cache):
+                    changed = True
+    return [line.text for line in code if line is not None]
+
+def generate_program_asm(program: Program, comments: bool = True, all_labels: bool = True, optimization_level: int = 0, depths: Optional[List[int]] = None, profile: Optional[AsmProfile] = None) -> List[str]:
+    if optimization_level >= 2:
+        asm, live = generate_cached_asm(program, depths, comments, profile)
+        return optimize_asm(asm, live)
+    if optimization_level >= 1:
+        # labels between the ops would stop the peephole optimizer
+        return optimize_asm(generate_asm(program, comments, all_labels=False, fuse_branches=True, rotate_loops=True, profile=profile))
+    return generate_asm(program, comments, all_labels, profile=profile)
+
+def asm_size(asm: List[str]) -> int:
+    '''Size of the assembly as written by write_asm()'''
+    return sum(len(line.encode('utf-8')) + 1 for line in asm)
+
+def write_asm(asm: List[str], out_file_path: str):
+    with open(out_file_path, "w") as out:
+        out.write("\n".join(asm))
+        out.write("\n")
+
+def compile(program: Program, out_file_path: str, comments: bool = True, all_labels: bool = True, optimization_level: int = 0, depths: Optional[List[int]] = None):
+    write_asm(generate_program_asm(program, comments, all_labels, optimization_level, depths), out_file_path)
+
+ELF_BASE_ADDRESS = 0x400000
+ELF_PAGE_SIZE = 0x1000
+ELF_HEADER_SIZE = 64
+ELF_PROGRAM_HEADER_SIZE = 56
+ELF_PROGRAM_HEADERS = 3
+
+# name -> (size in bits, number)
+X86_REGISTERS: Dict[str, Tuple[int, int]] = {
+    **{name: (64, i) for i, name in enumerate(['rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi'])},
+    **{name: (32, i) for i, name in enumerate(['eax', 'ecx', 'edx', 'ebx', 'esp', 'ebp', 'esi', 'edi'])},
+    **{name: (8, i) for i, name in enumerate(['al', 'cl', 'dl', 'bl', 'spl', 'bpl', 'sil', 'dil'])},
+    **{'r%d' % i: (64, i) for i in range(8, 16)},
+    **{'r%dd' % i: (32, i) for i in range(8, 16)},
+    **{'r%db' % i: (8, i) for i in range(8, 16)},
+}
+X86_SIZE_PREFIXES = [('byte ', 8), ('dword ', 32), ('qword ', 64)]
+X86_CONDITIONS = {
+    'o': 0, 'no': 1, 'b': 2, 'c': 2, 'nae': 2, 'ae': 3, 'nb': 3, 'nc': 3,
+    'e': 4, 'z': 4, 'ne': 5, 'nz': 5, 'be': 6, 'na': 6, 'a': 7, 'nbe': 7,
+    's': 8, 'ns': 9, 'p': 10, 'pe': 10, 'np': 11, 'po': 11,
+    'l': 12, 'nge': 12, 'ge': 13, 'nl': 13, 'le': 14, 'ng': 14, 'g': 15, 'nle': 15,
+}
+# the /digit of the instructions with an immediate operand
+X86_ALU = {'add': 0, 'or': 1, 'and': 4, 'sub': 5, 'xor': 6, 'cmp': 7}
+X86_UNARY = {'not': 2, 'neg': 3, 'mul': 4, 'div': 6}
+X86_SHIFTS = {'shl': 4, 'shr': 5, 'sar': 7}
+X86_NOPS = [
+    b'',
+    b'\x90',
+    b'\x66\x90',
+    b'\x0f\x1f\x00',
+    b'\x0f\x1f\x40\x00',
+    b'\x0f\x1f\x44\x00\x00',
+    b'\x66\x0f\x1f\x44\x00\x00',
+    b'\x0f\x1f\x80\x00\x00\x00\x00',
+    b'\x0f\x1f\x84\x00\x00\x00\x00\x00',
+    b'\x66\x0f\x1f\x84\x00\x00\x00\x00\x00',
+]
+X86_MEMORY_TERM_REGEX = re.compile(r'([+-]?)\s*([^\s+-]+)')
+
+@dataclass(slots=True)
+class X86Operand:
+    # 'reg', 'imm' or 'mem'
+    kind: str
+    # in bits, 0 for immediates and memory without a size prefix
+    size: int = 0
+    reg: int = 0
+    base: Optional[int] = None
+    index: Optional[int] = None
+    # the immediate or the displacement, relative to `symbol` if there is one
+    value: int = 0
+    symbol: Optional[str] = None
+
+@dataclass(slots=True)
+class X86Instruction:
+    '''Machine code of an instruction. The address of `symbol` is added to the 32 bit value at `fixup` by link_elf().'''
+    code: bytes
+    fixup: int = -1
+    symbol: Optional[str] = None
+
+@dataclass(slots=True)
+class X86Program:
+    text: bytearray = field(default_factory=bytearray)
+    data: bytearray = field(default_factory=bytearray)
+    bss_size: int = 0
+    # name -> (section, offset in the section)
+    symbols: Dict[str, Tuple[str, int]] = field(default_factory=dict)
+    # (offset in text, symbol, whether it's relative to the end of the 32 bit value)
+    fixups: List[Tuple[int, str, bool]] = field(default_factory=list)
+
+def parse_x86_operand(text: str) -> X86Operand:
+    size = 0
+    for prefix, bits in X86_SIZE_PREFIXES:
+        if text.startswith(prefix):
+            size = bits
+            text = text[len(prefix):].strip()
+            break
+    if text.startswith('['):
+        assert text.endswith(']'), "Malformed memory operand %s" % text
+        operand = X86Operand('mem', size)
+        for sign, term in X86_MEMORY_TERM_REGEX.findall(text[1:-1]):
+            if term in X86_REGISTERS:
+                assert sign != '-' and X86_REGISTERS[term][0] == 64, "Unsupported memory operand %s" % text
+                if operand.base is None:
+                    operand.base = X86_REGISTERS[term][1]
+                else:
+                    assert operand.index is None, "Unsupported memory operand %s" % text
+                    operand.index = X86_REGISTERS[term][1]
+            elif ASM_INT_REGEX.fullmatch(term) is not None:
+                operand.value += int(sign + term)
+            else:
+                assert sign != '-' and operand.symbol is None, "Unsupported memory operand %s" % text
+                operand.symbol = term
+        return operand
+    if text in X86_REGISTERS:
+        size, reg = X86_REGISTERS[text]
+        return X86Operand('reg', size, reg)
+    if ASM_INT_REGEX.fullmatch(text) is not None:
+        value = int(text)
+        # unsigned 64 bit values are the same as their two's complement
+        return X86Operand('imm', value=value - (1 << 64) if value >= 1 << 63 else value)
+    return X86Operand('imm', symbol=text)
+
+def x86_fits8(operand: X86Operand) -> bool:
+    return operand.symbol is None and -128 <= operand.value < 128
+
+def x86_imm(operand: X86Operand, size: int) -> bytes:
+    # unsigned values are written as their two's complement
+    value = operand.value - (1 << size) if operand.value >= 1 << (size - 1) else operand.value
+    return value.to_bytes(size // 8, 'little', signed=True)
+
+def x86_modrm(reg: int, rm: X86Operand) -> Tuple[int, bytes, int]:
+    '''REX bits, ModRM, SIB and displacement for the `reg` field and the `rm` operand, and the offset of a symbol's displacement in them'''
+    rex = (reg >> 3) << 2
+    if rm.kind == 'reg':
+        return rex | rm.reg >> 3, bytes([0xC0 | (reg & 7) << 3 | rm.reg & 7]), -1
+    assert rm.kind == 'mem'
+    disp32 = rm.value.to_bytes(4, 'little', signed=True)
+    base, index = rm.base, rm.index
+    if base is None and index is None:
+        # absolute address, SIB without base and index
+        return rex, bytes([0x04 | (reg & 7) << 3, 0x25]) + disp32, 2 if rm.symbol is not None else -1
+    assert base is not None
+    if rm.symbol is not None or not -128 <= rm.value < 128:
+        mod, disp = 2, disp32
+    elif rm.value == 0 and base & 7 != 5:
+        mod, disp = 0, b''
+    else:
+        mod, disp = 1, disp32[:1]
+    rex |= base >> 3
+    if index is None and base & 7 != 4:
+        modrm = bytes([mod << 6 | (reg & 7) << 3 | base & 7])
+    else:
+        if index is None:
+            index = 4
+        else:
+            assert index != 4, "rsp can't be an index register"
+            rex |= (index >> 3) << 1
+        modrm = bytes([mod << 6 | (reg & 7) << 3 | 4, (index & 7) << 3 | base & 7])
+    return rex, modrm + disp, len(modrm) if rm.symbol is not None else -1
+
+def x86_encode(opcode: bytes, reg: int, rm: X86Operand, size: int, imm: Optional[X86Operand] = None, imm_size: int = 0, byte_regs: Tuple[X86Operand, ...] = ()) -> X86Instruction:
+    '''Instruction with a ModRM byte. `byte_regs` are the 8 bit register operands, which need a REX prefix for spl, bpl, sil and dil.'''
+    rex, modrm, fixup = x86_modrm(reg, rm)
+    if size == 64:
+        rex |= 8
+    if rex != 0 or any(operand.kind == 'reg' and operand.reg >= 4 for operand in byte_regs):
+        prefix = bytes([0x40 | rex])
+    else:
+        prefix = b''
+    code = prefix + opcode + modrm
+    symbol = rm.symbol if fixup >= 0 else None
+    if fixup >= 0:
+        fixup += len(prefix) + len(opcode)
+    if imm is not None:
+        if imm.symbol is not None:
+            assert symbol is None and imm_size == 32, "Only one symbol per instruction is supported"
+            fixup, symbol = len(code), imm.symbol
+        code += x86_imm(imm, imm_size)
+    return X86Instruction(code, fixup, symbol)
+
+def x86_encode_short(opcode: int, reg: int, imm: Optional[X86Operand] = None, imm_size: int = 0, w: bool = False, byte_reg: bool = False) -> X86Instruction:
+    '''Instruction with the register in the low bits of the opcode'''
+    rex = (8 if w else 0) | reg >> 3
+    prefix = bytes([0x40 | rex]) if rex != 0 or (byte_reg and reg >= 4) else b''
+    code = prefix + bytes([opcode | reg & 7])
+    if imm is None:
+        return X86Instruction(code)
+    if imm.symbol is not None:
+        assert imm_size == 32, "Symbols only fit 32 bit immediates"
+        return X86Instruction(code + x86_imm(imm, 32), len(code), imm.symbol)
+    return X86Instruction(code + x86_imm(imm, imm_size))
+
+def x86_operand_size(mnemonic: str, *operands: X86Operand) -> int:
+    for operand in operands:
+        if operand.kind == 'reg' or operand.size != 0:
+            return operand.size
+    assert False, "The operand size of %s is unknown" % mnemonic
+
+def encode_x86_instruction(mnemonic: str, operands: List[X86Operand]) -> X86Instruction:
+    '''Machine code of one of the instructions generate_asm(), generate_cached_asm() and optimize_asm() use'''
+    if len(operands) == 0:
+        if mnemonic == 'syscall':
+            return X86Instruction(b'\x0f\x05')
+        if mnemonic == 'ret':
+            return X86Instruction(b'\xc3')
+        if mnemonic == 'nop':
+            return X86Instruction(b'\x90')
+    elif mnemonic == 'push':
+        src, = operands
+        if src.kind == 'reg':
+            return x86_encode_short(0x50, src.reg)
+        assert src.kind == 'imm', "Unsupported push"
+        if x86_fits8(src):
+            return X86Instruction(b'\x6a' + x86_imm(src, 8))
+        return X86Instruction(b'\x68' + x86_imm(src, 32), 1, src.symbol)
+    elif mnemonic == 'pop':
+        dst, = operands
+        assert dst.kind == 'reg', "Unsupported pop"
+        return x86_encode_short(0x58, dst.reg)
+    elif mnemonic == 'mov':
+        dst, src = operands
+        if src.kind == 'imm':
+            if dst.kind == 'mem':
+                size = x86_operand_size(mnemonic, dst)
+                if size == 8:
+                    return x86_encode(b'\xc6', 0, dst, size, src, 8)
+                return x86_encode(b'\xc7', 0, dst, size, src, 32)
+            if dst.size == 8:
+                return x86_encode_short(0xB0, dst.reg, src, 8, byte_reg=True)
+            if src.symbol is not None or dst.size == 32 or 0 <= src.value < 1 << 32:
+                # writing the 32 bit register zero extends
+                return x86_encode_short(0xB8, dst.reg, src, 32)
+            if -1 << 31 <= src.value < 0:
+                return x86_encode(b'\xc7', 0, dst, 64, src, 32)
+            return x86_encode_short(0xB8, dst.reg, src, 64, w=True)
+        size = x86_operand_size(mnemonic, dst, src)
+        if src.kind == 'reg':
+            return x86_encode(b'\x88' if size == 8 else b'\x89', src.reg, dst, size, byte_regs=(dst, src) if size == 8 else ())
+        assert dst.kind == 'reg', "Unsupported mov"
+        return x86_encode(b'\x8a' if size == 8 else b'\x8b', dst.reg, src, size, byte_regs=(dst, ) if size == 8 else ())
+    elif mnemonic == 'movzx':
+        dst, src = operands
+        assert dst.kind == 'reg' and (src.kind == 'mem' or src.size == 8), "Unsupported movzx"
+        return x86_encode(b'\x0f\xb6', dst.reg, src, dst.size, byte_regs=(src, ))
+    elif mnemonic == 'lea':
+        dst, src = operands
+        assert dst.kind == 'reg' and src.kind == 'mem', "Unsupported lea"
+        return x86_encode(b'\x8d', dst.reg, src, dst.size)
+    elif mnemonic in X86_ALU:
+        dst, src = operands
+        digit = X86_ALU[mnemonic]
+        size = x86_operand_size(mnemonic, dst, src)
+        if src.kind == 'imm':
+            if size == 8:
+                return x86_encode(b'\x80', digit, dst, size, src, 8, byte_regs=(dst, ))
+            if x86_fits8(src):
+                return x86_encode(b'\x83', digit, dst, size, src, 8)
+            if dst.kind == 'reg' and dst.reg == 0:
+                # the shorter form for rax
+                return x86_encode_short(digit << 3 | 5, 0, src, 32, w=size == 64)
+            return x86_encode(b'\x81', digit, dst, size, src, 32)
+        if src.kind == 'reg':
+            return x86_encode(bytes([digit << 3 | (0 if size == 8 else 1)]), src.reg, dst, size, byte_regs=(dst, src) if size == 8 else ())
+        assert dst.kind == 'reg', "Unsupported %s" % mnemonic
+        return x86_encode(bytes([digit << 3 | (2 if size == 8 else 3)]), dst.reg, src, size, byte_regs=(dst, ) if size == 8 else ())
+    elif mnemonic == 'test':
+        dst, src = operands
+        size = x86_operand_size(mnemonic, dst, src)
+        if src.kind == 'imm':
+            return x86_encode(b'\xf6' if size == 8 else b'\xf7', 0, dst, size, src, 8 if size == 8 else 32, byte_regs=(dst, ))
+        assert src.kind == 'reg', "Unsupported test"
+        return x86_encode(b'\x84' if size == 8 else b'\x85', src.reg, dst, size, byte_regs=(dst, src) if size == 8 else ())
+    elif mnemonic == 'imul':
+        dst, *rest = operands
+        assert dst.kind == 'reg', "Unsupported imul"
+        if len(rest) == 1 and rest[0].kind != 'imm':
+            return x86_encode(b'\x0f\xaf', dst.reg, rest[0], dst.size)
+        src, imm = (dst, rest[0]) if len(rest) == 1 else rest
+        if x86_fits8(imm):
+            return x86_encode(b'\x6b', dst.reg, src, dst.size, imm, 8)
+        return x86_encode(b'\x69', dst.reg, src, dst.size, imm, 32)
+    elif mnemonic in X86_UNARY or mnemonic in ['inc', 'dec']:
+        dst, = operands
+        size = x86_operand_size(mnemonic, dst)
+        if mnemonic in X86_UNARY:
+            return x86_encode(b'\xf6' if size == 8 else b'\xf7', X86_UNARY[mnemonic], dst, size, byte_regs=(dst, ))
+        return x86_encode(b'\xfe' if size == 8 else b'\xff', 0 if mnemonic == 'inc' else 1, dst, size, byte_regs=(dst, ))
+    elif mnemonic in X86_SHIFTS:
+        dst, src = operands
+        digit = X86_SHIFTS[mnemonic]
+        size = x86_operand_size(mnemonic, dst)
+        if src.kind == 'reg':
+            assert src.size == 8 and src.reg == 1, "Shifts by a register shift by cl"
+            return x86_encode(b'\xd2' if size == 8 else b'\xd3', digit, dst, size, byte_regs=(dst, ))
+        if src.value == 1:
+            return x86_encode(b'\xd0' if size == 8 else b'\xd1', digit, dst, size, byte_regs=(dst, ))
+        return x86_encode(b'\xc0' if size == 8 else b'\xc1', digit, dst, size, src, 8, byte_regs=(dst, ))
+    elif mnemonic == 'xchg':
+        dst, src = operands
+        size = x86_operand_size(mnemonic, dst, src)
+        assert src.kind == 'reg', "Unsupported xchg"
+        if size == 64 and dst.kind == 'reg' and 0 in [dst.reg, src.reg]:
+            return x86_encode_short(0x90, dst.reg | src.reg, w=True)
+        return x86_encode(b'\x86' if size == 8 else b'\x87', src.reg, dst, size, byte_regs=(dst, src) if size == 8 else ())
+    elif mnemonic.startswith('set') and mnemonic[3:] in X86_CONDITIONS:
+        dst, = operands
+        return x86_encode(bytes([0x0f, 0x90 | X86_CONDITIONS[mnemonic[3:]]]), 0, dst, 8, byte_regs=(dst, ))
+    elif mnemonic.startswith('cmov') and mnemonic[4:] in X86_CONDITIONS:
+        dst, src = operands
+        assert dst.kind == 'reg', "Unsupported %s" % mnemonic
+        return x86_encode(bytes([0x0f, 0x40 | X86_CONDITIONS[mnemonic[4:]]]), dst.reg, src, dst.size)
+    assert False, "Unsupported instruction %s" % mnemonic
+
+def x86_jump_opcodes(mnemonic: str) -> Tuple[Optional[bytes], bytes]:
+    '''The rel8 (if any) and rel32 opcodes of a jump or call'''
+    if mnemonic == 'jmp':
+        return b'\xeb', b'\xe9'
+    if mnemonic == 'call':
+        return None, b'\xe8'
+    assert mnemonic.startswith('j') and mnemonic[1:] in X86_CONDITIONS, "Unsupported jump %s" % mnemonic
+    condition = X86_CONDITIONS[mnemonic[1:]]
+    return bytes([0x70 | condition]), bytes([0x0f, 0x80 | condition])
+
+def assemble_x86(asm: List[str]) -> X86Program:
+    '''Machine code of the lines of nasm assembly the code generators emit.
+
+    Only that subset of nasm is understood. Backward jumps get the short
+    encoding when they can, forward jumps always use 32 bit displacements.
+    '''
+    x86 = X86Program()
+    text = x86.text
+    symbols = x86.symbols
+    fixups = x86.fixups
+    instructions: Dict[str, X86Instruction] = {}
+    jumps: Dict[str, Tuple[Optional[bytes], bytes, str]] = {}
+    section = '.text'
+    for line in asm:
+        instruction = instructions.get(line)
+        if instruction is None:
+            jump = jumps.get(line)
+            if jump is None:
+                stripped = line.split(';', 1)[0].strip()
+                if stripped == '':
+                    instructions[line] = X86Instruction(b'')
+                    continue
+                if section != '.text' or not line.startswith("    "):
+                    name, _, rest = stripped.partition(' ')
+                    if name == 'section':
+                        section = rest.strip()
+                    elif name in ['BITS', 'global']:
+                        pass
+                    elif stripped.endswith(':'):
+                        assert section == '.text', "Labels are only supported in .text"
+                        symbols[stripped[:-1]] = ('.text', len(text))
+                    else:
+                        directive, _, value = rest.strip().partition(' ')
+                        name = name.rstrip(':')
+                        if directive in ['resb', 'resq']:
+                            assert section == '.bss', "%s outside of .bss" % directive
+                            x86.bss_size += -x86.bss_size % 8
+                            symbols[name] = ('.bss', x86.bss_size)
+                            x86.bss_size += int(value) * (1 if directive == 'resb' else 8)
+                        else:
+                            assert section == '.data' and directive == 'db', "Unsupported directive %s" % stripped
+                            symbols[name] = ('.data', len(x86.data))
+                            x86.data += bytes(int(byte, 0) for byte in value.split(',') if byte.strip() != '')
+                    continue
+                mnemonic, _, rest = stripped.partition(' ')
+                operands = [operand.strip() for operand in rest.split(',')] if rest != '' else []
+                if mnemonic == 'align':
+                    padding = -len(text) % int(operands[0])
+                    while padding > 0:
+                        nop = X86_NOPS[min(padding, len(X86_NOPS) - 1)]
+                        text += nop
+                        padding -= len(nop)
+                    continue
+                if mnemonic.startswith('j') or mnemonic == 'call':
+                    jump = jumps[line] = (*x86_jump_opcodes(mnemonic), operands[0])
+                else:
+                    instruction = instructions[line] = encode_x86_instruction(mnemonic, [parse_x86_operand(operand) for operand in operands])
+            if jump is not None:
+                short, near, target = jump
+                known = symbols.get(target)
+                if known is not None and short is not None:
+                    displacement = known[1] - (len(text) + 2)
+                    if displacement >= -128:
+                        text += short
+                        text.append(displacement & 0xFF)
+                        continue
+                text += near
+                fixups.append((len(text), target, True))
+                text += b'\0\0\0\0'
+                continue
+        assert instruction is not None
+        if instruction.symbol is not None:
+            fixups.append((len(text) + instruction.fixup, instruction.symbol, False))
+        text += instruction.code
+    return x86
+
+def link_elf(x86: X86Program, entry: str = '_start') -> bytes:
+    '''Static x86-64 executable with the text segment (the headers and .text) and the data segment (.data and .bss)'''
+    headers_size = ELF_HEADER_SIZE + ELF_PROGRAM_HEADERS * ELF_PROGRAM_HEADER_SIZE
+    text_offset = headers_size + -headers_size % 16
+    text_address = ELF_BASE_ADDRESS + text_offset
+    data_offset = text_offset + len(x86.text)
+    # the data segment is mapped from the page of the file it starts in
+    data_address = ELF_BASE_ADDRESS + data_offset + -data_offset % ELF_PAGE_SIZE + data_offset % ELF_PAGE_SIZE
+    bss_address = data_address + len(x86.data) + -len(x86.data) % 8
+    addresses = {'.text': text_address, '.data': data_address, '.bss': bss_address}
+    text = x86.text
+    for offset, symbol, relative in x86.fixups:
+        assert symbol in x86.symbols, "Undefined symbol %s" % symbol
+        section, symbol_offset = x86.symbols[symbol]
+        target = addresses[section] + symbol_offset
+        if relative:
+            value = target - (text_address + offset + 4)
+        else:
+            value = int.from_bytes(text[offset:offset + 4], 'little', signed=True) + target
+        text[offset:offset + 4] = value.to_bytes(4, 'little', signed=True)
+    assert entry in x86.symbols, "Undefined entry point %s" % entry
+    section, entry_offset = x86.symbols[entry]
+    import struct
+    ident = b'\x7fELF' + bytes([2, 1, 1]) + bytes(9)
+    elf = bytearray(struct.pack('<16sHHIQQQIHHHHHH', ident, 2, 0x3E, 1, addresses[section] + entry_offset, ELF_HEADER_SIZE, 0, 0,
+                                ELF_HEADER_SIZE, ELF_PROGRAM_HEADER_SIZE, ELF_PROGRAM_HEADERS, 0, 0, 0))
+    # PT_LOAD r-x, PT_LOAD rw-, PT_GNU_STACK rw-
+    elf += struct.pack('<IIQQQQQQ', 1, 5, 0, ELF_BASE_ADDRESS, ELF_BASE_ADDRESS, data_offset, data_offset, ELF_PAGE_SIZE)
+    elf += struct.pack('<IIQQQQQQ', 1, 6, data_offset, data_address, data_address, len(x86.data), bss_address + x86.bss_size - data_address, ELF_PAGE_SIZE)
+    elf += struct.pack('<IIQQQQQQ', 0x6474E551, 6, 0, 0, 0, 0, 0, 16)
+    elf += bytes(text_offset - len(elf))
+    elf += text
+    elf += x86.data
+    return bytes(elf)
+
+def compile_elf(program: Program, out_file_path: str, comments: bool = True, all_labels: bool = True, optimization_level: int = 0, depths: Optional[List[int]] = None, asm_file_path: Optional[str] = None, report: Optional['CompileReport'] = None, profile: Optional[AsmProfile] = None):
+    '''Like compile() followed by nasm and ld, but assembles and links in process. The assembly is only written if `asm_file_path` is given.'''
+    asm = generate_program_asm(program, comments and asm_file_path is not None, all_labels and asm_file_path is not None, optimization_level, depths, profile)
+    if asm_file_path is not None:
+        write_asm(asm, asm_file_path)
+    report_phase(report, 'generate asm')
+    report_stat(report, 'asm_bytes', asm_size(asm))
+    x86 = assemble_x86(asm)
+    report_phase(report, 'assemble')
+    with open(out_file_path, "wb") as out:
+        out.write(link_elf(x86))
+    os.chmod(out_file_path, 0o755)
+    report_phase(report, 'link')
+
+# -profile: how many times every op ran, counted by the simulation or by the
+# counters of the basic blocks of an executable, mapped back to the source
+# through the tokens of the ops and the macro uses and includes they were
+# expanded from. The reports are written by tau_sim.py.
+PROFILE_MAP_EXT = '.profile.json'
+PROFILE_COUNTS_EXT = '.counts'
+PROFILE_REPORT_EXT = '.profile.txt'
+PROFILE_FOLDED_EXT = '.folded'
+
+# (file, row, col, text) of a token
+ProfileFrame = Tuple[str, int, int, str]
+
+def profile_frames(op: Op) -> List[ProfileFrame]:
+    '''The macro uses and includes the op was expanded from, outermost first, then the op itself'''
+    frames: List[ProfileFrame] = [(*op.token.loc, op.token.text)]
+    token = op.expanded_from if op.expanded_from is not None else op.token.expanded_from
+    while token is not None:
+        frames.append((*token.loc, token.text))
+        token = token.expanded_from
+    frames.reverse()
+    return frames
+
+def write_profile_map(program: Program, basepath: str):
+    '''The basic blocks whose counters a -profile executable writes to <basepath>.counts and the frames of every op'''
+    import json
+    with open(basepath + PROFILE_MAP_EXT, 'w') as f:
+        json.dump({
+            'blocks': [[block.start, block.end] for block in control_flow_graph(program).values()],
+            'ops': [profile_frames(op) for op in program],
+        }, f)
+
+
+assert len(Keyword) == 7, "Exhaustive KEYWORD_NAMES definition."
+KEYWORD_NAMES = {
+    'if': Keyword.IF,
+    'end': Keyword.END,
+    'else': Keyword.ELSE,
+    'while': Keyword.WHILE,
+    'do': Keyword.DO,
+    'macro': Keyword.MACRO,
+    'include': Keyword.INCLUDE,
+}
+
+assert len(Intrinsic) == 37, "Exhaustive INTRINSIC_BY_NAMES definition"
+INTRINSIC_BY_NAMES = {
+    '+': Intrinsic.PLUS,
+    '-': Intrinsic.MINUS,
+    '*': Intrinsic.MUL,
+    'divmod': Intrinsic.DIVMOD,
+    'prn': Intrinsic.PRINT,
+    
+    '=': Intrinsic.EQ,
+    '>': Intrinsic.GT,
+    '<': Intrinsic.LT,
+    '>=': Intrinsic.GE,
+    '<=': Intrinsic.LE,
+    '!=': Intrinsic.NE,
+    
+    '>>': Intrinsic.SHR,
+    '<<': Intrinsic.SHL,
+    'or': Intrinsic.OR,
+    'and': Intrinsic.AND,
+    'not': Intrinsic.NOT,
+    
+    'dup': Intrinsic.DUP,
+    'swap': Intrinsic.SWAP,
+    'drop': Intrinsic.DROP,
+    'over': Intrinsic.OVER,
+    'rot': Intrinsic.ROT,
+    
+    'bit': Intrinsic.MEM,
+    '.': Intrinsic.STORE,
+    ',': Intrinsic.LOAD,
+    '.64': Intrinsic.STORE64,
+    ',64': Intrinsic.LOAD64,
+    'cast(ptr)': Intrinsic.CAST_PTR,
+    'argc': Intrinsic.ARGC,
+    'argv': Intrinsic.ARGV,
+    'here': Intrinsic.HERE,
+    
+    'syscall0': Intrinsic.SYSCALL0,
+    'syscall1': Intrinsic.SYSCALL1,
+    'syscall2': Intrinsic.SYSCALL2,
+    'syscall3': Intrinsic.SYSCALL3,
+    'syscall4': Intrinsic.SYSCALL4,
+    'syscall5': Intrinsic.SYSCALL5,
+    'syscall6': Intrinsic.SYSCALL6,
+}
+INTRINSIC_NAMES = {v: k for k, v in INTRINSIC_BY_NAMES.items()}
+
+@dataclass(slots=True)
+class Macro:
+    loc: Loc
+    tokens: List[Token]
+
+def human(obj: Union[TokenType, Op, Intrinsic]) -> str:
+    '''Human readable representation of an object that can be used in error messages'''
+    assert len(TokenType) == 5, "Exhaustive handling of token types in human()"
+    if obj == TokenType.WORD:
+        return "a word"
+    elif obj == TokenType.INT:
+        return "an integer"
+    elif obj == TokenType.STR:
+        return "a string"
+    elif obj == TokenType.CHAR:
+        return "a character"
+    elif obj == TokenType.KEYWORD:
+        return "a keyword"
+    else:
+        assert False, "unreachable"
+
+@dataclass(slots=True)
+class Expansion:
+    tokens: List[Token]
+    index: int
+    # Copy of the token that caused this expansion (the macro call or the
+    # include path) chained to the expansion it was found in. None for the
+    # tokens of the main file.
+    expanded_from: Optional[Token]
+
+def expansion_depth(expanded_from: Optional[Token]) -> int:
+    return 0 if expanded_from is None else expanded_from.expanded_count + 1
+
+def expand(expansions: List[Expansion], tokens: List[Token], token: Token, expanded_from: Optional[Token]):
+    '''Continue reading tokens from `tokens` until they run out.
+
+    The tokens are not copied, they are shared by every expansion of a macro or
+    include. Only `token` is copied once per expansion to record where the
+    expansion happened.
+    '''
+    origin = Token(token.typ, token.text, token.file, token.row, token.col, token.value, expanded_from, expansion_depth(expanded_from))
+    expansions.append(Expansion(tokens, 0, origin))
+
+def next_token(expansions: List[Expansion]) -> Optional[Token]:
+    '''Next token of the innermost expansion that is not exhausted yet.
+
+    The expansion the token came from stays on top of `expansions` until the
+    next call, so its `expanded_from` can be read right after.
+    '''
+    while len(expansions) > 0:
+        top = expansions[-1]
+        if top.index < len(top.tokens):
+            top.index += 1
+            return top.tokens[top.index - 1]
+        expansions.pop()
+    return None
+
+@dataclass(slots=True)
+class IncludeResolver:
+    '''Include lookups of a single compilation and its counters for -stats.'''
+    include_paths: List[str]
+    include_once: bool = False
+    # include path as written in the source -> path of the file or None if not found
+    resolved: Dict[str, Optional[str]] = field(default_factory=dict)
+    lexed: Dict[str, List[Token]] = field(default_factory=dict)
+    # real paths of all the files that were included so far
+    included: Set[str] = field(default_factory=set)
+    include_count: int = 0
+    token_count: int = 0
+    # seconds spent lexing the included files
+    lex_time: float = 0.0
+    # macro name -> number of times it was expanded
+    macro_expansions: Dict[str, int] = field(default_factory=dict)
+
+def resolve_include(resolver: IncludeResolver, include_path: str) -> Optional[str]:
+    if include_path in resolver.resolved:
+        return resolver.resolved[include_path]
+    file_path = None
+    for include_dir in resolver.include_paths:
+        candidate = path.join(include_dir, include_path)
+        if path.isfile(candidate):
+            file_path = candidate
+            break
+    resolver.resolved[include_path] = file_path
+    return file_path
+
+def include_file(resolver: IncludeResolver, file_path: str) -> Optional[List[Token]]:
+    '''Tokens of the included file or None if it must be skipped in include-once mode.
+
+    Every file is lexed at most once per compilation, further includes of it
+    share the same tokens.
+    '''
+    real_path = path.realpath(file_path)
+    if resolver.include_once and real_path in resolver.included:
+        return None
+    resolver.included.add(real_path)
+    if file_path not in resolver.lexed:
+        start = perf_counter()
+        resolver.lexed[file_path] = lex_file(file_path)
+        resolver.lex_time += perf_counter() - start
+    tokens = resolver.lexed[file_path]
+    resolver.include_count += 1
+    resolver.token_count += len(tokens)
+    return tokens
+
+def compile_tokens(tokens: List[Token], resolver: IncludeResolver, expansion_limit: int) -> Program:
+    stack: List[OpAddr] = []
+    program: List[Op] = []
+    expansions: List[Expansion] = [Expansion(tokens, 0, None)]
+    macros: Dict[str, Macro] = {}
+    ip: OpAddr = 0
+    while True:
+        token = next_token(expansions)
+        if token is None:
+            break
+        expanded_from = expansions[-1].expanded_from
+        assert len(TokenType) == 5, "Exhaustive token handling in compile_tokens"
+        if token.typ == TokenType.WORD:
+            assert isinstance(token.value, str), "This could be a bug in the lexer"
+            if token.value in INTRINSIC_BY_NAMES:
+                program.append(Op(typ=OpType.INTRINSIC, token=token, operand=INTRINSIC_BY_NAMES[token.value], expanded_from=expanded_from))
+                ip += 1
+            elif token.value in macros:
+                depth = expansion_depth(expanded_from)
+                if depth >= expansion_limit:
+                    compiler_error_with_expansion_stack(token, "the macro exceeded the expansion limit (it expanded %d times)" % depth, expanded_from)
+                    exit(1)
+                expand(expansions, macros[token.value].tokens, token, expanded_from)
+                resolver.macro_expansions[token.value] = resolver.macro_expansions.get(token.value, 0) + 1
+            else:
+                compiler_error_with_expansion_stack(token, "unknown word `%s`" % token.value, expanded_from)
+                exit(1)
+        elif token.typ == TokenType.INT:
+            assert isinstance(token.value, int), "This could be a bug in the lexer"
+            program.append(Op(typ=OpType.PUSH_INT, operand=token.value, token=token, expanded_from=expanded_from))
+            ip += 1
+        elif token.typ == TokenType.STR:
+            assert isinstance(token.value, str), "This could be a bug in the lexer"
+            program.append(Op(typ=OpType.PUSH_STR, operand=token.value, token=token, expanded_from=expanded_from))
+            ip += 1
+        elif token.typ == TokenType.CHAR:
+            assert isinstance(token.value, int)
+            program.append(Op(typ=OpType.PUSH_INT, operand=token.value, token=token, expanded_from=expanded_from))
+            ip += 1
+        elif token.typ == TokenType.KEYWORD:
+            assert len(Keyword) == 7, "Exhaustive keywords handling in compile_tokens()"
+            if token.value == Keyword.IF:
+                program.append(Op(typ=OpType.IF, token=token, expanded_from=expanded_from))
+                stack.append(ip)
+                ip += 1
+            elif token.value == Keyword.ELSE:
+                program.append(Op(typ=OpType.ELSE, token=token, expanded_from=expanded_from))
+                if_ip = stack.pop()
+                if program[if_ip].typ != OpType.IF:
+                    compiler_error_with_expansion_stack(program[if_ip].token, '`else` can only be used in `if`-blocks', program[if_ip].expanded_from)
+                    exit(1)
+                program[if_ip].operand = ip + 1
+                stack.append(ip)
+                ip += 1
+            elif token.value == Keyword.END:
+                program.append(Op(typ=OpType.END, token=token, expanded_from=expanded_from))
+                block_ip = stack.pop()
+                if program[block_ip].typ == OpType.IF or program[block_ip].typ == OpType.ELSE:
+                    program[block_ip].operand = ip
+                    program[ip].operand = ip + 1
+                elif program[block_ip].typ == OpType.DO:
+                    assert program[block_ip].operand is not None
+                    program[ip].operand = program[block_ip].operand
+                    program[block_ip].operand = ip + 1
+                else:
+                    compiler_error_with_expansion_stack(program[block_ip].token, '`end` can only close `if`, `else` or `do` blocks for now', program[block_ip].expanded_from)
+                    exit(1)
+                ip += 1
+            elif token.value == Keyword.WHILE:
+                program.append(Op(typ=OpType.WHILE, token=token, expanded_from=expanded_from))
+                stack.append(ip)
+                ip += 1
+            elif token.value == Keyword.DO:
+                program.append(Op(typ=OpType.DO, token=token, expanded_from=expanded_from))
+                while_ip = stack.pop()
+                program[ip].operand = while_ip
+                stack.append(ip)
+                ip += 1
+            elif token.value == Keyword.INCLUDE:
+                include_token = token
+                token = next_token(expansions)
+                if token is None:
+                    compiler_error_with_expansion_stack(include_token, "expected path to the include file but found nothing", expanded_from)
+                    exit(1)
+                expanded_from = expansions[-1].expanded_from
+                if token.typ != TokenType.STR:
+                    compiler_error_with_expansion_stack(token, "expected path to the include file to be %s but found %s" % (human(TokenType.STR), human(token.typ)), expanded_from)
+                    exit(1)
+                assert isinstance(token.value, str), "This is probably a bug in the lexer"
+                depth = expansion_depth(expanded_from)
+                if depth >= expansion_limit:
+                    compiler_error_with_expansion_stack(token, "the include exceeded the expansion limit (it expanded %d times)" % depth, expanded_from)
+                    exit(1)
+                file_path = resolve_include(resolver, token.value)
+                if file_path is None:
+                    compiler_error_with_expansion_stack(token, "file `%s` not found" % token.value, expanded_from)
+                    exit(1)
+                included_tokens = include_file(resolver, file_path)
+                if included_tokens is not None:
+                    expand(expansions, included_tokens, token, expanded_from)
+            elif token.value == Keyword.MACRO:
+                macro_token = token
+                token = next_token(expansions)
+                if token is None:
+                    compiler_error_with_expansion_stack(macro_token, "expected macro name but found nothing", expanded_from)
+                    exit(1)
+                expanded_from = expansions[-1].expanded_from
+                if token.typ != TokenType.WORD:
+                    compiler_error_with_expansion_stack(token, "expected macro name to be %s but found %s" % (human(TokenType.WORD), human(token.typ)), expanded_from)
+                    exit(1)
+                assert isinstance(token.value, str), "This is probably a bug in the lexer"
+                if token.value in macros:
+                    compiler_error_with_expansion_stack(token, "redefinition of already existing macro `%s`" % token.value, expanded_from)
+                    compiler_note(macros[token.value].loc, "the first definition is located here")
+                    exit(1)
+                if token.value in INTRINSIC_BY_NAMES:
+                    compiler_error_with_expansion_stack(token, "redefinition of an intrinsic word `%s`. Please choose a different name for your macro." % (token.value, ), expanded_from)
+                    exit(1)
+                macro = Macro(token.loc, [])
+                macros[token.value] = macro
+                nesting_depth = 0
+                while True:
+                    body_token = next_token(expansions)
+                    if body_token is None:
+                        break
+                    token = body_token
+                    expanded_from = expansions[-1].expanded_from
+                    if token.typ == TokenType.KEYWORD and token.value == Keyword.END and nesting_depth == 0:
+                        break
+                    else:
+                        macro.tokens.append(token)
+                        if token.typ == TokenType.KEYWORD:
+                            if token.value in [Keyword.IF, Keyword.WHILE, Keyword.MACRO]:
+                                nesting_depth += 1
+                            elif token.value == Keyword.END:
+                                nesting_depth -= 1
+                if token.typ != TokenType.KEYWORD or token.value != Keyword.END:
+                    compiler_error_with_expansion_stack(token, "expected `end` at the end of the macro definition but got `%s`" % (token.value, ), expanded_from)
+                    exit(1)
+            else:
+                assert False, 'unreachable'
+        else:
+            assert False, 'unreachable'
+
+
+    if len(stack) > 0:
+        block_ip = stack.pop()
+        compiler_error_with_expansion_stack(program[block_ip].token, 'unclosed block', program[block_ip].expanded_from)
+        exit(1)
+
+    return program
+
+def find_col(line: str, start: int, predicate: Callable[[str], bool]) -> int:
+    while start < len(line) and not predicate(line[start]):
+        start += 1
+    return start
+
+def unescape_string(s: str) -> str:
+    return s.encode('utf-8').decode('unicode_escape').encode('latin-1').decode('utf-8')
+
+def find_string_literal_end(line: str, start: int) -> int:
+    prev = line[start]
+    while start < len(line):
+        curr = line[start]
+        if curr == '"' and prev != '\\':
+            break
+        prev = curr
+        start += 1
+    return start
+
+def lex_lines(file_path: str, lines: List[str]) -> Generator[Token, None, None]:
+    assert len(TokenType) == 5, 'Exhaustive handling of token types in lex_lines'
+    file_path = sys.intern(file_path)
+    row = 0
+    str_literal_buf = ""
+    while row < len(lines):
+        line = lines[row]
+        col = find_col(line, 0, lambda x: not x.isspace())
+        col_end = 0 
+        while col < len(line):
+            loc = (file_path, row + 1, col + 1)
+            if line[col] == '"':
+                while row < len(lines):
+                    start = col
+                    if str_literal_buf == "":
+                        start += 1
+                    else:
+                        line = lines[row]
+                    col_end = find_string_literal_end(line, start)
+                    if col_end >= len(line) or line[col_end] != '"':
+                        str_literal_buf += line[start:]
+                        row +=1
+                        col = 0
+                    else:
+                        str_literal_buf += line[start:col_end]
+                        break
+                if row >= len(lines):
+                    compiler_error(loc, "unclosed string literal")
+                    exit(1)
+                text_of_token = str_literal_buf
+                str_literal_buf = ""
+                yield Token(TokenType.STR, text_of_token, *loc, unescape_string(text_of_token))
+                col = find_col(line, col_end+1, lambda x: not x.isspace())
+            elif line[col] == "'":
+                col_end = find_col(line, col+1, lambda x: x == "'")
+                if col_end >= len(line) or line[col_end] != "'":
+                    compiler_error(loc, "unclosed character literal")
+                    exit(1)
+                text_of_token = line[col+1:col_end]
+                char_bytes = unescape_string(text_of_token).encode('utf-8')
+                if len(char_bytes) != 1:
+                    compiler_error(loc, "only a single byte is allowed inside of a character literal")
+                    exit(1)
+                yield Token(TokenType.CHAR, text_of_token, *loc, char_bytes[0])
+                col = find_col(line, col_end+1, lambda x: not x.isspace())
+            else:
+                col_end = find_col(line, col, lambda x: x.isspace())
+                text_of_token = line[col:col_end]
+
+                try:
+                    yield Token(TokenType.INT, text_of_token, *loc, int(text_of_token))
+                except ValueError:
+                    if text_of_token in KEYWORD_NAMES:
+                        yield Token(TokenType.KEYWORD, text_of_token, *loc, KEYWORD_NAMES[text_of_token])
+                    else:
+                        if text_of_token.startswith("//"):
+                            break
+                        yield Token(TokenType.WORD, text_of_token, *loc, text_of_token)
+                col = find_col(line, col_end, lambda x: not x.isspace())
+        row += 1
+
+LEX_WORD_REGEX = re.compile(r'\S+')
+LEX_INT_REGEX = re.compile(r'[+-]?\d+(?:_\d+)*')
+# A string literal ends at the first `"` that is either the very first character
+# after the opening quote (or of a continuation line) or is not preceded by `\`.
+# This is exactly what find_string_literal_end() accepts.
+LEX_STR_END_REGEX = re.compile(r'"|.*?[^\\]"')
+LEX_LINE_REGEX = re.compile(r'[^\n]*\n|[^\n]+')
+
+def lex_text(file_path: str, text: str) -> List[Token]:
+    '''Single pass lexer over the whole text of a file.
+
+    Produces exactly the same tokens, locations and errors as lex_lines(), but
+    jumps from token to token with precompiled regexes instead of testing every
+    character with a predicate, and classifies words without exceptions.
+    '''
+    assert len(TokenType) == 5, 'Exhaustive handling of token types in lex_text'
+    file_path = sys.intern(file_path)
+    lines = LEX_LINE_REGEX.findall(text)
+    result: List[Token] = []
+    append = result.append
+    search_word = LEX_WORD_REGEX.search
+    match_int = LEX_INT_REGEX.fullmatch
+    match_str_end = LEX_STR_END_REGEX.match
+    keywords = KEYWORD_NAMES
+    row = 0
+    while row < len(lines):
+        line = lines[row]
+        word = search_word(line)
+        while word is not None:
+            col = word.start()
+            text_of_token = word.group()
+            first = text_of_token[0]
+            if first == '"':
+                str_literal_buf = ""
+                str_row = row
+                start = col + 1
+                while True:
+                    end = match_str_end(line, start)
+                    if end is not None:
+                        col_end = end.end() - 1
+                        str_literal_buf += line[start:col_end]
+                        break
+                    str_literal_buf += line[start:]
+                    row += 1
+                    if row >= len(lines):
+                        compiler_error((file_path, str_row + 1, col + 1), "unclosed string literal")
+                        exit(1)
+                    line = lines[row]
+                    start = 0
+                append(Token(TokenType.STR, str_literal_buf, file_path, str_row + 1, col + 1, unescape_string(str_literal_buf)))
+                word = search_word(line, col_end + 1)
+            elif first == "'":
+                col_end = line.find("'", col + 1)
+                if col_end < 0:
+                    compiler_error((file_path, row + 1, col + 1), "unclosed character literal")
+                    exit(1)
+                text_of_token = line[col+1:col_end]
+                char_bytes = unescape_string(text_of_token).encode('utf-8')
+                if len(char_bytes) != 1:
+                    compiler_error((file_path, row + 1, col + 1), "only a single byte is allowed inside of a character literal")
+                    exit(1)
+                append(Token(TokenType.CHAR, text_of_token, file_path, row + 1, col + 1, char_bytes[0]))
+                word = search_word(line, col_end + 1)
+            else:
+                if match_int(text_of_token) is not None:
+                    append(Token(TokenType.INT, text_of_token, file_path, row + 1, col + 1, int(text_of_token)))
+                elif text_of_token in keywords:
+                    append(Token(TokenType.KEYWORD, text_of_token, file_path, row + 1, col + 1, keywords[text_of_token]))
+                elif text_of_token.startswith("//"):
+                    break
+                else:
+                    append(Token(TokenType.WORD, text_of_token, file_path, row + 1, col + 1, text_of_token))
+                word = search_word(line, word.end())
+        row += 1
+    return result
+
+# TokenType by value, for deserialize_tokens()
+TOKEN_TYPES = {typ.value: typ for typ in TokenType}
+
+def serialize_tokens(tokens: List[Token]) -> List[Tuple[int, str, int, int, Union[int, str, None]]]:
+    assert len(TokenType) == 5, "Exhaustive handling of token types in serialize_tokens()"
+    return [(token.typ.value, token.text, token.row, token.col, None if token.typ == TokenType.KEYWORD else token.value) for token in tokens]
+
+def deserialize_tokens(file_path: str, data: List[Tuple[int, str, int, int, Union[int, str, None]]]) -> List[Token]:
+    assert len(TokenType) == 5, "Exhaustive handling of token types in deserialize_tokens()"
+    file_path = sys.intern(file_path)
+    result: List[Token] = []
+    for typ_value, text, row, col, value in data:
+        typ = TOKEN_TYPES[typ_value]
+        if typ == TokenType.KEYWORD:
+            result.append(Token(typ, text, file_path, row, col, KEYWORD_NAMES[text]))
+        else:
+            assert value is not None, "This could be a bug in serialize_tokens()"
+            result.append(Token(typ, text, file_path, row, col, value))
+    return result
+
+def lex_cache_entry_path(cache_dir: str, abs_path: str) -> str:
+    import hashlib
+    return path.join(cache_dir, hashlib.sha1(abs_path.encode('utf-8')).hexdigest())
+
+def lex_file_cached(file_path: str, cache_dir: str) -> List[Token]:
+    '''Lex the file through the on-disk token cache.
+
+    An entry is keyed by the absolute path of the file and validated by the hash
+    of its content. If the mtime and the size of the file did not change since
+    the entry was written the file is not even read. Locations are rebuilt with
+    `file_path` as it was passed, so the diagnostics are the same as without the
+    cache.
+    '''
+    import hashlib, marshal
+    abs_path = path.abspath(file_path)
+    st = os.stat(file_path)
+    entry_path = lex_cache_entry_path(cache_dir, abs_path)
+    entry = None
+    try:
+        with open(entry_path, "rb") as f:
+            entry = marshal.loads(f.read())
+        version, entry_abs_path, mtime_ns, size, content_hash, data = entry
+        if version != LEX_CACHE_VERSION or entry_abs_path != abs_path:
+            entry = None
+    except (OSError, EOFError, ValueError, TypeError):
+        entry = None
+
+    if entry is not None and mtime_ns == st.st_mtime_ns and size == st.st_size:
+        return deserialize_tokens(file_path, data)
+
+    with open(file_path, "r", encoding='utf-8') as f:
+        text = f.read()
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    if entry is not None and content_hash == text_hash:
+        result = deserialize_tokens(file_path, data)
+    else:
+        result = lex_text(file_path, text)
+        data = serialize_tokens(result)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            marshal.dump((LEX_CACHE_VERSION, abs_path, st.st_mtime_ns, st.st_size, text_hash, data), f)
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        pass
+    return result
+
+def clear_cache(cache_dir: str):
+    if path.isdir(cache_dir):
+        import shutil
+        shutil.rmtree(cache_dir)
+
+def build_cache_key(program: Program, options: Tuple[Union[bool, int], ...]) -> str:
+    '''Hash of everything the executable of the program depends on.
+
+    The ops are the fully expanded token stream. The locations only matter
+    for `here`, the diagnostics can't differ because only programs that
+    compiled are cached. The source of the compiler is part of the key so a
+    changed compiler doesn't reuse the executables of the old one.
+    '''
+    import hashlib, marshal
+    h = hashlib.sha256()
+    with open(__file__, "rb") as f:
+        h.update(f.read())
+    h.update(marshal.dumps((BUILD_CACHE_VERSION, options)))
+    h.update(marshal.dumps([(op.typ.value, op.operand.value if isinstance(op.operand, Intrinsic) else op.operand, op.token.loc if op.operand == Intrinsic.HERE else None) for op in program]))
+    return h.hexdigest()
+
+def build_cache_lookup(cache_dir: str, key: str, basepath: str, exts: List[str]) -> bool:
+    '''Copy the cached files of the build to `basepath` followed by their extension if they are all there, marking the entry as recently used'''
+    import shutil
+    entry_path = path.join(cache_dir, key)
+    if not all(path.isfile(path.join(entry_path, BUILD_CACHE_FILE + ext)) for ext in exts):
+        return False
+    try:
+        for ext in exts:
+            tmp_path = "%s.%d.tmp" % (basepath + ext, os.getpid())
+            shutil.copyfile(path.join(entry_path, BUILD_CACHE_FILE + ext), tmp_path)
+            if ext == '':
+                os.chmod(tmp_path, 0o755)
+            os.replace(tmp_path, basepath + ext)
+        os.utime(entry_path)
+    except OSError:
+        return False
+    return True
+
+def build_cache_store(cache_dir: str, key: str, basepath: str, exts: List[str], capacity: int):
+    '''Cache the files of the build, `basepath` followed by every extension'''
+    import shutil
+    entry_path = path.join(cache_dir, key)
+    tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+    try:
+        os.makedirs(tmp_path)
+        for ext in exts:
+            shutil.copyfile(basepath + ext, path.join(tmp_path, BUILD_CACHE_FILE + ext))
+        os.replace(tmp_path, entry_path)
+        evict_build_cache(cache_dir, capacity)
+    except OSError:
+        # also when another process stored the entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def evict_build_cache(cache_dir: str, capacity: int):
+    '''Remove the least recently used entries until the cache takes at most `capacity` bytes'''
+    import shutil
+    entries: List[Tuple[int, int, str]] = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and not entry.name.endswith('.tmp'):
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            entries.append((entry.stat().st_mtime_ns, size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= capacity:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total -= size
+
+def lex_file(file_path: str) -> List[Token]:
+    if lex_memory_cache is not None:
+        st = os.stat(file_path)
+        entry = lex_memory_cache.get(file_path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        tokens = lex_file_uncached(file_path)
+        lex_memory_cache[file_path] = (st.st_mtime_ns, st.st_size, tokens)
+        return tokens
+    return lex_file_uncached(file_path)
+
+def lex_file_uncached(file_path: str) -> List[Token]:
+    '''Lex the file, through the on-disk cache unless it's disabled'''
+    if lex_cache_dir is not None:
+        return lex_file_cached(file_path, lex_cache_dir)
+    with open(file_path, "r", encoding='utf-8') as f:
+        return lex_text(file_path, f.read())
+
+def compile_file(file_path: str, include_paths: List[str], expansion_limit: int, include_once: bool = False) -> Program:
+    resolver = IncludeResolver(include_paths, include_once)
+    resolver.included.add(path.realpath(file_path))
+    return compile_tokens(lex_file(file_path), resolver, expansion_limit)
+
+def cmd_and_echo(cmd: List[str], silent: bool=False) -> int:
+    import subprocess, shlex
+    if not silent:
+        print("[CMD] %s" % " ".join(map(shlex.quote, cmd)))
+    return subprocess.call(cmd)
+
+@dataclass(slots=True)
+class ComOptions:
+    '''Options of `com` for com_file(), including the global ones, so they can be passed to the processes of a pool'''
+    include_paths: List[str]
+    expansion_limit: int
+    unsafe: bool
+    include_once: bool
+    silent: bool
+    compact_asm: bool
+    optimization_level: int
+    direct_elf: bool
+    keep_asm: bool
+    build_cache_size: int
+    lex_cache_dir: Optional[str]
+    build_cache_dir: Optional[str]
+    debug: bool
+    report_time: bool
+    report_stats: bool
+    report_json: bool
+    profile: bool
+
+@dataclass(slots=True)
+class Phase:
+    name: str
+    seconds: float
+    # ru_maxrss of the compiler at the end of the phase or, for nasm and ld, of the biggest child process so far
+    max_rss_kib: int
+
+@dataclass(slots=True)
+class CompileReport:
+    '''Phases and statistics of a compilation for -time, -stats and -json'''
+    phases: List[Phase] = field(default_factory=list)
+    stats: Dict[str, Any] = field(default_factory=dict)
+    # end of the last phase
+    start: float = field(default_factory=perf_counter)
+
+def report_phase(report: Optional[CompileReport], name: str, children: bool = False):
+    '''Record the time since the end of the previous phase as the phase `name`'''
+    if report is None:
+        return
+    import resource
+    now = perf_counter()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    report.phases.append(Phase(name, now - report.start, usage.ru_maxrss))
+    report.start = now
+
+def report_stat(report: Optional[CompileReport], name: str, value: Any):
+    if report is not None:
+        report.stats[name] = value
+
+def count_ops(program: Program) -> Tuple[Dict[str, int], Dict[str, int]]:
+    '''Number of ops of every OpType and of every intrinsic, most frequent first'''
+    op_types: Dict[str, int] = {}
+    intrinsics: Dict[str, int] = {}
+    for op in program:
+        op_types[op.typ.name] = op_types.get(op.typ.name, 0) + 1
+        if op.typ == OpType.INTRINSIC:
+            assert isinstance(op.operand, Intrinsic), "This could be a bug in compile_tokens()"
+            name = INTRINSIC_NAMES[op.operand]
+            intrinsics[name] = intrinsics.get(name, 0) + 1
+    by_count = lambda counts: dict(sorted(counts.items(), key=lambda item: item[1], reverse=True))
+    return by_count(op_types), by_count(intrinsics)
+
+def print_report(report: CompileReport, basepath: str, options: ComOptions):
+    if options.report_time:
+        total = sum(phase.seconds for phase in report.phases)
+        for phase in report.phases:
+            print("[TIME] %-14s %10.3f ms  %9d KiB max RSS" % (phase.name, phase.seconds * 1000, phase.max_rss_kib))
+        print("[TIME] %-14s %10.3f ms" % ("total", total * 1000))
+    if options.report_stats:
+        for name, value in report.stats.items():
+            if isinstance(value, dict):
+                print("[STATS] %s: %s" % (name, ", ".join("%s %d" % item for item in value.items()) if len(value) > 0 else "none"))
+            else:
+                print("[STATS] %s: %s" % (name, value))
+    if options.report_json:
+        import json
+        json_path = basepath + ".stats.json"
+        with open(json_path, "w") as f:
+            json.dump({
+                'program': basepath,
+                'optimization_level': options.optimization_level,
+                'direct_elf': options.direct_elf,
+                'phases': [{'name': phase.name, 'seconds': phase.seconds, 'max_rss_kib': phase.max_rss_kib} for phase in report.phases],
+                'stats': report.stats,
+            }, f, indent=2)
+            f.write("\n")
+        if not options.silent:
+            print("[INFO] Wrote %s" % json_path)
+
+def program_resolver(program_path: str, options: ComOptions) -> IncludeResolver:
+    resolver = IncludeResolver(options.include_paths + [path.dirname(program_path)], options.include_once)
+    resolver.included.add(path.realpath(program_path))
+    return resolver
+
+def front_end(program_path: str, resolver: IncludeResolver, options: ComOptions, report: Optional[CompileReport] = None) -> Program:
+    '''Lex the program and expand it into ops'''
+    tokens = lex_file(program_path)
+    report_phase(report, 'lex')
+    program = compile_tokens(tokens, resolver, options.expansion_limit)
+    report_phase(report, 'expand')
+    if report is not None:
+        # the included files are lexed during the expansion
+        lex, expansion = report.phases[-2:]
+        lex.seconds += resolver.lex_time
+        expansion.seconds -= resolver.lex_time
+        report.stats['tokens'] = len(tokens) + resolver.token_count
+        report.stats['files'] = 1 + len(resolver.lexed)
+        report.stats['includes'] = resolver.include_count
+        report.stats['macro_expansions'] = dict(sorted(resolver.macro_expansions.items(), key=lambda item: item[1], reverse=True))
+        report.stats['ops'] = len(program)
+        report.stats['op_types'], report.stats['intrinsics'] = count_ops(program)
+        # the statistics are not part of the next phase
+        report.start = perf_counter()
+    return program
+
+def output_base_path(program_path: str, output_path: Optional[str]) -> str:
+    '''Path of the executable of the program without the extension, next to the program or in or at `output_path`'''
+    if output_path is not None:
+        if path.isdir(output_path):
+            basename = path.basename(program_path)
+            if basename.endswith(TAU_EXT):
+                basename = basename[:-len(TAU_EXT)]
+            basedir = output_path
+        else:
+            basename = path.basename(output_path)
+            basedir = path.dirname(output_path)
+    else:
+        basename = path.basename(program_path)
+        if basename.endswith(TAU_EXT):
+            basename = basename[:-len(TAU_EXT)]
+        basedir = path.dirname(program_path)
+    if basedir == "":
+        basedir = os.getcwd()
+    return path.join(basedir, basename)
+
+def com_file(program_path: str, basepath: str, options: ComOptions) -> bool:
+    '''Compile the program to the executable `basepath`. Returns whether it was built, exits on compilation errors.'''
+    report = None
+    if options.report_time or options.report_stats or options.report_json:
+        report = CompileReport()
+    program = front_end(program_path, program_resolver(program_path, options), options, report)
+    return com_program(program, basepath, options, report)
+
+def com_program(program: Program, basepath: str, options: ComOptions, report: Optional[CompileReport] = None) -> bool:
+    '''The part of com_file() after the front end'''
+    built = com_back_end(program, basepath, options, report)
+    if report is not None and built:
+        report_stat(report, 'executable_bytes', os.stat(basepath).st_size)
+        print_report(report, basepath, options)
+    return built
+
+def com_back_end(program: Program, basepath: str, options: ComOptions, report: Optional[CompileReport]) -> bool:
+    cache_key = None
+    # the files written next to the executable, restored on a hit
+    cache_exts = ([''] + (['.asm'] if options.keep_asm else [])) if options.direct_elf else ['', '.asm', '.o']
+    # the executables of -profile write their counters next to themselves, and
+    # the reports are about the phases and the output of a build
+    if options.build_cache_dir is not None and not options.profile and report is None:
+        cache_key = build_cache_key(program, (options.unsafe, options.optimization_level, options.direct_elf, options.keep_asm, options.compact_asm))
+        if build_cache_lookup(options.build_cache_dir, cache_key, basepath, cache_exts):
+            if not options.silent:
+                print("[INFO] Build cache hit for %s" % basepath)
+            return True
+    if not options.silent:
+        print("[INFO] Generating %s" % (basepath if options.direct_elf else basepath + ".asm"))
+    depths = None
+    if not options.unsafe:
+        depths = type_check_program(program)
+        report_phase(report, 'type check')
+    if options.optimization_level >= 1:
+        program, depths = fold_constants(program, depths)
+        report_phase(report, 'fold')
+        report_stat(report, 'folded_ops', len(program))
+    profile = None
+    if options.profile:
+        profile = asm_profile(program, path.abspath(basepath + PROFILE_COUNTS_EXT))
+        write_profile_map(program, basepath)
+        if path.exists(profile.counts_path):
+            # the counters of the previous build would not match
+            os.remove(profile.counts_path)
+    comments = not options.compact_asm
+    if options.direct_elf:
+        compile_elf(program, basepath, comments=comments, all_labels=comments, optimization_level=options.optimization_level, depths=depths, asm_file_path=basepath + ".asm" if options.keep_asm else None, report=report, profile=profile)
+        built = True
+    else:
+        asm = generate_program_asm(program, comments, comments, options.optimization_level, depths, profile)
+        write_asm(asm, basepath + ".asm")
+        report_phase(report, 'generate asm')
+        report_stat(report, 'asm_bytes', asm_size(asm))
+        nasm_code = cmd_and_echo(["nasm", "-felf64", basepath + ".asm"], options.silent)
+        report_phase(report, 'nasm', children=True)
+        ld_code = cmd_and_echo(["ld", "-o", basepath, basepath + ".o"], options.silent)
+        report_phase(report, 'ld', children=True)
+        built = nasm_code == 0 and ld_code == 0
+    if cache_key is not None and built:
+        build_cache_store(options.build_cache_dir, cache_key, basepath, cache_exts, options.build_cache_size)
+    return built
+
+def com_worker(program_path: str, basepath: str, options: ComOptions) -> Tuple[str, int, float, bytes]:
+    '''com_file() in a process of the pool.
+
+    Everything written to stdout and stderr, including by nasm and ld, is
+    captured so the output of every program can be printed in one piece.
+    Returns the exit code, the time and the output.
+    '''
+    global lex_cache_dir, build_cache_dir, debug
+    import tempfile, traceback
+    lex_cache_dir = options.lex_cache_dir
+    build_cache_dir = options.build_cache_dir
+    debug = options.debug
+    start = perf_counter()
+    with tempfile.TemporaryFile() as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = [os.dup(1), os.dup(2)]
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            code = 0 if com_file(program_path, basepath, options) else 1
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip([1, 2], saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+        log.seek(0)
+        output = log.read()
+    return program_path, code, perf_counter() - start, output
+
+def com_inputs(args: List[str]) -> List[str]:
+    '''The programs to compile. The ones of a directory are its files with TAU_EXT.'''
+    program_paths: List[str] = []
+    for arg in args:
+        if path.isdir(arg):
+            program_paths.extend(sorted(path.join(arg, name) for name in os.listdir(arg) if name.endswith(TAU_EXT)))
+        else:
+            program_paths.append(arg)
+    return program_paths
+
+def com_many(program_paths: List[str], output_path: Optional[str], jobs: int, options: ComOptions) -> int:
+    '''Compile the programs with a pool of `jobs` processes, printing the output of each one as it finishes and a summary at the end'''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    start = perf_counter()
+    results: List[Tuple[str, int, float]] = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(com_worker, program_path, output_base_path(program_path, output_path), options) for program_path in program_paths]
+        for future in as_completed(futures):
+            program_path, code, elapsed, output = future.result()
+            sys.stdout.flush()
+            sys.stdout.buffer.write(output)
+            sys.stdout.flush()
+            results.append((program_path, code, elapsed))
+    failed = [program_path for program_path, code, _ in results if code != 0]
+    if not options.silent:
+        print("[INFO] Compiled %d of %d programs in %.3f s (-j %d)" % (len(results) - len(failed), len(results), perf_counter() - start, jobs))
+        for program_path, code, elapsed in sorted(results, key=lambda result: result[2], reverse=True):
+            print("  %8.3f s  %s%s" % (elapsed, program_path, "  (failed)" if code != 0 else ""))
+    for program_path in failed:
+        print("[ERROR] could not compile %s" % program_path, file=sys.stderr)
+    return 0 if len(failed) == 0 else 1
+
+FileStat = Optional[Tuple[int, int]]
+
+def watched_file_stat(stats: Dict[str, FileStat], file_path: str) -> FileStat:
+    '''mtime and size of the file or None if it doesn't exist, remembered in `stats` for the rest of a polling round'''
+    if file_path not in stats:
+        try:
+            st = os.stat(file_path)
+            stats[file_path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stats[file_path] = None
+    return stats[file_path]
+
+def watch_build(program_path: str, basepath: str, options: ComOptions, stats: Dict[str, FileStat]) -> Dict[str, FileStat]:
+    '''Compile the program like com_file() and return the files it depends on with their stats'''
+    start = perf_counter()
+    report = None
+    if options.report_time or options.report_stats or options.report_json:
+        report = CompileReport()
+    resolver = program_resolver(program_path, options)
+    front_end_time = 0.0
+    built = False
+    try:
+        program = front_end(program_path, resolver, options, report)
+        front_end_time = perf_counter() - start
+        built = com_program(program, basepath, options, report)
+    except SystemExit:
+        # the diagnostics are already printed
+        pass
+    except OSError as e:
+        print("[ERROR] could not read %s: %s" % (program_path, e.strerror), file=sys.stderr)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+    if built:
+        print("[INFO] Built %s in %.1f ms (front end %.1f ms)" % (basepath, (perf_counter() - start) * 1000, front_end_time * 1000))
+    else:
+        print("[ERROR] could not compile %s" % program_path, file=sys.stderr)
+    sys.stdout.flush()
+    return {file_path: watched_file_stat(stats, file_path) for file_path in resolver.included}
+
+def watch(args: List[str], output_path: Optional[str], interval: float, options: ComOptions) -> int:
+    '''Recompile the programs whenever one of the files they are compiled from changes, until interrupted.
+
+    The process keeps the tokens of every file it lexed, so a change only
+    costs lexing the changed files and compiling the programs that include
+    them. The files are polled every `interval` seconds, the directories in
+    `args` are rescanned for new programs too.
+    '''
+    global lex_memory_cache
+    lex_memory_cache = {}
+    # program path -> the files it was compiled from with their stats at that time
+    dependencies: Dict[str, Dict[str, FileStat]] = {}
+    if not options.silent:
+        print("[INFO] Watching %s, stop with Ctrl-C" % ", ".join(args))
+    try:
+        while True:
+            stats: Dict[str, FileStat] = {}
+            for program_path in com_inputs(args):
+                files = dependencies.get(program_path)
+                if files is not None and all(watched_file_stat(stats, file_path) == stat for file_path, stat in files.items()):
+                    continue
+                dependencies[program_path] = watch_build(program_path, output_base_path(program_path, output_path), options, stats)
+            sleep(interval)
+    except KeyboardInterrupt:
+        return 0
+
+def usage(compiler_name: str):
+    print("Usage: %s [OPTIONS] <SUBCOMMAND> [ARGS]" % compiler_name)
+    print("  OPTIONS:")
+    print("    -debug                Enable debug mode.")
+    print("    -I <path>             Add the path to the include search list")
+    print("    -E <expansion-limit>  Macro and include expansion limit. (Default %d)" % DEFAULT_EXPANSION_LIMIT)
+    print("    -unsafe               Disable type checking.")
+    print("    -include-once         Include every file at most once per compilation.")
+    print("    -no-cache             Don't use the on-disk token and build caches (%s)." % CACHE_DIR)
+    print("    -cache-size <MiB>     Size limit of the build cache. (Default %d)" % DEFAULT_BUILD_CACHE_SIZE_MB)
+    print("    -clear-cache          Remove the on-disk token and build caches before compiling.")
+    print("  SUBCOMMAND:")
+    print("    com [OPTIONS] <file|dir>...  Compile the programs, all the %s files of a directory" % TAU_EXT)
+    print("      OPTIONS:")
+    print("        -r                  Run the program after successful compilation. The arguments after the file are passed to it.")
+    print("        -o <file|dir>       Customize the output path. Has to be a directory for several programs.")
+    print("        -j <n>              Compile several programs with n processes. (Default: the number of CPUs)")
+    print("        -s                  Silent mode. Don't print any info about compilation phases.")
+    print("        -compact-asm        Leave comments and unreferenced labels out of the generated assembly.")
+    print("        -O0                 Don't optimize the generated assembly. (Default)")
+    print("        -O1                 Fold constants, fuse comparisons with branches and run the peephole optimizer.")
+    print("        -O2                 Also keep the top of the data stack in registers.")
+    print("        -elf                Write the executable directly instead of running nasm and ld.")
+    print("        -asm                With -elf, also write the generated assembly.")
+    print("        -time               Print the time and the peak memory of every compilation phase.")
+    print("        -stats              Print the number of tokens, includes, macro expansions, ops and bytes of assembly.")
+    print("        -json               Write the -time and -stats report to <output>.stats.json.")
+    print("        -profile            Count the runs of every basic block. The executable writes them to <output>%s at exit." % PROFILE_COUNTS_EXT)
+    print("    watch [OPTIONS] <file|dir>...  Compile the programs again whenever they or their includes change")
+    print("      OPTIONS:")
+    print("        The ones of com except -r and -j")
+    print("        -interval <seconds> Time between the checks for changes. (Default %g)" % DEFAULT_WATCH_INTERVAL)
+    print("    sim [OPTIONS] <file> [ARGS]  Simulate the program in Python without compiling it. The arguments after the file are passed to it.")
+    print("      OPTIONS:")
+    print("        -interpret          Run the ops one by one instead of translating the basic blocks to Python functions first.")
+    print("        -profile            Count the runs of every op and write the %s and %s profile reports." % (PROFILE_REPORT_EXT, PROFILE_FOLDED_EXT))
+    print("    profile <executable>  Write the %s and %s reports of an executable compiled with -profile after it ran" % (PROFILE_REPORT_EXT, PROFILE_FOLDED_EXT))
+    print("    help                  Print this help to stdout and exit with 0 code")
+
+def main():
+    '''The command line of tau.py'''
+    global lex_cache_dir, build_cache_dir, debug
+    argv = sys.argv
+    assert len(argv) >= 1
+    compiler_name, *argv = argv
+
+    include_paths = ['.', './std/']
+    expansion_limit = DEFAULT_EXPANSION_LIMIT
+    unsafe = False
+    include_once = False
+    build_cache_size = DEFAULT_BUILD_CACHE_SIZE_MB * 1024 * 1024
+
+    while len(argv) > 0:
+        if argv[0] == '-debug':
+            argv = argv[1:]
+            debug = True
+        elif argv[0] == '-I':
+            argv = argv[1:]
+            if len(argv) == 0:
+                usage(compiler_name)
+                print("[ERROR] no path is provided for `-I` flag", file=sys.stderr)
+                exit(1)
+            include_path, *argv = argv
+            include_paths.append(include_path)
+        elif argv[0] == '-E':
+            argv = argv[1:]
+            if len(argv) == 0:
+                usage(compiler_name)
+                print("[ERROR] no value is provided for `-E` flag", file=sys.stderr)
+                exit(1)
+            arg, *argv = argv
+            expansion_limit = int(arg)
+        elif argv[0] == '-unsafe':
+            argv = argv[1:]
+            unsafe = True
+        elif argv[0] == '-include-once':
+            argv = argv[1:]
+            include_once = True
+        elif argv[0] == '-no-cache':
+            argv = argv[1:]
+            lex_cache_dir = None
+            build_cache_dir = None
+        elif argv[0] == '-cache-size':
+            argv = argv[1:]
+            if len(argv) == 0:
+                usage(compiler_name)
+                print("[ERROR] no value is provided for `-cache-size` flag", file=sys.stderr)
+                exit(1)
+            arg, *argv = argv
+            build_cache_size = int(arg) * 1024 * 1024
+        elif argv[0] == '-clear-cache':
+            argv = argv[1:]
+            clear_cache(CACHE_DIR)
+        else:
+            break
+
+    if debug:
+        print("[INFO] Debug mode is enabled")
+
+    if len(argv) < 1:
+        usage(compiler_name)
+        print("[ERROR] no subcommand is provided", file=sys.stderr)
+        exit(1)
+    subcommand, *argv = argv
+
+    if subcommand in ["com", "watch"]:
+        silent = False
+        run = False
+        output_path = None
+        compact_asm = False
+        optimization_level = 0
+        direct_elf = False
+        keep_asm = False
+        report_time = False
+        report_stats = False
+        report_json = False
+        profile = False
+        jobs = os.cpu_count() or 1
+        interval = DEFAULT_WATCH_INTERVAL
+        program_paths: List[str] = []
+        while len(argv) > 0:
+            arg, *argv = argv
+            if arg == '-r' and subcommand == "com":
+                run = True
+            elif arg == '-compact-asm':
+                compact_asm = True
+            elif arg == '-elf':
+                direct_elf = True
+            elif arg == '-asm':
+                keep_asm = True
+            elif arg == '-time':
+                report_time = True
+            elif arg == '-stats':
+                report_stats = True
+            elif arg == '-json':
+                report_json = True
+            elif arg == '-profile':
+                profile = True
+            elif arg in ['-O0', '-O1', '-O2']:
+                optimization_level = int(arg[2:])
+            elif arg == '-s':
+                silent = True
+            elif arg == '-o':
+                if len(argv) == 0:
+                    usage(compiler_name)
+                    print("[ERROR] no argument is provided for parameter -o", file=sys.stderr)
+                    exit(1)
+                output_path, *argv = argv
+            elif arg == '-j' and subcommand == "com":
+                if len(argv) == 0:
+                    usage(compiler_name)
+                    print("[ERROR] no argument is provided for parameter -j", file=sys.stderr)
+                    exit(1)
+                arg, *argv = argv
+                jobs = int(arg)
+            elif arg == '-interval' and subcommand == "watch":
+                if len(argv) == 0:
+                    usage(compiler_name)
+                    print("[ERROR] no argument is provided for parameter -interval", file=sys.stderr)
+                    exit(1)
+                arg, *argv = argv
+                interval = float(arg)
+            elif run:
+                # the rest are the arguments of the program
+                program_paths = [arg]
+                break
+            else:
+                program_paths = [arg] + argv
+                argv = []
+                break
+
+        if len(program_paths) == 0:
+            usage(compiler_name)
+            print("[ERROR] no input file is provided for the compilation", file=sys.stderr)
+            exit(1)
+
+        options = ComOptions(include_paths, expansion_limit, unsafe, include_once, silent, compact_asm, optimization_level,
+                             direct_elf, keep_asm, build_cache_size, lex_cache_dir, build_cache_dir, debug,
+                             report_time, report_stats, report_json, profile)
+        if subcommand == "watch":
+            if (len(program_paths) > 1 or path.isdir(program_paths[0])) and output_path is not None and not path.isdir(output_path):
+                usage(compiler_name)
+                print("[ERROR] the output path of several programs has to be a directory", file=sys.stderr)
+                exit(1)
+            exit(watch(program_paths, output_path, interval, options))
+        if len(program_paths) > 1 or path.isdir(program_paths[0]):
+            if run:
+                usage(compiler_name)
+                print("[ERROR] -r can only run a single program", file=sys.stderr)
+                exit(1)
+            if output_path is not None and not path.isdir(output_path):
+                usage(compiler_name)
+                print("[ERROR] the output path of several programs has to be a directory", file=sys.stderr)
+                exit(1)
+            program_paths = com_inputs(program_paths)
+            exit(com_many(program_paths, output_path, max(1, min(jobs, len(program_paths))), options))
+
+        program_path = program_paths[0]
+        basepath = output_base_path(program_path, output_path)
+        com_file(program_path, basepath, options)
+        if run:
+            exit_code = cmd_and_echo([basepath] + argv, silent)
+            if profile:
+                import tau_sim
+                tau_sim.write_profile_report(*tau_sim.read_profile(basepath), basepath)
+            exit(exit_code)
+    elif subcommand == "sim":
+        if len(argv) < 1:
+            usage(compiler_name)
+            print("[ERROR] no input file is provided for the simulation", file=sys.stderr)
+            exit(1)
+        interpret = False
+        profile = False
+        while len(argv) > 0 and argv[0] in ['-interpret', '-profile']:
+            arg, *argv = argv
+            if arg == '-interpret':
+                interpret = True
+            else:
+                profile = True
+        if len(argv) < 1:
+            usage(compiler_name)
+            print("[ERROR] no input file is provided for the simulation", file=sys.stderr)
+            exit(1)
+        program_path, *argv = argv
+        import tau_sim
+        exit(tau_sim.sim_file(program_path, argv, include_paths, expansion_limit, unsafe, include_once, interpret, profile))
+    elif subcommand == "profile":
+        if len(argv) != 1:
+            usage(compiler_name)
+            print("[ERROR] expected the path of a single executable compiled with -profile", file=sys.stderr)
+            exit(1)
+        basepath, = argv
+        import tau_sim
+        tau_sim.write_profile_report(*tau_sim.read_profile(basepath), basepath)
+    elif subcommand == "help":
+        usage(compiler_name)
+        exit(0)
+    else:
+        usage(compiler_name)
+        print("[ERROR] unknown subcommand %s" % (subcommand), file=sys.stderr)
+        exit(1)
@@ -0,0 +1,768 @@
+# The simulator of `tau.py sim` and the reports of -profile, see
+# PROFILE_MAP_EXT in tau_compiler.py.
+#
+# tau_compiler.py imports this module only for the `sim` and `profile`
+# subcommands and after a -profile run, the rest of the subcommands don't load
+# it.
+
+import os
+import sys
+from os import path
+from typing import *
+from dataclasses import dataclass, field
+
+from tau_compiler import (
+    MEM_CAP, OUTPUT_BUFFER_CAP, SIM_NULL_POINTER_PADDING, SIM_STR_CAPACITY, SIM_ARGV_CAPACITY,
+    Intrinsic, OpType, OpAddr, Program, BasicBlock, FOLD_INTRINSICS, IncludeResolver,
+    word, control_flow_graph, rotated_loops, compile_tokens, lex_file, type_check_program,
+    compiler_error_with_expansion_stack, output_base_path,
+    PROFILE_MAP_EXT, PROFILE_COUNTS_EXT, PROFILE_REPORT_EXT, PROFILE_FOLDED_EXT, ProfileFrame, profile_frames,
+)
+
+# Layout of the memory of the simulation: a null pointer padding, the string
+# literals, the command line arguments, then the `bit` region. Pointers are
+# offsets into it.
+SIM_STR_START = SIM_NULL_POINTER_PADDING
+SIM_ARGV_START = SIM_STR_START + SIM_STR_CAPACITY
+SIM_MEM_START = SIM_ARGV_START + SIM_ARGV_CAPACITY
+SIM_MEM_SIZE = SIM_MEM_START + MEM_CAP
+
+class SimError(Exception):
+    '''Runtime error of the simulated program, reported at the op `ip` or at the one that raised it'''
+    def __init__(self, message: str, ip: Optional[OpAddr] = None):
+        super().__init__(message)
+        self.ip = ip
+
+@dataclass(slots=True)
+class Sim:
+    '''State of a simulated program. The values of the stack are words, see word().'''
+    mem: bytearray
+    argc: int
+    stack: List[int] = field(default_factory=list)
+    # the output of `prn` is buffered like in the runtime of the executables
+    output: bytearray = field(default_factory=bytearray)
+    str_size: int = 0
+    exit_code: int = 0
+
+# A handler executes the op with its pre-decoded operand and returns the
+# address of the next op
+SimHandler = Callable[[Sim, Any, OpAddr], OpAddr]
+SIM_EXIT = sys.maxsize
+
+def sim_alloc_str(sim: Sim, value: bytes) -> int:
+    if sim.str_size + len(value) > SIM_STR_CAPACITY:
+        raise SimError("string literals exceed the capacity of %d bytes" % SIM_STR_CAPACITY)
+    ptr = SIM_STR_START + sim.str_size
+    sim.mem[ptr:ptr + len(value)] = value
+    sim.str_size += len(value)
+    return ptr
+
+def sim_load_args(sim: Sim, args: List[str]):
+    '''Null terminated pointers to the arguments at SIM_ARGV_START followed by the null terminated arguments'''
+    values = [arg.encode('utf-8') + b'\0' for arg in args]
+    ptr = SIM_ARGV_START + 8 * (len(args) + 1)
+    if ptr + sum(map(len, values)) > SIM_MEM_START:
+        raise SimError("command line arguments exceed the capacity of %d bytes" % SIM_ARGV_CAPACITY)
+    for i, value in enumerate(values):
+        sim.mem[SIM_ARGV_START + 8 * i:SIM_ARGV_START + 8 * i + 8] = ptr.to_bytes(8, 'little')
+        sim.mem[ptr:ptr + len(value)] = value
+        ptr += len(value)
+    sim.argc = len(args)
+
+def sim_flush(sim: Sim):
+    '''Write the buffered output of `prn` to stdout. What is left after a failed write is lost, like in flushOutput.'''
+    output = memoryview(sim.output)
+    try:
+        while len(output) > 0:
+            output = output[os.write(1, output):]
+    except OSError:
+        pass
+    output.release()
+    sim.output.clear()
+
+def sim_check_memory(sim: Sim, ptr: int, size: int):
+    if not 0 <= ptr <= len(sim.mem) - size:
+        raise SimError("memory access out of bounds at %d" % ptr)
+
+# errno of a syscall given a buffer outside of the memory
+SIM_EFAULT = 14
+
+def sim_buffer_ok(sim: Sim, ptr: int, count: int) -> bool:
+    return 0 <= ptr and 0 <= count and ptr + count <= len(sim.mem)
+
+def sim_read(sim: Sim, fd: int, ptr: int, count: int, *_: int) -> int:
+    if not sim_buffer_ok(sim, ptr, count):
+        return -SIM_EFAULT
+    data = os.read(fd, count)
+    sim.mem[ptr:ptr + len(data)] = data
+    return len(data)
+
+def sim_write(sim: Sim, fd: int, ptr: int, count: int, *_: int) -> int:
+    if not sim_buffer_ok(sim, ptr, count):
+        return -SIM_EFAULT
+    return os.write(fd, sim.mem[ptr:ptr + count])
+
+def sim_exit(sim: Sim, code: int, *_: int) -> int:
+    sim.exit_code = code & 0xFF
+    return 0
+
+# syscall number -> (function, whether the program stops)
+SIM_SYSCALLS: Dict[int, Tuple[Callable[..., int], bool]] = {
+    0: (sim_read, False),
+    1: (sim_write, False),
+    60: (sim_exit, True),
+}
+
+def sim_push(sim: Sim, value: int, ip: OpAddr) -> OpAddr:
+    sim.stack.append(value)
+    return ip + 1
+
+def sim_push2(sim: Sim, values: Tuple[int, int], ip: OpAddr) -> OpAddr:
+    sim.stack.extend(values)
+    return ip + 1
+
+def sim_jump(sim: Sim, target: OpAddr, ip: OpAddr) -> OpAddr:
+    return target
+
+def sim_jump_if_zero(sim: Sim, target: OpAddr, ip: OpAddr) -> OpAddr:
+    return ip + 1 if sim.stack.pop() else target
+
+def sim_nop(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    return ip + 1
+
+def sim_plus(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = ((stack[-1] + b + 2**63) & (2**64 - 1)) - 2**63
+    return ip + 1
+
+def sim_minus(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = ((stack[-1] - b + 2**63) & (2**64 - 1)) - 2**63
+    return ip + 1
+
+def sim_mul(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = ((stack[-1] * b + 2**63) & (2**64 - 1)) - 2**63
+    return ip + 1
+
+def sim_divmod(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop() & (2**64 - 1)
+    if b == 0:
+        raise SimError("division by zero")
+    a = stack[-1] & (2**64 - 1)
+    stack[-1] = word(a // b)
+    stack.append(word(a % b))
+    return ip + 1
+
+def sim_shr(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = word((stack[-1] & (2**64 - 1)) >> (b & 63))
+    return ip + 1
+
+def sim_shl(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = word(stack[-1] << (b & 63))
+    return ip + 1
+
+def sim_or(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] |= b
+    return ip + 1
+
+def sim_and(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] &= b
+    return ip + 1
+
+def sim_not(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    sim.stack[-1] = ~sim.stack[-1]
+    return ip + 1
+
+def sim_eq(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = int(stack[-1] == b)
+    return ip + 1
+
+def sim_ne(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = int(stack[-1] != b)
+    return ip + 1
+
+def sim_gt(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = int(stack[-1] > b)
+    return ip + 1
+
+def sim_lt(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = int(stack[-1] < b)
+    return ip + 1
+
+def sim_ge(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = int(stack[-1] >= b)
+    return ip + 1
+
+def sim_le(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    b = stack.pop()
+    stack[-1] = int(stack[-1] <= b)
+    return ip + 1
+
+def sim_print(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    sim.output += b'%d\n' % (sim.stack.pop() & (2**64 - 1))
+    if len(sim.output) >= OUTPUT_BUFFER_CAP:
+        sim_flush(sim)
+    return ip + 1
+
+def sim_dup(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    sim.stack.append(sim.stack[-1])
+    return ip + 1
+
+def sim_swap(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    stack[-1], stack[-2] = stack[-2], stack[-1]
+    return ip + 1
+
+def sim_drop(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    sim.stack.pop()
+    return ip + 1
+
+def sim_over(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    sim.stack.append(sim.stack[-2])
+    return ip + 1
+
+def sim_rot(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    stack.append(stack.pop(-3))
+    return ip + 1
+
+def sim_load(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    sim_check_memory(sim, stack[-1], 1)
+    stack[-1] = sim.mem[stack[-1]]
+    return ip + 1
+
+def sim_store(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    value = stack.pop()
+    ptr = stack.pop()
+    sim_check_memory(sim, ptr, 1)
+    sim.mem[ptr] = value & 0xFF
+    return ip + 1
+
+def sim_load64(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    ptr = stack[-1]
+    sim_check_memory(sim, ptr, 8)
+    stack[-1] = int.from_bytes(sim.mem[ptr:ptr + 8], 'little', signed=True)
+    return ip + 1
+
+def sim_store64(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    value = stack.pop()
+    ptr = stack.pop()
+    sim_check_memory(sim, ptr, 8)
+    sim.mem[ptr:ptr + 8] = value.to_bytes(8, 'little', signed=True)
+    return ip + 1
+
+def sim_argc(sim: Sim, _: None, ip: OpAddr) -> OpAddr:
+    sim.stack.append(sim.argc)
+    return ip + 1
+
+def sim_call(sim: Sim, number: int, args: List[int], ip: OpAddr) -> Tuple[int, bool]:
+    '''Result of the syscall and whether the program stops'''
+    if number not in SIM_SYSCALLS:
+        raise SimError("unsupported syscall %d" % number, ip)
+    sim_flush(sim)
+    function, stops = SIM_SYSCALLS[number]
+    try:
+        return function(sim, *args), stops
+    except OSError as e:
+        return -e.errno, stops
+    except TypeError:
+        raise SimError("not enough arguments for syscall %d" % number, ip)
+
+def sim_syscall(sim: Sim, arity: int, ip: OpAddr) -> OpAddr:
+    stack = sim.stack
+    number = stack.pop()
+    result, stops = sim_call(sim, number, [stack.pop() for _ in range(arity)], ip)
+    stack.append(result)
+    return SIM_EXIT if stops else ip + 1
+
+# The handlers of the ops that don't depend on the operand. The others are
+# decoded by sim_decode().
+SIM_INTRINSICS: Dict[Intrinsic, SimHandler] = {
+    Intrinsic.PLUS: sim_plus,
+    Intrinsic.MINUS: sim_minus,
+    Intrinsic.MUL: sim_mul,
+    Intrinsic.DIVMOD: sim_divmod,
+    Intrinsic.EQ: sim_eq,
+    Intrinsic.GT: sim_gt,
+    Intrinsic.LT: sim_lt,
+    Intrinsic.GE: sim_ge,
+    Intrinsic.LE: sim_le,
+    Intrinsic.NE: sim_ne,
+    Intrinsic.SHR: sim_shr,
+    Intrinsic.SHL: sim_shl,
+    Intrinsic.OR: sim_or,
+    Intrinsic.AND: sim_and,
+    Intrinsic.NOT: sim_not,
+    Intrinsic.PRINT: sim_print,
+    Intrinsic.DUP: sim_dup,
+    Intrinsic.SWAP: sim_swap,
+    Intrinsic.DROP: sim_drop,
+    Intrinsic.OVER: sim_over,
+    Intrinsic.ROT: sim_rot,
+    Intrinsic.LOAD: sim_load,
+    Intrinsic.STORE: sim_store,
+    Intrinsic.LOAD64: sim_load64,
+    Intrinsic.STORE64: sim_store64,
+    Intrinsic.CAST_PTR: sim_nop,
+    Intrinsic.ARGC: sim_argc,
+}
+SIM_OPS: Dict[OpType, SimHandler] = {
+    OpType.IF: sim_jump_if_zero,
+    OpType.ELSE: sim_jump,
+    OpType.END: sim_jump,
+    OpType.WHILE: sim_nop,
+    OpType.DO: sim_jump_if_zero,
+}
+SIM_SYSCALL_ARITIES = {Intrinsic.SYSCALL0: 0, Intrinsic.SYSCALL1: 1, Intrinsic.SYSCALL2: 2, Intrinsic.SYSCALL3: 3, Intrinsic.SYSCALL4: 4, Intrinsic.SYSCALL5: 5, Intrinsic.SYSCALL6: 6}
+assert len(SIM_INTRINSICS) + len(SIM_SYSCALL_ARITIES) == len(Intrinsic) - 3, "Every intrinsic but bit, argv and here has its handler in SIM_INTRINSICS"
+assert len(SIM_OPS) == len(OpType) - 3, "Every op but the pushes and the intrinsics has its handler in SIM_OPS"
+
+def sim_decode(sim: Sim, program: Program) -> List[Tuple[SimHandler, Any]]:
+    '''The handler and the operand of every op. The string literals are allocated in the memory of `sim`.'''
+    code: List[Tuple[SimHandler, Any]] = []
+    assert len(OpType) == 8, "Exhaustive ops handling in sim_decode()"
+    for op in program:
+        if op.typ == OpType.PUSH_INT:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            code.append((sim_push, word(op.operand)))
+        elif op.typ == OpType.PUSH_STR:
+            assert isinstance(op.operand, str), "This could be a bug in the compilation step"
+            value = op.operand.encode('utf-8')
+            code.append((sim_push2, (len(value), sim_alloc_str(sim, value))))
+        elif op.typ == OpType.INTRINSIC:
+            if op.operand == Intrinsic.HERE:
+                value = ("%s:%d:%d" % op.token.loc).encode('utf-8')
+                code.append((sim_push2, (len(value), sim_alloc_str(sim, value))))
+            elif op.operand == Intrinsic.MEM:
+                code.append((sim_push, SIM_MEM_START))
+            elif op.operand == Intrinsic.ARGV:
+                code.append((sim_push, SIM_ARGV_START))
+            elif op.operand in SIM_SYSCALL_ARITIES:
+                code.append((sim_syscall, SIM_SYSCALL_ARITIES[op.operand]))
+            else:
+                assert isinstance(op.operand, Intrinsic), "This could be a bug in the compilation step"
+                code.append((SIM_INTRINSICS[op.operand], None))
+        else:
+            code.append((SIM_OPS[op.typ], op.operand))
+    return code
+
+def sim_interpret(sim: Sim, code: List[Tuple[SimHandler, Any]], ip: OpAddr, counts: Optional[List[int]] = None) -> None:
+    '''Run the ops from `ip` to the end of the program one by one, counting the runs of every op in `counts` if given'''
+    n = len(code)
+    try:
+        if counts is not None:
+            while ip < n:
+                counts[ip] += 1
+                handler, operand = code[ip]
+                ip = handler(sim, operand, ip)
+        else:
+            while ip < n:
+                handler, operand = code[ip]
+                ip = handler(sim, operand, ip)
+    except IndexError:
+        raise SimError("stack underflow", ip)
+    except SimError as e:
+        if e.ip is None:
+            e.ip = ip
+        raise
+
+def simulate_program(program: Program, args: List[str], interpret: bool = False, counts: Optional[List[int]] = None) -> int:
+    '''Run the program in Python, with the memory layout described at SIM_STR_START. Returns the exit code.
+
+    The ops are run one by one with their handlers if `interpret` or if their
+    runs are counted in `counts`, otherwise the program is translated with
+    sim_translate() first.
+    '''
+    sim = Sim(bytearray(SIM_MEM_SIZE), 0)
+    try:
+        sim_load_args(sim, args)
+        code = sim_decode(sim, program)
+        if interpret or counts is not None:
+            sim_interpret(sim, code, 0, counts)
+        else:
+            block = sim_translate(sim, program, code)
+            while block is not None:
+                block = block()
+    except SimError as e:
+        sim_flush(sim)
+        sim_runtime_error(program, len(program) if e.ip is None else e.ip, str(e))
+        return 1
+    sim_flush(sim)
+    return sim.exit_code
+
+def sim_runtime_error(program: Program, ip: OpAddr, message: str):
+    if ip < len(program):
+        compiler_error_with_expansion_stack(program[ip].token, message, program[ip].expanded_from)
+    else:
+        print("[ERROR] %s" % message, file=sys.stderr)
+
+def sim_file(program_path: str, args: List[str], include_paths: List[str], expansion_limit: int, unsafe: bool, include_once: bool, interpret: bool = False, profile: bool = False) -> int:
+    '''Simulate the program, type checked unless `unsafe`. Returns the exit code, exits on compilation errors.
+
+    With `profile` the ops run one by one and the -profile report is written
+    next to where `com` would write the executable.
+    '''
+    resolver = IncludeResolver(include_paths + [path.dirname(program_path)], include_once)
+    resolver.included.add(path.realpath(program_path))
+    program = compile_tokens(lex_file(program_path), resolver, expansion_limit)
+    if not unsafe:
+        type_check_program(program)
+    if not profile:
+        return simulate_program(program, [program_path] + args, interpret)
+    counts = [0] * len(program)
+    exit_code = simulate_program(program, [program_path] + args, counts=counts)
+    write_profile_report([profile_frames(op) for op in program], counts, output_base_path(program_path, None))
+    return exit_code
+
+# The fast path of the simulation translates every basic block into a Python
+# function. The values the block works with are locals, only the ones it leaves
+# are written back to the stack at its end, and it returns the function of the
+# block that comes next.
+SIM_WORD_MASK = 2**64 - 1
+SIM_SIGN_BIT = 2**63
+
+def sim_wrap(expr: str) -> str:
+    return '((%s + %d) & %d) - %d' % (expr, SIM_SIGN_BIT, SIM_WORD_MASK, SIM_SIGN_BIT)
+
+def sim_block_name(addr: OpAddr, program: Program) -> str:
+    return 'b%d' % addr if addr < len(program) else 'None'
+
+# intrinsic -> Python operator of the comparisons
+SIM_COMPARISONS = {
+    Intrinsic.EQ: '==',
+    Intrinsic.NE: '!=',
+    Intrinsic.GT: '>',
+    Intrinsic.LT: '<',
+    Intrinsic.GE: '>=',
+    Intrinsic.LE: '<=',
+}
+
+def sim_translate_block(sim: Sim, program: Program, code: List[Tuple[SimHandler, Any]], block: BasicBlock, loops: Dict[OpAddr, Tuple[OpAddr, OpAddr]]) -> List[str]:
+    '''Source of the function of the block. Constant arguments are folded with FOLD_INTRINSICS.
+
+    A block that ends a loop of `loops` goes on with a copy of the condition of
+    the loop, like in the generated assembly. If the loop body is that single
+    block and leaves the stack as deep as it found it, the function runs the
+    whole loop in a Python `while`.
+    '''
+    lines: List[str] = []
+    # values on the stack since the start of the block, ints for the constants
+    # and names of locals or conditions for the others
+    values: List[Union[int, str]] = []
+    # number of values of the stack at the start of the block that are taken by the block
+    entries = 0
+    names = 0
+
+    def pop() -> Union[int, str]:
+        nonlocal entries
+        if len(values) > 0:
+            return values.pop()
+        entries += 1
+        return 'e%d' % (entries - 1)
+
+    def arg(value: Union[int, str]) -> str:
+        return '(%d)' % value if isinstance(value, int) else value
+
+    def assign(expr: str) -> str:
+        nonlocal names
+        names += 1
+        lines.append('t%d = %s' % (names, expr))
+        return 't%d' % names
+
+    def check_memory(ptr: Union[int, str], size: int, ip: OpAddr):
+        if isinstance(ptr, int) and 0 <= ptr <= len(sim.mem) - size:
+            return
+        lines.append('if not 0 <= %s <= %d: raise SimError("memory access out of bounds at %%d" %% %s, %d)' % (arg(ptr), len(sim.mem) - size, arg(ptr), ip))
+
+    def write_back() -> List[str]:
+        # the values at the bottom that are still where they were are left alone
+        kept = 0
+        while kept < min(entries, len(values)) and values[kept] == 'e%d' % (entries - 1 - kept):
+            kept += 1
+        taken, outputs = entries - kept, ', '.join(arg(value) for value in values[kept:])
+        if taken == 0:
+            if len(values) - kept == 1:
+                return ['stack.append(%s)' % outputs]
+            return ['stack.extend((%s, ))' % outputs] if len(values) > kept else []
+        if len(values) == kept:
+            return ['del stack[-%d:]' % taken]
+        if len(values) - kept == 1 and taken == 1:
+            return ['stack[-1] = %s' % outputs]
+        return ['stack[-%d:] = (%s, )' % (taken, outputs)]
+
+    ips = list(range(block.start, block.end))
+    if block.end - 1 in loops:
+        while_ip, do_ip = loops[block.end - 1]
+        ips.extend(range(while_ip + 1, do_ip + 1))
+    # the control flows to `following` if there is no condition or if it holds, to `target` otherwise
+    condition: Union[int, str, None] = None
+    following, target = block.end, block.end
+    assert len(OpType) == 8, "Exhaustive ops handling in sim_translate_block()"
+    for ip in ips:
+        op = program[ip]
+        if op.typ == OpType.PUSH_INT:
+            values.append(code[ip][1])
+        elif op.typ == OpType.PUSH_STR:
+            values.extend(code[ip][1])
+        elif op.typ in [OpType.IF, OpType.DO]:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            condition, following, target = pop(), ip + 1, op.operand
+        elif op.typ in [OpType.ELSE, OpType.END]:
+            assert isinstance(op.operand, int), "This could be a bug in the compilation step"
+            following = op.operand
+        elif op.typ == OpType.WHILE:
+            pass
+        elif op.typ == OpType.INTRINSIC:
+            intrinsic = op.operand
+            assert len(Intrinsic) == 37, "Exhaustive intrinsic handling in sim_translate_block()"
+            if intrinsic in FOLD_INTRINSICS:
+                arity, _, fold = FOLD_INTRINSICS[intrinsic]
+                if arity <= len(values) and all(isinstance(value, int) for value in values[len(values) - arity:]):
+                    folded = fold(*values[len(values) - arity:])
+                    if folded is not None:
+                        del values[len(values) - arity:]
+                        values.extend(folded)
+                        continue
+            if intrinsic == Intrinsic.PLUS:
+                b, a = pop(), pop()
+                values.append(assign(sim_wrap('%s + %s' % (arg(a), arg(b)))))
+            elif intrinsic == Intrinsic.MINUS:
+                b, a = pop(), pop()
+                values.append(assign(sim_wrap('%s - %s' % (arg(a), arg(b)))))
+            elif intrinsic == Intrinsic.MUL:
+                b, a = pop(), pop()
+                values.append(assign(sim_wrap('%s * %s' % (arg(a), arg(b)))))
+            elif intrinsic == Intrinsic.DIVMOD:
+                b, a = pop(), pop()
+                if not isinstance(b, int) or b == 0:
+                    lines.append('if %s == 0: raise SimError("division by zero", %d)' % (arg(b), ip))
+                quotient = assign('(%s & %d) // (%s & %d)' % (arg(a), SIM_WORD_MASK, arg(b), SIM_WORD_MASK))
+                remainder = assign('(%s & %d) %% (%s & %d)' % (arg(a), SIM_WORD_MASK, arg(b), SIM_WORD_MASK))
+                values.append(assign(sim_wrap(quotient)))
+                values.append(assign(sim_wrap(remainder)))
+            elif intrinsic in SIM_COMPARISONS:
+                b, a = pop(), pop()
+                comparison = '%s %s %s' % (arg(a), SIM_COMPARISONS[intrinsic], arg(b))
+                if ip + 1 in ips and program[ip + 1].typ in [OpType.IF, OpType.DO]:
+                    # taken right away by the branch
+                    values.append('(%s)' % comparison)
+                else:
+                    values.append(assign('1 if %s else 0' % comparison))
+            elif intrinsic == Intrinsic.SHR:
+                b, a = pop(), pop()
+                count = str(b & 63) if isinstance(b, int) else '(%s & 63)' % b
+                values.append(assign(sim_wrap('((%s & %d) >> %s)' % (arg(a), SIM_WORD_MASK, count))))
+            elif intrinsic == Intrinsic.SHL:
+                b, a = pop(), pop()
+                count = str(b & 63) if isinstance(b, int) else '(%s & 63)' % b
+                values.append(assign(sim_wrap('(%s << %s)' % (arg(a), count))))
+            elif intrinsic == Intrinsic.OR:
+                b, a = pop(), pop()
+                values.append(assign('%s | %s' % (arg(a), arg(b))))
+            elif intrinsic == Intrinsic.AND:
+                b, a = pop(), pop()
+                values.append(assign('%s & %s' % (arg(a), arg(b))))
+            elif intrinsic == Intrinsic.NOT:
+                values.append(assign('~%s' % arg(pop())))
+            elif intrinsic == Intrinsic.PRINT:
+                lines.append("out.extend(b'%%d\\n' %% (%s & %d))" % (arg(pop()), SIM_WORD_MASK))
+                lines.append('if len(out) >= %d: sim_flush(sim)' % OUTPUT_BUFFER_CAP)
+            elif intrinsic == Intrinsic.DUP:
+                a = pop()
+                values.extend((a, a))
+            elif intrinsic == Intrinsic.SWAP:
+                b, a = pop(), pop()
+                values.extend((b, a))
+            elif intrinsic == Intrinsic.DROP:
+                pop()
+            elif intrinsic == Intrinsic.OVER:
+                b, a = pop(), pop()
+                values.extend((a, b, a))
+            elif intrinsic == Intrinsic.ROT:
+                c, b, a = pop(), pop(), pop()
+                values.extend((b, c, a))
+            elif intrinsic == Intrinsic.MEM:
+                values.append(SIM_MEM_START)
+            elif intrinsic == Intrinsic.LOAD:
+                ptr = pop()
+                check_memory(ptr, 1, ip)
+                values.append(assign('mem[%s]' % arg(ptr)))
+            elif intrinsic == Intrinsic.STORE:
+                value, ptr = pop(), pop()
+                check_memory(ptr, 1, ip)
+                lines.append('mem[%s] = %s & 255' % (arg(ptr), arg(value)))
+            elif intrinsic == Intrinsic.LOAD64:
+                ptr = pop()
+                check_memory(ptr, 8, ip)
+                values.append(assign("from_bytes(mem[%s:%s + 8], 'little', signed=True)" % (arg(ptr), arg(ptr))))
+            elif intrinsic == Intrinsic.STORE64:
+                value, ptr = pop(), pop()
+                check_memory(ptr, 8, ip)
+                lines.append("mem[%s:%s + 8] = %s.to_bytes(8, 'little', signed=True)" % (arg(ptr), arg(ptr), arg(value)))
+            elif intrinsic == Intrinsic.CAST_PTR:
+                pass
+            elif intrinsic == Intrinsic.ARGC:
+                values.append(sim.argc)
+            elif intrinsic == Intrinsic.ARGV:
+                values.append(SIM_ARGV_START)
+            elif intrinsic == Intrinsic.HERE:
+                values.extend(code[ip][1])
+            elif intrinsic in SIM_SYSCALL_ARITIES:
+                number = pop()
+                args = [arg(pop()) for _ in range(SIM_SYSCALL_ARITIES[intrinsic])]
+                names += 1
+                lines.append('t%d, stop = sim_call(sim, %s, [%s], %d)' % (names, arg(number), ', '.join(args), ip))
+                lines.append('if stop: return None')
+                values.append('t%d' % names)
+            else:
+                assert False, "unreachable"
+        else:
+            assert False, "unreachable"
+
+    header = []
+    if entries > 0:
+        # the interpreter runs the ops before the one that underflows and reports it
+        header.append('if len(stack) < %d: return interpret(sim, code, %d)' % (entries, block.start))
+        if entries == 1:
+            header.append('e0 = stack[-1]')
+        else:
+            header.append('%s = stack[-%d:]' % (', '.join('e%d' % i for i in reversed(range(entries))), entries))
+    if isinstance(condition, str) and following == block.start and len(values) == entries:
+        # the next iteration starts with the values this one leaves
+        loop = lines + ['if not %s: break' % condition]
+        changed = [(i, value) for i, value in enumerate(values) if value != 'e%d' % (entries - 1 - i)]
+        if len(changed) > 0:
+            loop.append('%s = %s' % (', '.join('e%d' % (entries - 1 - i) for i, _ in changed), ', '.join(arg(value) for _, value in changed)))
+        body = header + ['while True:'] + ['    ' + line for line in loop] + write_back() + ['return %s' % sim_block_name(target, program)]
+    else:
+        if condition is None or isinstance(condition, int) and condition != 0:
+            exit = 'return %s' % sim_block_name(following, program)
+        elif isinstance(condition, int):
+            exit = 'return %s' % sim_block_name(target, program)
+        else:
+            exit = 'return %s if %s else %s' % (sim_block_name(following, program), condition, sim_block_name(target, program))
+        body = header + lines + write_back() + [exit]
+    return ['def b%d():' % block.start] + ['    ' + line for line in body]
+
+def sim_translate(sim: Sim, program: Program, code: List[Tuple[SimHandler, Any]]) -> Optional[Callable[[], Any]]:
+    '''Function of the first block of the program, see sim_translate_block(). A block returns the next one, None at the end.'''
+    if len(program) == 0:
+        return None
+    loops = rotated_loops(program)
+    lines = ['def blocks(stack, mem, sim, out, code):']
+    for block in control_flow_graph(program).values():
+        lines.extend('    ' + line for line in sim_translate_block(sim, program, code, block, loops))
+    lines.append('    return b0')
+    namespace: Dict[str, Any] = {'SimError': SimError, 'sim_flush': sim_flush, 'sim_call': sim_call, 'interpret': sim_interpret, 'from_bytes': int.from_bytes}
+    exec('\n'.join(lines) + '\n', namespace)
+    return namespace['blocks'](sim.stack, sim.mem, sim, sim.output, code)
+
+def read_profile(basepath: str) -> Tuple[List[List[ProfileFrame]], List[int]]:
+    '''Frames and number of runs of every op of the executable `basepath` after a -profile run. Exits on errors.
+
+    Every op runs as many times as its basic block, including the ops after a
+    syscall that exited in the middle of the block.
+    '''
+    import json
+    try:
+        with open(basepath + PROFILE_MAP_EXT) as f:
+            profile_map = json.load(f)
+    except FileNotFoundError:
+        print("[ERROR] %s was not compiled with -profile" % basepath, file=sys.stderr)
+        exit(1)
+    try:
+        with open(basepath + PROFILE_COUNTS_EXT, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        print("[ERROR] no %s, run %s first" % (basepath + PROFILE_COUNTS_EXT, basepath), file=sys.stderr)
+        exit(1)
+    blocks = profile_map['blocks']
+    if len(data) != 8 * len(blocks):
+        print("[ERROR] %s does not match %s, run %s again" % (basepath + PROFILE_COUNTS_EXT, basepath + PROFILE_MAP_EXT, basepath), file=sys.stderr)
+        exit(1)
+    frames = [[tuple(frame) for frame in op_frames] for op_frames in profile_map['ops']]
+    counts = [0] * len(frames)
+    for i, (start, end) in enumerate(blocks):
+        count = int.from_bytes(data[8 * i:8 * i + 8], 'little')
+        for ip in range(start, end):
+            counts[ip] = count
+    return frames, counts
+
+def profile_report(frames: List[List[ProfileFrame]], counts: List[int]) -> Tuple[List[str], List[str]]:
+    '''Lines of the text report and of the folded stacks.
+
+    The text report has a line for every source line with ops that ran:
+    `self` counts the runs of its ops, `total` also the ones of the ops
+    expanded from the macro uses and includes on it. The folded stacks are
+    the ones flamegraph.pl reads, with a frame for every expansion.
+    '''
+    total_runs = sum(counts)
+    self_runs: Dict[Tuple[str, int], int] = {}
+    total_runs_by_line: Dict[Tuple[str, int], int] = {}
+    stacks: Dict[str, int] = {}
+    for op_frames, count in zip(frames, counts):
+        if count == 0:
+            continue
+        file_path, row, _, _ = op_frames[-1]
+        self_runs[(file_path, row)] = self_runs.get((file_path, row), 0) + count
+        for line in {(frame[0], frame[1]) for frame in op_frames}:
+            total_runs_by_line[line] = total_runs_by_line.get(line, 0) + count
+        stack = ';'.join("%s (%s:%d)" % (text.replace(';', ','), file_path, row) for file_path, row, _, text in op_frames)
+        stacks[stack] = stacks.get(stack, 0) + count
+
+    sources: Dict[str, List[str]] = {}
+    def source_line(file_path: str, row: int) -> str:
+        if file_path not in sources:
+            try:
+                with open(file_path) as f:
+                    sources[file_path] = f.read().splitlines()
+            except (OSError, UnicodeDecodeError):
+                sources[file_path] = []
+        lines = sources[file_path]
+        return lines[row - 1].strip() if 0 < row <= len(lines) else ''
+
+    def percent(runs: int) -> float:
+        return runs / total_runs * 100 if total_runs > 0 else 0.0
+
+    report = ["%d op runs" % total_runs, "%12s %7s %12s %7s  %s" % ('total', '', 'self', '', 'location')]
+    for line in sorted(total_runs_by_line, key=lambda line: (-total_runs_by_line[line], line)):
+        total, self = total_runs_by_line[line], self_runs.get(line, 0)
+        report.append("%12d %6.2f%% %12d %6.2f%%  %s:%d  %s" % (total, percent(total), self, percent(self), *line, source_line(*line)))
+    folded = ["%s %d" % (stack, count) for stack, count in sorted(stacks.items())]
+    return report, folded
+
+def write_profile_report(frames: List[List[ProfileFrame]], counts: List[int], basepath: str):
+    report, folded = profile_report(frames, counts)
+    for ext, lines in [(PROFILE_REPORT_EXT, report), (PROFILE_FOLDED_EXT, folded)]:
+        with open(basepath + ext, 'w') as f:
+            f.write("\n".join(lines))
+            f.write("\n")
+        print("[INFO] Wrote %s" % (basepath + ext))